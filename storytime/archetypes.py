@@ -1,9 +1,14 @@
+from typing import Callable, Optional
+
+import functools
 import logging
 
 from storytime.character import Character
+from storytime.character_pool import CharacterPool
+from storytime.pipeline import produce_story
+from storytime.rng import Seed, derive_rng, new_seed
 from storytime.story import Story
 from storytime.time_period import TimePeriod
-from storytime.video import create_video
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,18 +28,45 @@ story_types = {
 def generate_story(
     story_type: str,
     with_images: bool,
+    deferred: bool = False,
+    seed: Optional[int] = None,
+    plan_only: bool = False,
+    character_pool: Optional[CharacterPool] = None,
 ) -> Story:
-    """Generates a story from the archetype."""
+    """Generates a story from the archetype.
+
+    A deferred story is only planned, ready to be written by a pipeline.
+    The same seed generates the same plan for the story. A plan_only story
+    makes no requests at all until it's rendered. Characters are taken from
+    character_pool, if given, instead of being made for the story.
+    """
+    if seed is None:
+        seed = new_seed()
+    rng = derive_rng(seed, "archetype")
     if story_type == "fairy tale":
-        time_period = TimePeriod(era="Medieval")
+        time_period = TimePeriod(era="Medieval", seed=rng)
         characters = {
-            "protagonist": generate_character("princess"),
-            "antagonist": generate_character("witch"),
-            "deuteragonist": generate_character("prince"),
-            "confidante": generate_character("wizard"),
-            "love interest": generate_character("knight"),
-            "foil": generate_character("queen"),
-            "tertiary 1": generate_character("king"),
+            "protagonist": generate_character(
+                "princess", rng, deferred=True, character_pool=character_pool
+            ),
+            "antagonist": generate_character(
+                "witch", rng, deferred=True, character_pool=character_pool
+            ),
+            "deuteragonist": generate_character(
+                "prince", rng, deferred=True, character_pool=character_pool
+            ),
+            "confidante": generate_character(
+                "wizard", rng, deferred=True, character_pool=character_pool
+            ),
+            "love interest": generate_character(
+                "knight", rng, deferred=True, character_pool=character_pool
+            ),
+            "foil": generate_character(
+                "queen", rng, deferred=True, character_pool=character_pool
+            ),
+            "tertiary 1": generate_character(
+                "king", rng, deferred=True, character_pool=character_pool
+            ),
         }
         story = Story(
             target_audience="children",
@@ -47,17 +79,38 @@ def generate_story(
             with_images=with_images,
             medium="digital art",
             style="pixar",
+            deferred=deferred,
+            seed=seed,
+            plan_only=plan_only,
+            character_pool=character_pool,
         )
     elif story_type == "science fiction comedy":
-        time_period = TimePeriod(era="Future")
+        time_period = TimePeriod(era="Future", seed=rng)
         characters = {
-            "protagonist": generate_character("ensign"),
-            "antagonist": generate_character("captain"),
-            "deuteragonist": generate_character("engineer"),
-            "confidante": generate_character("chief medical officer"),
-            "love interest": generate_character("lieutenant"),
-            "foil": generate_character("technician"),
-            "tertiary 1": generate_character("crewman"),
+            "protagonist": generate_character(
+                "ensign", rng, deferred=True, character_pool=character_pool
+            ),
+            "antagonist": generate_character(
+                "captain", rng, deferred=True, character_pool=character_pool
+            ),
+            "deuteragonist": generate_character(
+                "engineer", rng, deferred=True, character_pool=character_pool
+            ),
+            "confidante": generate_character(
+                "chief medical officer",
+                rng,
+                deferred=True,
+                character_pool=character_pool,
+            ),
+            "love interest": generate_character(
+                "lieutenant", rng, deferred=True, character_pool=character_pool
+            ),
+            "foil": generate_character(
+                "technician", rng, deferred=True, character_pool=character_pool
+            ),
+            "tertiary 1": generate_character(
+                "crewman", rng, deferred=True, character_pool=character_pool
+            ),
         }
         story = Story(
             target_audience="teenagers",
@@ -70,19 +123,40 @@ def generate_story(
             with_images=with_images,
             medium="digital art",
             style="photorealistic",
+            deferred=deferred,
+            seed=seed,
+            plan_only=plan_only,
+            character_pool=character_pool,
         )
     else:
         logger.error(
             f"Story type: {story_type} not found. Generating random " f"story."
         )
-        story = Story()
+        story = Story(
+            deferred=deferred,
+            seed=seed,
+            plan_only=plan_only,
+            character_pool=character_pool,
+        )
     return story
 
 
-def generate_character(character_type: str) -> Character:
-    """Generates a character from the archetype."""
+def generate_character(
+    character_type: str,
+    seed: Seed = None,
+    deferred: bool = False,
+    character_pool: Optional[CharacterPool] = None,
+) -> Character:
+    """Generates a character from the archetype.
+
+    The character is taken from character_pool instead, if one is given.
+    """
+    if character_pool is not None:
+        make: Callable[..., Character] = character_pool.take
+    else:
+        make = functools.partial(Character, seed=seed, deferred=deferred)
     if character_type == "princess":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Female",
@@ -90,7 +164,7 @@ def generate_character(character_type: str) -> Character:
             occupation="princess",
         )
     elif character_type == "prince":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Male",
@@ -98,7 +172,7 @@ def generate_character(character_type: str) -> Character:
             occupation="prince",
         )
     elif character_type == "king":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Male",
@@ -106,7 +180,7 @@ def generate_character(character_type: str) -> Character:
             occupation="king",
         )
     elif character_type == "queen":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Female",
@@ -114,7 +188,7 @@ def generate_character(character_type: str) -> Character:
             occupation="queen",
         )
     elif character_type == "wizard":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Male",
@@ -122,7 +196,7 @@ def generate_character(character_type: str) -> Character:
             occupation="wizard",
         )
     elif character_type == "witch":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Female",
@@ -130,7 +204,7 @@ def generate_character(character_type: str) -> Character:
             occupation="witch",
         )
     elif character_type == "knight":
-        character = Character(
+        character = make(
             era="Medieval",
             ethnicity="old-english",
             gender="Male",
@@ -138,7 +212,7 @@ def generate_character(character_type: str) -> Character:
             occupation="knight",
         )
     elif character_type == "ensign":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="spanish",
             gender="Male",
@@ -146,7 +220,7 @@ def generate_character(character_type: str) -> Character:
             occupation="ensign",
         )
     elif character_type == "captain":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="german",
             gender="Male",
@@ -154,7 +228,7 @@ def generate_character(character_type: str) -> Character:
             occupation="captain",
         )
     elif character_type == "engineer":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="hindi",
             gender="Female",
@@ -162,7 +236,7 @@ def generate_character(character_type: str) -> Character:
             occupation="engineer",
         )
     elif character_type == "chief medical officer":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="korean",
             gender="Female",
@@ -170,7 +244,7 @@ def generate_character(character_type: str) -> Character:
             occupation="chief medical officer",
         )
     elif character_type == "lieutenant":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="swahili",
             gender="Female",
@@ -178,7 +252,7 @@ def generate_character(character_type: str) -> Character:
             occupation="lieutenant",
         )
     elif character_type == "technician":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="english",
             gender="Male",
@@ -186,7 +260,7 @@ def generate_character(character_type: str) -> Character:
             occupation="technician",
         )
     elif character_type == "crewman":
-        character = Character(
+        character = make(
             era="Future",
             ethnicity="japanese",
             gender="Male",
@@ -198,7 +272,7 @@ def generate_character(character_type: str) -> Character:
             f"Character type: {character_type} not found. Generating "
             f"random character."
         )
-        character = Character()
+        character = make()
     return character
 
 
@@ -206,9 +280,9 @@ if __name__ == "__main__":
     fairy_tale = generate_story(
         "science fiction comedy",
         with_images=True,
+        deferred=True,
     )
+    # Illustrate and narrate each scene as soon as it's written
+    produce_story(fairy_tale)
     fairy_tale.save_as_json()
-    fairy_tale.download_image_set()
-    fairy_tale.add_narration()
-    create_video(fairy_tale)
     print(fairy_tale)
@@ -0,0 +1,221 @@
+"""Produce many stories at once under one shared quota.
+
+Every story in a batch draws its text, image and speech requests from the
+same host-wide rate limiters, so raising the number of stories written at
+once raises throughput up to the quota and no further.
+
+Usage:
+    python -m storytime.batch "fairy tale" random --count 10 --with-images
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+from storytime import archetypes, gpt3
+from storytime.catalog import get_catalog
+from storytime.character_pool import CharacterPool
+from storytime.narrator import tts_rate_limiter
+from storytime.pipeline import STORY_WORKERS, Pipeline, Stage, StoryProducer
+from storytime.story import Story, get_save_path
+
+RANDOM_SPEC = "random"  # A story with nothing chosen in advance
+HOUR = 60 * 60
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def expand_specs(specs: Sequence[str], count: Optional[int]) -> List[str]:
+    """Repeat the story specs in turn until there are count of them."""
+    specs = list(specs) or [RANDOM_SPEC]
+    if count is None:
+        return specs
+    return [specs[i % len(specs)] for i in range(count)]
+
+
+def plan_story(
+    spec: str,
+    with_images: bool,
+    character_pool: Optional[CharacterPool] = None,
+) -> Story:
+    """Plan a story from an archetype, or a random one."""
+    if spec == RANDOM_SPEC:
+        return Story(
+            with_images=with_images,
+            deferred=True,
+            character_pool=character_pool,
+        )
+    if spec not in archetypes.story_types:
+        raise ValueError(f"Unknown story type: {spec}")
+    return archetypes.generate_story(
+        spec, with_images, deferred=True, character_pool=character_pool
+    )
+
+
+def run_batch(
+    specs: Sequence[str],
+    with_images: bool = False,
+    with_video: bool = False,
+    upload: bool = False,
+    concurrency: int = STORY_WORKERS,
+) -> Dict[str, Any]:
+    """Produce a story for each spec and report on how it went.
+
+    Args:
+        specs: Archetype name, or "random", for each story.
+        with_images: Whether to illustrate the stories.
+        with_video: Whether to render a video of each story.
+        upload: Whether to upload each video.
+        concurrency: Stories written at once.
+
+    Returns:
+        A summary of the stories produced, the failures, throughput, the
+        time spent in each stage and how often casts came from the pool.
+    """
+    # Stories in a batch aren't remade from their seeds, so their casts can
+    # be made ahead of time
+    character_pool = CharacterPool()
+    character_pool.warm()
+    producer = StoryProducer(
+        with_video=with_video,
+        upload=upload,
+        story_workers=concurrency,
+    )
+    plan = Stage(
+        "plan",
+        lambda spec: (plan_story(spec, with_images, character_pool), None),
+        concurrency,
+    )
+    save = Stage("save", save_story)
+    failures: List[Dict[str, str]] = []
+    failures_lock = threading.Lock()
+
+    def record_failure(stage: Stage, item: Any, error: Exception) -> None:
+        spec = item if isinstance(item, str) else item[0].title
+        with failures_lock:
+            failures.append(
+                {"story": spec, "stage": stage.name, "error": str(error)}
+            )
+
+    start = time.time()
+    produced = Pipeline([plan] + producer.stages() + [save]).run(
+        specs,
+        on_error=record_failure,
+    )
+    elapsed = time.time() - start
+    character_pool.close()
+    stages = {"plan": plan.stats()}
+    stages.update(producer.stats())
+    stages["save"] = save.stats()
+    return {
+        "started": start,
+        "seconds": elapsed,
+        "requested": len(specs),
+        "produced": len(produced),
+        "failed": len(failures),
+        "stories_per_hour": len(produced) * HOUR / elapsed if elapsed else 0,
+        "stories": produced,
+        "failures": failures,
+        "stages": stages,
+        "character_pool": character_pool.stats(),
+    }
+
+
+def save_story(item: Tuple[Story, Optional[str]]) -> Dict[str, Any]:
+    """Save a produced story, returning its entry for the report."""
+    story, video_file = item
+    file = story.save_as_json()
+    if video_file is not None:
+        get_catalog(get_save_path()).set_assets(file, video_file=video_file)
+    return {
+        "title": story.title,
+        "file": file,
+        "video": video_file,
+    }
+
+
+def set_quota(
+    text_rpm: Optional[float],
+    text_tpm: Optional[float],
+    image_rpm: Optional[float],
+    tts_rpm: Optional[float],
+) -> None:
+    """Override the starting limits shared by every story on this host."""
+    if text_rpm is not None or text_tpm is not None:
+        limiter = gpt3.text_rate_limiter()
+        rpm, tpm = limiter.limits()
+        limiter.set_limits(text_rpm or rpm, text_tpm or tpm)
+    if image_rpm is not None:
+        gpt3.image_rate_limiter().set_limits(image_rpm)
+    if tts_rpm is not None:
+        tts_rate_limiter().set_limits(tts_rpm)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Produce a batch of stories.",
+    )
+    parser.add_argument(
+        "specs",
+        nargs="*",
+        help=(
+            f"Story types to produce: one of "
+            f"{', '.join(archetypes.story_types)} or {RANDOM_SPEC}. "
+            f"Defaults to {RANDOM_SPEC}."
+        ),
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="Number of stories to produce, cycling through the specs.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=STORY_WORKERS,
+        help="Stories written at once.",
+    )
+    parser.add_argument("--with-images", action="store_true")
+    parser.add_argument("--video", action="store_true")
+    parser.add_argument("--upload", action="store_true")
+    parser.add_argument("--text-rpm", type=float)
+    parser.add_argument("--text-tpm", type=float)
+    parser.add_argument("--image-rpm", type=float)
+    parser.add_argument("--tts-rpm", type=float)
+    parser.add_argument(
+        "--report",
+        default="batch_report.json",
+        help="File to write the summary report to.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    set_quota(args.text_rpm, args.text_tpm, args.image_rpm, args.tts_rpm)
+    report = run_batch(
+        expand_specs(args.specs, args.count),
+        with_images=args.with_images or args.video,
+        with_video=args.video,
+        upload=args.upload,
+        concurrency=args.concurrency,
+    )
+    with open(args.report, "w") as write_file:
+        json.dump(report, write_file, indent=4)
+    logger.info(
+        f"Produced {report['produced']} of {report['requested']} stories "
+        f"in {report['seconds']:.0f}s, report written to {args.report}"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    main()
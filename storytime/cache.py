@@ -0,0 +1,316 @@
+"""Persistent, content-addressed cache for text and image responses.
+
+Responses are stored in a SQLite database keyed on a hash of everything that
+determines the response (service, model, prompt and sampling parameters), so
+re-running a story with the same parameters doesn't pay for the same requests
+again. Only deterministic calls, with a temperature of 0, are cached unless
+sampled ones are opted into, since caching those would give a rerun the same
+"random" text.
+
+Scraped pages get a cache of their own, keyed on their URL, that keeps what
+was parsed from each page along with the validators to revalidate it with.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_ENV = "STORYTIME_CACHE"  # Set to "0" to disable the cache
+# Set to "1" to also cache calls with a temperature above 0
+CACHE_SAMPLED_ENV = "STORYTIME_CACHE_SAMPLED"
+CACHE_DIR_ENV = "STORYTIME_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "storytime"
+)
+CACHE_FILENAME = "responses.sqlite3"
+DAY = 24 * 60 * 60
+DEFAULT_MAX_AGE = 30 * DAY
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+EVICT_EVERY = 100  # Writes between eviction passes
+PAGE_CACHE_FILENAME = "pages.sqlite3"
+PAGE_TTL_ENV = "STORYTIME_PAGE_TTL"  # Seconds before a page is revalidated
+DEFAULT_PAGE_TTL = DAY
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_dir() -> str:
+    """Returns the directory for storytime's persistent caches."""
+    return os.getenv(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+
+
+def cache_enabled() -> bool:
+    """Returns whether caching is enabled by the environment."""
+    return os.getenv(CACHE_ENV, "1") != "0"
+
+
+def cache_sampled_enabled() -> bool:
+    """Returns whether calls with a temperature above 0 may be cached."""
+    return os.getenv(CACHE_SAMPLED_ENV, "0") == "1"
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """Returns a stable hash of the parameters that determine a response."""
+    encoded = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite backed cache of responses with size and age based eviction."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_age: float = DEFAULT_MAX_AGE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        cache_sampled: bool = False,
+    ) -> None:
+        """Open (or create) the cache database.
+
+        Args:
+            path: Database file, defaults to the storytime cache directory.
+            max_age: Seconds after which an entry is evicted.
+            max_bytes: Total response size to keep, least recently used
+                entries beyond it are evicted.
+            cache_sampled: Whether to also cache calls with a temperature
+                above 0. Those responses are random, so by default they're
+                requested anew every time and only reruns that should repeat
+                the same text opt in.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), CACHE_FILENAME)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "kind TEXT NOT NULL, "
+                "response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created REAL NOT NULL, "
+                "accessed REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed "
+                "ON responses (accessed)"
+            )
+
+    def accepts(self, temp: Optional[float]) -> bool:
+        """Returns whether a call with this temperature may be cached."""
+        return self.cache_sampled or not temp
+
+    def get(
+        self,
+        params: Dict[str, Any],
+        max_age: Optional[float] = None,
+    ) -> Optional[str]:
+        """Returns the cached response for the parameters, if any.
+
+        Args:
+            params: Everything that determines the response.
+            max_age: Seconds a response stays valid for, if shorter than the
+                cache's max_age.
+
+        Returns:
+            The cached response, or None on a miss.
+        """
+        key = cache_key(params)
+        now = time.time()
+        oldest = now - min(max_age or self.max_age, self.max_age)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or row[1] < oldest:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                (now, key),
+            )
+            self.hits += 1
+        return str(row[0])
+
+    def set(self, params: Dict[str, Any], response: str) -> None:
+        """Stores the response for the parameters."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, kind, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    cache_key(params),
+                    str(params.get("kind", "")),
+                    response,
+                    len(response.encode("utf-8")),
+                    now,
+                    now,
+                ),
+            )
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Removes expired entries and trims the cache to max_bytes.
+
+        Returns:
+            The number of entries removed.
+        """
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM responses WHERE created < ?",
+                (time.time() - self.max_age,),
+            ).rowcount
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                stale = []
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany(
+                    "DELETE FROM responses WHERE key = ?", stale
+                )
+                removed += len(stale)
+        if removed:
+            logger.info(f"Evicted {removed} cached responses.")
+        return removed
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit and miss counts along with the size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class CachedPage(NamedTuple):
+    """What was parsed from a page, and how to tell if it has changed."""
+
+    results: List[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched: float  # When the page was last fetched or revalidated
+
+
+class PageCache:
+    """SQLite backed cache of the results parsed from scraped pages."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """Open (or create) the cache database.
+
+        Args:
+            path: Database file, defaults to the storytime cache directory.
+            ttl: Seconds a page is used without revalidating it, defaults
+                to STORYTIME_PAGE_TTL or a day.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), PAGE_CACHE_FILENAME)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        if ttl is None:
+            ttl = float(os.getenv(PAGE_TTL_ENV, DEFAULT_PAGE_TTL))
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, "
+                "results TEXT NOT NULL, "
+                "etag TEXT, "
+                "last_modified TEXT, "
+                "fetched REAL NOT NULL)"
+            )
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Returns the cached page, fresh or not, if there is one."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, etag, last_modified, fetched FROM pages "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedPage(json.loads(row[0]), row[1], row[2], row[3])
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        """Returns whether a page can be used without revalidating it."""
+        return time.time() - page.fetched < self.ttl
+
+    def set(
+        self,
+        url: str,
+        results: List[str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """Stores what was parsed from a page and its validators."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, results, etag, last_modified, fetched) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, json.dumps(results), etag, last_modified, time.time()),
+            )
+
+    def touch(self, url: str) -> None:
+        """Marks a page as fresh again after revalidating it."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pages SET fetched = ? WHERE url = ?",
+                (time.time(), url),
+            )
+
+    def clear(self) -> None:
+        """Removes every page from the cache."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages")
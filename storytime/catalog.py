@@ -0,0 +1,379 @@
+"""Indexed catalog of saved stories.
+
+Every saved story gets a row in a SQLite database next to the story files,
+indexed on the fields stories are looked up by, so finding every western for
+teenagers about loyalty doesn't mean decoding every story file.
+
+The text, summary and visual summary of every scene also go in a full-text
+index (SQLite FTS5), which StoryCatalog.search queries for reused names,
+repeated phrasings or words that shouldn't be there.
+"""
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from storytime import serialization
+
+CATALOG_FILENAME = "catalog.sqlite3"
+INDEXED_COLUMNS = [
+    "title",
+    "genre",
+    "target_audience",
+    "narrative_structure",
+    "era",
+]
+ASSET_COLUMNS = ["image_dir", "audio_dir", "video_file"]
+SNIPPET_TOKENS = 12  # Words of context around a search match
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def story_stats(data: Dict[str, Any]) -> Dict[str, int]:
+    """Count what went into generating an encoded story."""
+    scenes = [scene for act in data["acts"] for scene in act]
+    return {
+        "acts": len(data["acts"]),
+        "scenes": len(scenes),
+        "words": sum(
+            len(part.split())
+            for scene in scenes
+            for part in scene["scene_text"]
+        ),
+        "images": sum(
+            1
+            for url in data.get("image_set", {}).get("images", {}).values()
+            if url
+        ),
+        "narrations": len(data["narrated"]),
+    }
+
+
+class SceneHit(NamedTuple):
+    """A scene matching a full-text search."""
+
+    title: str
+    file: str
+    act_number: int
+    scene_number: int
+    snippet: str
+
+
+class StoryCatalog:
+    """SQLite index of story metadata, asset paths and generation stats."""
+
+    def __init__(self, path: str) -> None:
+        """Open (or create) the catalog database."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stories ("
+                "id INTEGER PRIMARY KEY, "
+                "file TEXT NOT NULL UNIQUE, "
+                "title TEXT NOT NULL, "
+                "subtitle TEXT, "
+                "synopsis TEXT NOT NULL, "
+                "genre TEXT NOT NULL, "
+                "target_audience TEXT NOT NULL, "
+                "narrative_structure TEXT NOT NULL, "
+                "era TEXT NOT NULL, "
+                "with_images INTEGER NOT NULL, "
+                "image_dir TEXT, "
+                "audio_dir TEXT, "
+                "video_file TEXT, "
+                "acts INTEGER NOT NULL, "
+                "scenes INTEGER NOT NULL, "
+                "words INTEGER NOT NULL, "
+                "images INTEGER NOT NULL, "
+                "narrations INTEGER NOT NULL, "
+                "updated REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS themes ("
+                "story_id INTEGER NOT NULL "
+                "REFERENCES stories (id) ON DELETE CASCADE, "
+                "theme TEXT NOT NULL, "
+                "PRIMARY KEY (theme, story_id))"
+            )
+            for column in INDEXED_COLUMNS:
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS stories_{column} "
+                    f"ON stories ({column})"
+                )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS scene_text USING fts5("
+                "story_id UNINDEXED, act_number UNINDEXED, "
+                "scene_number UNINDEXED, text, summary, visual)"
+            )
+            # FTS5 can't index story_id, so the rows of each story's scenes
+            # are kept here to delete them by rowid instead of by a full scan
+            indexed = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'scenes'"
+            ).fetchone()
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scenes ("
+                "scene_rowid INTEGER PRIMARY KEY, "
+                "story_id INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS scenes_story_id "
+                "ON scenes (story_id)"
+            )
+            if indexed is None:
+                self._conn.execute(
+                    "INSERT INTO scenes (scene_rowid, story_id) "
+                    "SELECT rowid, story_id FROM scene_text"
+                )
+
+    def add_story(
+        self,
+        data: Dict[str, Any],
+        file: str,
+        assets: Optional[Dict[str, Optional[str]]] = None,
+    ) -> None:
+        """Add or update a story in the catalog.
+
+        Args:
+            data: The story in the story schema.
+            file: Where the story is saved, which identifies it.
+            assets: Paths of the story's image directory, audio directory and
+                video file, if known.
+        """
+        file = os.path.abspath(file)
+        assets = assets or {}
+        stats = story_stats(data)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM stories WHERE file = ?", (file,)
+            ).fetchone()
+            values = {
+                "file": file,
+                "title": data["title"],
+                "subtitle": data["subtitle"],
+                "synopsis": data["synopsis"],
+                "genre": data["genre"],
+                "target_audience": data["target_audience"],
+                "narrative_structure": data["narrative_structure"],
+                "era": data["time_period"]["era"],
+                "with_images": int(data["with_images"]),
+                "updated": time.time(),
+            }
+            values.update(stats)
+            for column in ASSET_COLUMNS:
+                if assets.get(column) is not None:
+                    values[column] = assets[column]
+            if row is None:
+                cursor = self._conn.execute(
+                    f"INSERT INTO stories ({', '.join(values)}) "
+                    f"VALUES ({', '.join('?' for _ in values)})",
+                    list(values.values()),
+                )
+                story_id = cursor.lastrowid
+            else:
+                story_id = row["id"]
+                self._conn.execute(
+                    f"UPDATE stories SET "
+                    f"{', '.join(f'{column} = ?' for column in values)} "
+                    f"WHERE id = ?",
+                    list(values.values()) + [story_id],
+                )
+                self._conn.execute(
+                    "DELETE FROM themes WHERE story_id = ?", (story_id,)
+                )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO themes (story_id, theme) VALUES (?, ?)",
+                [(story_id, theme) for theme in data["themes"]],
+            )
+            self._index_scenes(story_id, data)
+
+    def _index_scenes(self, story_id: int, data: Dict[str, Any]) -> None:
+        """Replace a story's scenes in the full-text index."""
+        self._unindex_scenes(story_id)
+        for act_number, act in enumerate(data["acts"], 1):
+            for scene_number, scene in enumerate(act, 1):
+                cursor = self._conn.execute(
+                    "INSERT INTO scene_text (story_id, act_number, "
+                    "scene_number, text, summary, visual) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        story_id,
+                        act_number,
+                        scene_number,
+                        "\n".join(scene["scene_text"]),
+                        scene["scene_summary"],
+                        scene["scene_visual"],
+                    ),
+                )
+                self._conn.execute(
+                    "INSERT INTO scenes (scene_rowid, story_id) VALUES (?, ?)",
+                    (cursor.lastrowid, story_id),
+                )
+
+    def _unindex_scenes(self, story_id: int) -> None:
+        """Remove a story's scenes from the full-text index."""
+        self._conn.execute(
+            "DELETE FROM scene_text WHERE rowid IN "
+            "(SELECT scene_rowid FROM scenes WHERE story_id = ?)",
+            (story_id,),
+        )
+        self._conn.execute(
+            "DELETE FROM scenes WHERE story_id = ?", (story_id,)
+        )
+
+    def set_assets(self, file: str, **paths: Optional[str]) -> None:
+        """Record where a story's assets are, e.g. video_file="story.mp4"."""
+        unknown = set(paths) - set(ASSET_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown asset: {', '.join(sorted(unknown))}")
+        if not paths:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE stories SET "
+                f"{', '.join(f'{column} = ?' for column in paths)} "
+                f"WHERE file = ?",
+                list(paths.values()) + [os.path.abspath(file)],
+            )
+
+    def remove(self, file: str) -> None:
+        """Remove a story from the catalog."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM stories WHERE file = ?",
+                (os.path.abspath(file),),
+            ).fetchone()
+            if row is None:
+                return
+            self._unindex_scenes(row["id"])
+            self._conn.execute(
+                "DELETE FROM stories WHERE id = ?", (row["id"],)
+            )
+
+    def find(
+        self,
+        theme: Optional[str] = None,
+        limit: Optional[int] = None,
+        **fields: str,
+    ) -> List[Dict[str, Any]]:
+        """Returns the stories matching every given field, newest first.
+
+        Args:
+            theme: A theme the stories must have.
+            limit: Most stories to return.
+            fields: Values for any of title, genre, target_audience,
+                narrative_structure and era.
+        """
+        unknown = set(fields) - set(INDEXED_COLUMNS)
+        if unknown:
+            raise ValueError(f"Can't search by: {', '.join(sorted(unknown))}")
+        query = "SELECT stories.* FROM stories"
+        conditions = [f"stories.{column} = ?" for column in fields]
+        params: List[Any] = list(fields.values())
+        if theme is not None:
+            query += " JOIN themes ON themes.story_id = stories.id"
+            conditions.append("themes.theme = ?")
+            params.append(theme)
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += " ORDER BY stories.updated DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            themes = self._themes([row["id"] for row in rows])
+        return [dict(row, themes=themes.get(row["id"], [])) for row in rows]
+
+    def search(self, query: str, limit: int = 20) -> List[SceneHit]:
+        """Returns the scenes best matching a full-text search.
+
+        Args:
+            query: FTS5 query, e.g. 'Cerelia', '"dark and stormy"' or
+                'dragon NOT fire'.
+            limit: Most scenes to return.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stories.title, stories.file, "
+                "scene_text.act_number, scene_text.scene_number, "
+                "snippet(scene_text, -1, '[', ']', '...', ?) "
+                "FROM scene_text "
+                "JOIN stories ON stories.id = scene_text.story_id "
+                "WHERE scene_text MATCH ? ORDER BY rank LIMIT ?",
+                (SNIPPET_TOKENS, query, limit),
+            ).fetchall()
+        return [SceneHit(*row) for row in rows]
+
+    def _themes(self, story_ids: Iterable[int]) -> Dict[int, List[str]]:
+        """Returns the themes of each story."""
+        story_ids = list(story_ids)
+        themes: Dict[int, List[str]] = {}
+        if not story_ids:
+            return themes
+        for story_id, theme in self._conn.execute(
+            f"SELECT story_id, theme FROM themes WHERE story_id IN "
+            f"({', '.join('?' for _ in story_ids)})",
+            story_ids,
+        ):
+            themes.setdefault(story_id, []).append(theme)
+        return themes
+
+    def count(self) -> int:
+        """Returns the number of stories in the catalog."""
+        with self._lock:
+            return int(
+                self._conn.execute("SELECT COUNT(*) FROM stories").fetchone()[
+                    0
+                ]
+            )
+
+    def add_directory(self, directory: str) -> int:
+        """Catalog every story file saved in a directory.
+
+        Files in the old jsonpickle format have to be migrated first and are
+        skipped, as are checkpoints.
+
+        Returns:
+            The number of stories added.
+        """
+        added = 0
+        for file in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            if file.endswith(".checkpoint.json"):
+                continue
+            data = serialization.read_story(file)
+            if serialization.is_jsonpickle(data):
+                logger.warning(f"Skipping {file}, it needs migrating.")
+                continue
+            serialization.check_schema(data)
+            self.add_story(data, file)
+            added += 1
+        return added
+
+
+_catalogs: Dict[str, StoryCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(directory: str) -> StoryCatalog:
+    """Returns the catalog of the stories saved in a directory."""
+    path = os.path.abspath(os.path.join(directory, CATALOG_FILENAME))
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = StoryCatalog(path)
+    return _catalogs[path]
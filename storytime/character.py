@@ -1,54 +1,27 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-import random
-
-import requests
-from bs4 import BeautifulSoup
+from storytime.corpus import get_corpus
+from storytime.rng import Seed, get_rng
 
 STORYGEN_URL = "https://storygen.page/character/"
-REEDSY_BASE_URL = "https://blog.reedsy.com/character-name-generator/"
 CHARACTER_GEN_URL = "https://www.character-generator.org.uk/"
-JOB_BASE_URL = "https://www.onetonline.org/explore/interests/"
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/68.0.3440.84 Safari/537.36",
-    "accept": "text/html,application/xhtml+xml,"
-    "application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
-}
 
 
-def random_occupation(job_interests: List[str]) -> str:
+def random_occupation(job_interests: List[str], seed: Seed = None) -> str:
     """Set the occupation of the character."""
-    url = (
-        f"{JOB_BASE_URL}{job_interests[0]}/{job_interests[1]}/"
-        f"{job_interests[2]}/"
-    )
-    r = requests.get(url, headers=HEADERS)
-    soup = BeautifulSoup(r.text, "html.parser")
-    jobs = soup.findAll("td", {"data-title": "Occupation"})
-    return str(random.choice(jobs).find("a").text.strip("s"))
+    return get_corpus().random_occupation(job_interests, get_rng(seed))
 
 
-def random_fullname(ethnicity: str, gender: str, tp_param: str) -> str:
+def random_fullname(
+    ethnicity: str,
+    gender: str,
+    tp_param: str,
+    seed: Seed = None,
+) -> str:
     """Generate a random full name for the character."""
-    url = (
-        f"{REEDSY_BASE_URL}{tp_param}/{ethnicity}/?filter="
-        f"{gender}&commit=Generate%20names"
+    return get_corpus().random_fullname(
+        ethnicity, gender, tp_param, get_rng(seed)
     )
-    r = requests.get(url, headers=HEADERS)
-    soup = BeautifulSoup(r.text, "html.parser")
-    nc = soup.find("div", {"id": "names-container"})
-    # Name
-    if nc is None:
-        print(f"Error with URL: {url}")
-        if gender == "Male":
-            fullname = "John Doe"
-        else:
-            fullname = "Jane Doe"
-    else:
-        fullname = nc.find("h3").text
-    return fullname
 
 
 class Character:
@@ -224,6 +197,32 @@ class Character:
         "Writer",
     ]
 
+    # What a character is saved as. The rest of its attributes follow from
+    # these, and the optional ones are only there for some characters
+    saved_fields = [
+        "era",
+        "ethnicity",
+        "gender",
+        "fullname",
+        "age",
+        "height",
+        "weight",
+        "face_type",
+        "personality",
+        "values",
+        "job_interests",
+        "social_class",
+        "education",
+        "occupation",
+    ]
+    optional_fields = [
+        "hair_color",
+        "eye_color",
+        "skin_tone",
+        "name_lookup",
+        "occupation_lookup",
+    ]
+
     def __init__(
         self,
         era: Optional[str] = None,
@@ -232,11 +231,19 @@ class Character:
         fullname: Optional[str] = None,
         age: Optional[int] = None,
         occupation: Optional[str] = None,
+        seed: Seed = None,
+        deferred: bool = False,
     ) -> None:
+        """Generate a character, picking whatever isn't provided.
+
+        A deferred character doesn't pick its name or occupation until
+        resolve() is called, and goes by John or Jane Doe until then.
+        """
+        rng = get_rng(seed)
         self.era = era
         # Select a random ethnicity if none is provided
         if ethnicity is None:
-            self.ethnicity = random.choice(self.ethnicities)
+            self.ethnicity = rng.choice(self.ethnicities)
         else:
             self.ethnicity = ethnicity
         # Set era-specific values
@@ -273,52 +280,46 @@ class Character:
             max_age = 100
         # Set a random gender and pronoun if none provided
         if gender is None:
-            self.gender = random.choice(self.genders)
+            self.gender = rng.choice(self.genders)
         else:
             self.gender = gender
         self.pronoun = "He" if self.gender == "Male" else "She"
         # Set a random name if none is provided
         if fullname is None:
-            self.fullname = random_fullname(
-                self.ethnicity, self.gender, tp_param
-            )
-        else:
-            self.fullname = fullname
-        if (
-            self.ethnicity == "chinese"
-            or self.ethnicity == "japanese"
-            or self.ethnicity == "korean"
-        ):
-            self.firstname = self.fullname.split(" ")[-1]
-            self.lastname = self.fullname.split(" ")[0]
-        elif self.ethnicity == "old-norse":
-            self.firstname = self.fullname.split(" ")[0]
-            self.lastname = ""
-        else:
-            self.firstname = self.fullname.split(" ")[0]
-            self.lastname = self.fullname.split(" ")[1]
-        self.name = self.firstname
+            # Its own seed, like the occupation's
+            name_lookup = [
+                self.ethnicity,
+                self.gender,
+                tp_param,
+                rng.getrandbits(32),
+            ]
+            if deferred:
+                self.name_lookup = name_lookup
+                fullname = "John Doe" if self.gender == "Male" else "Jane Doe"
+            else:
+                fullname = random_fullname(*name_lookup)
+        self.set_name(fullname)
         # Set a random age if none provided
         if age is None:
-            self.age = random.randint(5, max_age)
+            self.age = rng.randint(5, max_age)
         else:
             self.age = age
 
         # Height
-        self.height = random.choice(self.heights)
+        self.height = rng.choice(self.heights)
         # Weight
-        self.weight = random.choice(self.weights)
+        self.weight = rng.choice(self.weights)
         # Face type
-        self.face_type = random.choice(self.face_types)
+        self.face_type = rng.choice(self.face_types)
         # Appearance
         if (
             self.ethnicity == "chinese"
             or self.ethnicity == "japanese"
             or self.ethnicity == "korean"
         ):
-            self.hair_color = random.choice(["black", "brown"])
-            self.eye_color = random.choice(["black", "brown"])
-            self.skin_tone = random.choice(["olive", "light brown", "beige"])
+            self.hair_color = rng.choice(["black", "brown"])
+            self.eye_color = rng.choice(["black", "brown"])
+            self.skin_tone = rng.choice(["olive", "light brown", "beige"])
         elif (
             self.ethnicity == "english"
             or self.ethnicity == "german"
@@ -328,13 +329,13 @@ class Character:
             or self.ethnicity == "old-norse"
         ):
             if self.age > 60:
-                self.hair_color = random.choice(["white", "grey"])
+                self.hair_color = rng.choice(["white", "grey"])
             else:
-                self.hair_color = random.choice(["brown", "blonde", "red"])
-            self.eye_color = random.choice(
+                self.hair_color = rng.choice(["brown", "blonde", "red"])
+            self.eye_color = rng.choice(
                 ["brown", "blue", "green", "grey", "hazel"]
             )
-            self.skin_tone = random.choice(
+            self.skin_tone = rng.choice(
                 ["ivory", "porcelain", "alabaster", "beige", "light"]
             )
         elif (
@@ -343,13 +344,13 @@ class Character:
             or self.ethnicity == "old-roman"
         ):
             if self.age > 60:
-                self.hair_color = random.choice(["white", "grey"])
+                self.hair_color = rng.choice(["white", "grey"])
             else:
-                self.hair_color = random.choice(["brown", "black"])
-            self.eye_color = random.choice(
+                self.hair_color = rng.choice(["brown", "black"])
+            self.eye_color = rng.choice(
                 ["brown", "blue", "green", "grey", "hazel"]
             )
-            self.skin_tone = random.choice(
+            self.skin_tone = rng.choice(
                 ["sienna", "honey", "tan", "olive", "almond", "bronze"]
             )
         elif (
@@ -358,59 +359,57 @@ class Character:
             or self.ethnicity == "turkish"
         ):
             if self.age > 60:
-                self.hair_color = random.choice(["white", "grey"])
+                self.hair_color = rng.choice(["white", "grey"])
             else:
-                self.hair_color = random.choice(["black", "brown"])
-            self.eye_color = random.choice(["black", "brown"])
-            self.skin_tone = random.choice(
+                self.hair_color = rng.choice(["black", "brown"])
+            self.eye_color = rng.choice(["black", "brown"])
+            self.skin_tone = rng.choice(
                 ["olive", "chestnut", "praline", "honey", "caramel", "almond"]
             )
         elif self.ethnicity == "swahili":
             if self.age > 60:
-                self.hair_color = random.choice(["white", "grey"])
+                self.hair_color = rng.choice(["white", "grey"])
             else:
-                self.hair_color = random.choice(["black", "brown"])
-            self.eye_color = random.choice(["black", "brown"])
-            self.skin_tone = random.choice(
+                self.hair_color = rng.choice(["black", "brown"])
+            self.eye_color = rng.choice(["black", "brown"])
+            self.skin_tone = rng.choice(
                 ["black", "cacao", "sable", "espresso", "ebony", "mahogany"]
             )
         # Psychology
         # Personality
         self.personality = {}
         for factor in self.personality_factors:
-            self.personality[factor] = random.choice(
+            self.personality[factor] = rng.choice(
                 ["not very", "a little", "moderately", "often", "very"]
             )
         # Values
-        self.values = random.sample(self.value_list, 3)
+        self.values = rng.sample(self.value_list, 3)
 
         # Interests
-        self.job_interests = random.sample(self.interest_areas, 3)
+        self.job_interests = rng.sample(self.interest_areas, 3)
 
         # Background
         # Social Class
-        self.social_class = random.choice(["lower", "middle", "upper"])
+        self.social_class = rng.choice(["lower", "middle", "upper"])
         # Education and Occupation
         if self.era == "Prehistoric":
             self.education = "minimal"
-            self.occupation = random.choice(["Hunter", "Gatherer"])
+            self.occupation = rng.choice(["Hunter", "Gatherer"])
         elif self.era == "Ancient":
             self.education = "minimal"
-            self.occupation = random.choice(
+            self.occupation = rng.choice(
                 ["Farmer", "Carpenter", "Smith", "Merchant"]
             )
         elif self.era == "Medieval":
-            self.education = random.choice(
-                ["minimal", "basic", "intermediate"]
-            )
-            self.occupation = random.choice(
+            self.education = rng.choice(["minimal", "basic", "intermediate"])
+            self.occupation = rng.choice(
                 ["Farmer", "Carpenter", "Smith", "Merchant", "Knight", "Noble"]
             )
         elif self.era == "Renaissance":
-            self.education = random.choice(
+            self.education = rng.choice(
                 ["minimal", "basic", "intermediate", "advanced"]
             )
-            self.occupation = random.choice(
+            self.occupation = rng.choice(
                 [
                     "Farmer",
                     "Carpenter",
@@ -432,22 +431,94 @@ class Character:
                 self.education = "High School"
                 self.occupation = "Student"
             elif self.age <= 22:
-                self.education = random.choice(["College", "High School"])
-                self.occupation = random.choice(
-                    ["Student"] + self.generic_jobs
-                )
+                self.education = rng.choice(["College", "High School"])
+                self.occupation = rng.choice(["Student"] + self.generic_jobs)
             else:
-                self.education = random.choice(
+                self.education = rng.choice(
                     ["College", "High School", "Trade School", "Grad School"]
                 )
                 if self.era == "Contemporary":
-                    self.occupation = random_occupation(self.job_interests)
+                    # Its own seed, so the lookup can wait without changing
+                    # the rest of the character
+                    occupation_seed = rng.getrandbits(32)
+                    if deferred:
+                        self.occupation_lookup = [
+                            self.job_interests,
+                            occupation_seed,
+                        ]
+                        self.occupation = "Unemployed"
+                    else:
+                        self.occupation = random_occupation(
+                            self.job_interests, occupation_seed
+                        )
                 else:
-                    self.occupation = random.choice(self.generic_jobs)
+                    self.occupation = rng.choice(self.generic_jobs)
             if self.age > 65:
                 self.occupation = f"Retired {self.occupation}"
         if occupation is not None:
             self.occupation = occupation
+            self.__dict__.pop("occupation_lookup", None)
+
+    @classmethod
+    def generate_many(
+        cls,
+        n: int,
+        era: Optional[str] = None,
+        seed: Seed = None,
+        deferred: bool = False,
+    ) -> List["Character"]:
+        """Generate n characters of an era, e.g. a story's cast.
+
+        Each character draws from the same generator in turn, so a seed
+        makes the same cast as making the characters one after another.
+        """
+        rng = get_rng(seed)
+        return [cls(era, seed=rng, deferred=deferred) for _ in range(n)]
+
+    @classmethod
+    def restore(cls, fields: Dict[str, Any]) -> "Character":
+        """Rebuild a saved character from its fields, picking nothing new.
+
+        Args:
+            fields: Every one of saved_fields, and any of optional_fields
+                the character had.
+        """
+        character = cls.__new__(cls)
+        for field in cls.saved_fields + cls.optional_fields:
+            if field in fields:
+                setattr(character, field, fields[field])
+        character.pronoun = "He" if character.gender == "Male" else "She"
+        character.set_name(character.fullname)
+        return character
+
+    def set_name(self, fullname: str) -> None:
+        """Set the character's full, first and last names."""
+        self.fullname = fullname
+        if (
+            self.ethnicity == "chinese"
+            or self.ethnicity == "japanese"
+            or self.ethnicity == "korean"
+        ):
+            self.firstname = self.fullname.split(" ")[-1]
+            self.lastname = self.fullname.split(" ")[0]
+        elif self.ethnicity == "old-norse":
+            self.firstname = self.fullname.split(" ")[0]
+            self.lastname = ""
+        else:
+            self.firstname = self.fullname.split(" ")[0]
+            self.lastname = self.fullname.split(" ")[1]
+        self.name = self.firstname
+
+    def resolve(self) -> None:
+        """Pick the name and occupation a deferred character is missing."""
+        name_lookup = self.__dict__.pop("name_lookup", None)
+        if name_lookup is not None:
+            self.set_name(random_fullname(*name_lookup))
+        occupation_lookup = self.__dict__.pop("occupation_lookup", None)
+        if occupation_lookup is not None:
+            self.occupation = random_occupation(*occupation_lookup)
+            if self.age > 65:
+                self.occupation = f"Retired {self.occupation}"
 
     def __str__(self) -> str:
         """Return a string representation of the character."""
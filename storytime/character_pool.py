@@ -0,0 +1,159 @@
+"""Characters made ahead of time, so stories can start without making any.
+
+A CharacterPool keeps a few characters, names and occupations already
+picked, for each kind it's been asked for: by era, ethnicity, gender and, for
+archetypes, age and occupation. Taking a character refills its bucket on a
+background thread once it runs low. Pooled characters aren't drawn from a
+story's seed, so only use a pool for stories that needn't be remade.
+"""
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import collections
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from storytime.character import Character
+from storytime.time_period import TimePeriod
+
+POOL_SIZE = 10  # Characters kept of each kind, enough for a story's cast
+REFILL_AT = 5  # Characters left of a kind when it starts refilling
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+# Era, ethnicity, gender, age and occupation, None for any
+PoolKey = Tuple[
+    Optional[str], Optional[str], Optional[str], Optional[int], Optional[str]
+]
+
+
+class CharacterPool:
+    """Characters made in the background, by the kind asked for."""
+
+    def __init__(
+        self,
+        size: int = POOL_SIZE,
+        refill_at: int = REFILL_AT,
+    ) -> None:
+        """Start an empty pool.
+
+        Args:
+            size: Characters to keep of each kind.
+            refill_at: Characters left of a kind when it's refilled.
+        """
+        self.size = size
+        self.refill_at = refill_at
+        self.hits = 0
+        self.misses = 0
+        self._buckets: Dict[PoolKey, Deque[Character]] = {}
+        self._refilling: Set[PoolKey] = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="character-pool"
+        )
+
+    def take(
+        self,
+        era: Optional[str] = None,
+        ethnicity: Optional[str] = None,
+        gender: Optional[str] = None,
+        age: Optional[int] = None,
+        occupation: Optional[str] = None,
+    ) -> Character:
+        """Returns a character of the kind, making one if there are none.
+
+        Once the pool is closed, what's left is still handed out, then
+        characters are made here instead of refilling in the background.
+        """
+        key = (era, ethnicity, gender, age, occupation)
+        with self._lock:
+            bucket = self._buckets.setdefault(key, collections.deque())
+            if bucket:
+                character: Optional[Character] = bucket.popleft()
+                self.hits += 1
+            else:
+                character = None
+                self.misses += 1
+            refill = not self._closed and len(bucket) <= self.refill_at
+        if refill:
+            self._refill_in_background(key)
+        if character is None:
+            character = self._make(key)
+        return character
+
+    def warm(self, eras: Iterable[str] = TimePeriod.eras) -> "Future[None]":
+        """Fill the pool with characters of any kind from each era.
+
+        Returns:
+            A future that's done once the pool is filled.
+        """
+        keys: List[PoolKey] = [(era, None, None, None, None) for era in eras]
+        return self._executor.submit(self._refill_all, keys)
+
+    def _refill_all(self, keys: List[PoolKey]) -> None:
+        """Fill the buckets of several kinds, one after another."""
+        for key in keys:
+            self._refill(key)
+
+    def _refill_in_background(self, key: PoolKey) -> None:
+        """Refill a bucket on the pool's thread, unless it already is."""
+        with self._lock:
+            if self._closed or key in self._refilling:
+                return
+            self._refilling.add(key)
+            self._executor.submit(self._refill, key)
+
+    def _refill(self, key: PoolKey) -> None:
+        """Make characters of a kind until its bucket is full."""
+        try:
+            while True:
+                with self._lock:
+                    bucket = self._buckets.setdefault(key, collections.deque())
+                    if len(bucket) >= self.size:
+                        return
+                character = self._make(key)
+                with self._lock:
+                    bucket.append(character)
+        except Exception as e:
+            logger.error(f"Could not refill the character pool: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    @staticmethod
+    def _make(key: PoolKey) -> Character:
+        """Make a character of a kind, with its name and occupation."""
+        era, ethnicity, gender, age, occupation = key
+        return Character(
+            era=era,
+            ethnicity=ethnicity,
+            gender=gender,
+            age=age,
+            occupation=occupation,
+        )
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the characters pooled and how often a take was a hit."""
+        with self._lock:
+            taken = self.hits + self.misses
+            return {
+                "pooled": sum(
+                    len(bucket) for bucket in self._buckets.values()
+                ),
+                "kinds": len(self._buckets),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / taken if taken else 0.0,
+            }
+
+    def close(self) -> None:
+        """Stop refilling the pool."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,372 @@
+"""Names and occupations for characters, bundled with the package.
+
+Characters used to scrape a name generator and an occupation database for
+every name and occupation. Now they're picked from a corpus in storytime/data
+that's loaded once and indexed by what they're picked by, so picking one
+makes no requests. build_corpus scrapes the same sites to add to the corpus,
+parsing each page once and keeping the results in a PageCache, so a page is
+only fetched again once it's a day old, and then only in full if it changed.
+"""
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from storytime.cache import PageCache, cache_enabled
+from storytime.extract import Selector, extract_text
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+NAMES_FILENAME = "names.json"
+OCCUPATIONS_FILENAME = "occupations.json"
+REEDSY_BASE_URL = "https://blog.reedsy.com/character-name-generator/"
+JOB_BASE_URL = "https://www.onetonline.org/explore/interests/"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/68.0.3440.84 Safari/537.36",
+    "accept": "text/html,application/xhtml+xml,"
+    "application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
+}
+# Holland (RIASEC) interest areas, by the letter occupations are coded with
+INTEREST_AREAS = {
+    "R": "Realistic",
+    "I": "Investigative",
+    "A": "Artistic",
+    "S": "Social",
+    "E": "Enterprising",
+    "C": "Conventional",
+}
+SCRAPE_WORKERS = 8  # Pages scraped at once, and connections kept open
+CHUNK_SIZE = 16 * 1024  # Bytes of a page parsed at a time
+# Where the results are on each site's pages
+NAMES_PATH = [Selector("div", (("id", "names-container"),)), Selector("h3")]
+OCCUPATIONS_PATH = [
+    Selector("td", (("data-title", "Occupation"),)),
+    Selector("a"),
+]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+_page_cache: Optional[PageCache] = None
+_page_cache_loaded = False
+_page_cache_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def interest_code(job_interests: Iterable[str]) -> str:
+    """Returns the Holland code for interest areas, e.g. 'RIC'."""
+    return "".join(interest[0].upper() for interest in job_interests)
+
+
+class Corpus:
+    """Names by ethnicity, gender and era, and occupations by interests."""
+
+    def __init__(
+        self,
+        names: Dict[str, Dict[str, dict]],
+        occupations: Dict[str, List[str]],
+    ) -> None:
+        """Index the corpus for picking from.
+
+        Args:
+            names: First and last names by era ('language' or 'medieval'),
+                then ethnicity. Last names can be by gender too.
+            occupations: Occupation titles by their Holland code.
+        """
+        self.names = names
+        self.first_names: Dict[Tuple[str, str, str], Tuple[str, ...]] = {}
+        self.last_names: Dict[Tuple[str, str, str], Tuple[str, ...]] = {}
+        self.family_first: Set[Tuple[str, str]] = set()
+        # Ethnicities with names in another era
+        self.eras: Dict[str, str] = {}
+        for tp_param, ethnicities in names.items():
+            for ethnicity, entry in ethnicities.items():
+                self.eras.setdefault(ethnicity, tp_param)
+                if entry.get("family_first"):
+                    self.family_first.add((tp_param, ethnicity))
+                for gender, first_names in entry["first"].items():
+                    key = (tp_param, ethnicity, gender)
+                    last_names = entry["last"]
+                    if isinstance(last_names, dict):
+                        last_names = last_names[gender]
+                    self.first_names[key] = tuple(first_names)
+                    self.last_names[key] = tuple(last_names)
+        # Occupations for every ordered choice of three interest areas,
+        # falling back to those sharing the first two, then the first one
+        self.occupations: Dict[str, Tuple[str, ...]] = {}
+        for letters in itertools.permutations(INTEREST_AREAS, 3):
+            code = "".join(letters)
+            for length in (3, 2, 1):
+                titles = tuple(
+                    title
+                    for other_code, other_titles in occupations.items()
+                    if other_code[:length] == code[:length]
+                    for title in other_titles
+                )
+                if titles:
+                    break
+            self.occupations[code] = titles
+
+    @classmethod
+    def load(cls, directory: str = DATA_DIR) -> "Corpus":
+        """Load the corpus saved in a directory."""
+        with open(
+            os.path.join(directory, NAMES_FILENAME), encoding="utf-8"
+        ) as f:
+            names = json.load(f)
+        with open(
+            os.path.join(directory, OCCUPATIONS_FILENAME), encoding="utf-8"
+        ) as f:
+            occupations = json.load(f)
+        return cls(names, occupations)
+
+    def random_fullname(
+        self,
+        ethnicity: str,
+        gender: str,
+        tp_param: str,
+        rng: random.Random,
+    ) -> str:
+        """Pick a full name, or John or Jane Doe if there aren't any."""
+        key = (tp_param, ethnicity, gender)
+        if key not in self.first_names and ethnicity in self.eras:
+            key = (self.eras[ethnicity], ethnicity, gender)
+        if key not in self.first_names:
+            logger.warning(f"No {gender} {ethnicity} names, using Doe.")
+            return "John Doe" if gender == "Male" else "Jane Doe"
+        first_name = rng.choice(self.first_names[key])
+        last_name = rng.choice(self.last_names[key])
+        if key[:2] in self.family_first:
+            return f"{last_name} {first_name}"
+        return f"{first_name} {last_name}"
+
+    def random_occupation(
+        self,
+        job_interests: Iterable[str],
+        rng: random.Random,
+    ) -> str:
+        """Pick an occupation for someone with the interests, in order."""
+        return rng.choice(self.occupations[interest_code(job_interests)])
+
+
+@functools.lru_cache(maxsize=None)
+def get_corpus() -> Corpus:
+    """Returns the bundled corpus, loading it the first time."""
+    return Corpus.load()
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """Returns the shared page cache, or None if caching is disabled."""
+    global _page_cache, _page_cache_loaded
+    with _page_cache_lock:
+        if not _page_cache_loaded:
+            _page_cache_loaded = True
+            if cache_enabled():
+                _page_cache = PageCache()
+    return _page_cache
+
+
+def set_page_cache(cache: Optional[PageCache]) -> None:
+    """Replaces the shared page cache, None disables caching."""
+    global _page_cache, _page_cache_loaded
+    with _page_cache_lock:
+        _page_cache = cache
+        _page_cache_loaded = True
+
+
+def get_session() -> requests.Session:
+    """Returns the session pages are scraped with, to reuse connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=SCRAPE_WORKERS
+            )
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def fetch_results(
+    url: str,
+    parse: Callable[[Iterable[bytes], str], List[str]],
+) -> List[str]:
+    """Returns what parse finds on a page, fetching it only when stale.
+
+    A stale page is revalidated with its ETag and Last-Modified, and only
+    parsed again if it has changed. The page is parsed from its raw bytes
+    as it downloads. Pages where nothing is found aren't cached, so they're
+    tried again next time.
+    """
+    cache = get_page_cache()
+    page = cache.get(url) if cache is not None else None
+    if page is not None and cache is not None and cache.is_fresh(page):
+        return page.results
+    headers = dict(HEADERS)
+    if page is not None:
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+    r = get_session().get(url, headers=headers, stream=True)
+    if page is not None and cache is not None and r.status_code == 304:
+        r.close()
+        cache.touch(url)
+        return page.results
+    download_seconds = 0.0
+
+    def timed_chunks() -> Iterator[bytes]:
+        """Yield the page's chunks, adding up the time spent waiting."""
+        nonlocal download_seconds
+        chunks = iter(r.iter_content(chunk_size=CHUNK_SIZE))
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            download_seconds += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    start = time.perf_counter()
+    try:
+        results = parse(timed_chunks(), r.encoding or "utf-8")
+    finally:
+        r.close()
+    # Parsing is interleaved with the download, so take the download out
+    parse_seconds = time.perf_counter() - start - download_seconds
+    logger.info(
+        f"Parsed {len(results)} results in {parse_seconds * 1000:.1f}ms "
+        f"(downloaded in {download_seconds * 1000:.1f}ms) from {url}"
+    )
+    if results and cache is not None:
+        cache.set(
+            url,
+            results,
+            r.headers.get("ETag"),
+            r.headers.get("Last-Modified"),
+        )
+    elif not results:
+        logger.warning(f"Nothing found at URL: {url}")
+    return results
+
+
+def parse_fullnames(chunks: Iterable[bytes], encoding: str) -> List[str]:
+    """Returns the full names on a Reedsy name generator page."""
+    return extract_text(chunks, NAMES_PATH, encoding, once=True)
+
+
+def parse_occupations(chunks: Iterable[bytes], encoding: str) -> List[str]:
+    """Returns the occupations on an O*NET interests page."""
+    titles = extract_text(chunks, OCCUPATIONS_PATH, encoding)
+    # O*NET titles are plural
+    return [title[:-1] if title.endswith("s") else title for title in titles]
+
+
+def scrape_fullnames(ethnicity: str, gender: str, tp_param: str) -> List[str]:
+    """Scrape a page of full names from the Reedsy name generator."""
+    url = (
+        f"{REEDSY_BASE_URL}{tp_param}/{ethnicity}/?filter="
+        f"{gender}&commit=Generate%20names"
+    )
+    return fetch_results(url, parse_fullnames)
+
+
+def scrape_occupations(code: str) -> List[str]:
+    """Scrape the occupations for a Holland code from O*NET."""
+    url = JOB_BASE_URL + "".join(
+        f"{INTEREST_AREAS[letter]}/" for letter in code
+    )
+    return fetch_results(url, parse_occupations)
+
+
+def build_corpus(directory: str = DATA_DIR) -> None:
+    """Add to the corpus in a directory by scraping the sites it came from.
+
+    Names are scraped for the eras, ethnicities and genders already in the
+    corpus, and added to the names there. Pages are scraped concurrently.
+    """
+    corpus = Corpus.load(directory)
+    names = corpus.names
+    name_keys = [
+        (ethnicity, gender, tp_param)
+        for tp_param, ethnicities in names.items()
+        for ethnicity, entry in ethnicities.items()
+        for gender in entry["first"]
+    ]
+    with open(
+        os.path.join(directory, OCCUPATIONS_FILENAME), encoding="utf-8"
+    ) as f:
+        occupations = json.load(f)
+    with ThreadPoolExecutor(
+        max_workers=SCRAPE_WORKERS, thread_name_prefix="scrape"
+    ) as executor:
+        scraped_names = executor.map(
+            lambda key: scrape_fullnames(*key), name_keys
+        )
+        scraped_occupations = executor.map(
+            scrape_occupations, corpus.occupations
+        )
+        for (ethnicity, gender, tp_param), fullnames in zip(
+            name_keys, scraped_names
+        ):
+            entry = names[tp_param][ethnicity]
+            parts = [
+                fullname.split(" ", 1)
+                for fullname in fullnames
+                if " " in fullname
+            ]
+            if entry.get("family_first"):
+                parts = [[given, family] for family, given in parts]
+            first_names = entry["first"][gender]
+            last_names = entry["last"]
+            if isinstance(last_names, dict):
+                last_names = last_names[gender]
+            for given, family in parts:
+                if given not in first_names:
+                    first_names.append(given)
+                if family not in last_names:
+                    last_names.append(family)
+        for code, scraped in zip(corpus.occupations, scraped_occupations):
+            titles = occupations.setdefault(code, [])
+            titles.extend(title for title in scraped if title not in titles)
+            if not titles:
+                del occupations[code]
+    for filename, data in [
+        (NAMES_FILENAME, names),
+        (OCCUPATIONS_FILENAME, occupations),
+    ]:
+        with open(
+            os.path.join(directory, filename), "w", encoding="utf-8"
+        ) as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+    get_corpus.cache_clear()
+
+
+if __name__ == "__main__":
+    build_corpus()
@@ -0,0 +1,136 @@
+"""Streaming extraction of text from scraped pages.
+
+Scraped pages are fed to an HTMLParser a chunk at a time as they download,
+and only the text of the elements asked for is kept, instead of building a
+tree of the whole page. When the text is all in one element, parsing stops
+as soon as that element ends.
+"""
+from typing import (
+    Counter,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import codecs
+import collections
+from html.parser import HTMLParser
+
+# Elements that never have an end tag
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+class Selector(NamedTuple):
+    """An element by its tag and some of its attributes, like CSS."""
+
+    tag: str
+    attrs: Tuple[Tuple[str, str], ...] = ()
+
+    def matches(
+        self, tag: str, attrs: List[Tuple[str, Optional[str]]]
+    ) -> bool:
+        """Returns whether an element has the tag and attributes."""
+        return tag == self.tag and all(attr in attrs for attr in self.attrs)
+
+
+class TextExtractor(HTMLParser):
+    """Collects the text of elements matching a path of selectors.
+
+    The path is read like a CSS descendant selector, so the path
+    [Selector("div", (("id", "names"),)), Selector("h3")] collects the text of
+    every h3 in the div with the id "names".
+    """
+
+    def __init__(self, path: Sequence[Selector], once: bool = False) -> None:
+        """Start extracting.
+
+        Args:
+            path: Selectors from the outermost element to the one whose text
+                is collected.
+            once: Whether the first element to match the outermost selector
+                is the only one, so parsing is done once it ends.
+        """
+        super().__init__(convert_charrefs=True)
+        self.path = path
+        self.once = once
+        self.done = False
+        self.results: List[str] = []
+        # Open elements and how many selectors of the path match so far
+        self._open: List[Tuple[str, int]] = []
+        self._open_tags: Counter[str] = collections.Counter()
+        self._text: List[str] = []
+
+    def handle_starttag(
+        self, tag: str, attrs: List[Tuple[str, Optional[str]]]
+    ) -> None:
+        """Note how much of the path an element completes."""
+        if self.done:
+            return
+        matched = self._open[-1][1] if self._open else 0
+        if matched < len(self.path) and self.path[matched].matches(tag, attrs):
+            matched += 1
+            if matched == len(self.path):
+                self._text = []
+        if tag not in VOID_ELEMENTS:
+            self._open.append((tag, matched))
+            self._open_tags[tag] += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        """Close an element, and any left open inside it."""
+        if self.done or not self._open_tags[tag]:
+            return
+        while self._open:
+            open_tag, matched = self._open.pop()
+            self._open_tags[open_tag] -= 1
+            parent_matched = self._open[-1][1] if self._open else 0
+            if matched == len(self.path) and parent_matched < matched:
+                self.results.append("".join(self._text).strip())
+            if self.once and matched == 1 and parent_matched == 0:
+                self.done = True
+            if open_tag == tag:
+                return
+
+    def handle_data(self, data: str) -> None:
+        """Keep text inside an element at the end of the path."""
+        if self._open and self._open[-1][1] == len(self.path):
+            self._text.append(data)
+
+
+def extract_text(
+    chunks: Iterable[bytes],
+    path: Sequence[Selector],
+    encoding: str = "utf-8",
+    once: bool = False,
+) -> List[str]:
+    """Returns the text of the elements matching a path, in page order.
+
+    Chunks are decoded and parsed as they come, so a page isn't decoded or
+    even downloaded past the end of what's wanted when once is set.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    extractor = TextExtractor(path, once=once)
+    for chunk in chunks:
+        extractor.feed(decoder.decode(chunk))
+        if extractor.done:
+            break
+    else:
+        extractor.feed(decoder.decode(b"", final=True))
+        extractor.close()
+    return extractor.results
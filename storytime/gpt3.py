@@ -1,16 +1,28 @@
-from typing import Optional
+from typing import Any, Callable, Coroutine, Dict, Optional, TypeVar
 
+import asyncio
+import functools
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import openai
-from backoff import expo, on_exception
-from ratelimit import RateLimitException, limits
+import requests
+
+from storytime.cache import ResponseCache, cache_enabled, cache_sampled_enabled
+from storytime.rate_limiter import RateLimiter, get_rate_limiter
+from storytime.tokens import MAX_TOKENS, MODEL, count_tokens
 
-MODEL = "text-davinci-003"  # For testing use: "text-curie-001"  #
-MAX_TOKENS = 2048
 MINUTE = 60
+TEXT_REQUESTS_PER_MINUTE = 50
+TEXT_TOKENS_PER_MINUTE = 150000
+IMAGE_REQUESTS_PER_MINUTE = 10
 MAX_IMAGE_PROMPT_LENGTH = 1000
+IMAGE_SIZE = "512x512"
+IMAGE_URL_TTL = 60 * MINUTE  # Generated image URLs expire after an hour
+MAX_CONCURRENT_REQUESTS = 32  # Requests in flight on the shared event loop
+MAX_TRIES = 8  # Attempts at a request that keeps getting rate limited
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +31,120 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_REQUESTS,
+    thread_name_prefix="gpt3",
+)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_response_cache: Optional[ResponseCache] = None
+_response_cache_loaded = False
+_response_cache_lock = threading.Lock()
+_rate_limit_hook_missing = False
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns the shared event loop, starting it in a background thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name="gpt3-event-loop",
+                daemon=True,
+            ).start()
+    return _loop
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """Runs a coroutine on the shared event loop and waits for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the shared response cache, or None if caching is disabled."""
+    global _response_cache, _response_cache_loaded
+    with _response_cache_lock:
+        if not _response_cache_loaded:
+            _response_cache_loaded = True
+            if cache_enabled():
+                _response_cache = ResponseCache(
+                    cache_sampled=cache_sampled_enabled()
+                )
+    return _response_cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Replaces the shared response cache, None disables caching."""
+    global _response_cache, _response_cache_loaded
+    with _response_cache_lock:
+        _response_cache = cache
+        _response_cache_loaded = True
+
+
+def text_rate_limiter() -> RateLimiter:
+    """Returns the limiter shared by all text requests on this host."""
+    return get_rate_limiter(
+        "text", TEXT_REQUESTS_PER_MINUTE, TEXT_TOKENS_PER_MINUTE
+    )
+
+
+def image_rate_limiter() -> RateLimiter:
+    """Returns the limiter shared by all image requests on this host."""
+    return get_rate_limiter("image", IMAGE_REQUESTS_PER_MINUTE)
+
+
+def _observe_rate_limits(
+    response: requests.Response,
+    *args: Any,
+    **kwargs: Any,
+) -> None:
+    """Retunes the rate limiters from the headers of an API response."""
+    if response.status_code >= 400:
+        return  # Failed requests are handled where their errors are raised
+    if "/images/" in response.url:
+        image_rate_limiter().observe(response.headers)
+    else:
+        text_rate_limiter().observe(response.headers)
+
+
+def _report_rate_limits() -> None:
+    """Has this thread's OpenAI session report rate limit headers.
+
+    openai 0.x doesn't expose the headers of successful responses, so this
+    hooks the per-thread session in its private api_requestor module. That
+    module is only known to work with the openai version pinned in
+    pyproject.toml; if it changes, the limiters keep their configured
+    limits and a warning is logged instead.
+    """
+    requestor = openai.api_requestor
+    if not hasattr(requestor, "_thread_context") or not hasattr(
+        requestor, "_make_session"
+    ):
+        global _rate_limit_hook_missing
+        if not _rate_limit_hook_missing:
+            _rate_limit_hook_missing = True
+            logger.warning(
+                f"openai {openai.version.VERSION} has no session to read rate "
+                f"limit headers from, using the configured limits."
+            )
+        return
+    context = requestor._thread_context
+    if not hasattr(context, "session"):
+        context.session = requestor._make_session()
+    hooks = context.session.hooks["response"]
+    if _observe_rate_limits not in hooks:
+        hooks.append(_observe_rate_limits)
+
+
+def estimate_tokens(prompt: str, max_tokens: Optional[int]) -> int:
+    """Estimates the tokens a completion counts against the token limit."""
+    return count_tokens(prompt) + (max_tokens or 0)
+
 
 def get_api_key_from_env() -> Optional[str]:
     """Returns API Key if available as environment variable."""
@@ -30,51 +156,227 @@ def get_api_key_from_env() -> Optional[str]:
     return os.getenv("OPENAI_API_KEY")
 
 
-@on_exception(expo, RateLimitException, max_tries=8)
-@limits(calls=50, period=MINUTE)
+def _create_completion(
+    prompt: str,
+    temp: Optional[float],
+    max_tokens: Optional[int],
+    top_p: Optional[float],
+) -> str:
+    """Sends a blocking request to the GPT-3 Completion service."""
+    openai.api_key = get_api_key_from_env()
+    _report_rate_limits()
+    response = openai.Completion.create(
+        engine=MODEL,
+        prompt=prompt,
+        temperature=temp,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        frequency_penalty=0,
+        presence_penalty=0,
+    )
+    return str(response["choices"][0]["text"])
+
+
+def _create_image(prompt: str) -> str:
+    """Sends a blocking request to the GPT-3 Image service."""
+    openai.api_key = get_api_key_from_env()
+    _report_rate_limits()
+    if len(prompt) > MAX_IMAGE_PROMPT_LENGTH:
+        prompt = prompt[:MAX_IMAGE_PROMPT_LENGTH]
+    response = openai.Image.create(
+        prompt=prompt,
+        n=1,
+        size=IMAGE_SIZE,
+    )
+    return str(response["data"][0]["url"])
+
+
+def _text_params(
+    prompt: str,
+    temp: Optional[float],
+    max_tokens: Optional[int],
+    top_p: Optional[float],
+) -> Dict[str, Any]:
+    """Returns everything that determines a completion, for caching."""
+    return {
+        "kind": "text",
+        "model": MODEL,
+        "prompt": prompt,
+        "temp": temp,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+    }
+
+
+def _image_params(prompt: str) -> Dict[str, Any]:
+    """Returns everything that determines an image, for caching."""
+    return {
+        "kind": "image",
+        "prompt": prompt[:MAX_IMAGE_PROMPT_LENGTH],
+        "size": IMAGE_SIZE,
+    }
+
+
+def _cache_lookup(
+    params: Dict[str, Any],
+    temp: Optional[float] = None,
+    max_age: Optional[float] = None,
+) -> Optional[str]:
+    """Returns a cached response for the request, if there is one."""
+    cache = get_response_cache()
+    if cache is None or not cache.accepts(temp):
+        return None
+    return cache.get(params, max_age=max_age)
+
+
+def _cache_store(
+    params: Dict[str, Any],
+    response: str,
+    temp: Optional[float] = None,
+) -> None:
+    """Caches a successful response."""
+    cache = get_response_cache()
+    if response and cache is not None and cache.accepts(temp):
+        cache.set(params, response)
+
+
+def _send(
+    limiter: RateLimiter,
+    tokens: int,
+    request: Callable[[], str],
+    description: str,
+) -> str:
+    """Sends a request within the rate limits, retrying when rate limited.
+
+    A rate limited response pauses the limiter for as long as the service
+    asks, so the retry waits for exactly that long.
+    """
+    for _ in range(MAX_TRIES):
+        limiter.acquire(tokens)
+        try:
+            return request()
+        except openai.error.RateLimitError as e:
+            logger.warning(e)
+            limiter.observe(e.headers, rate_limited=True)
+        except Exception as e:
+            logger.error(e)
+            logger.debug(description)
+            return ""
+    logger.error(f"Gave up after {MAX_TRIES} rate limited attempts.")
+    logger.debug(description)
+    return ""
+
+
+async def _asend(
+    limiter: RateLimiter,
+    tokens: int,
+    request: Callable[[], str],
+    description: str,
+) -> str:
+    """Asynchronous version of _send that runs the request on a thread."""
+    loop = asyncio.get_running_loop()
+    for _ in range(MAX_TRIES):
+        await limiter.aacquire(tokens)
+        try:
+            return await loop.run_in_executor(_executor, request)
+        except openai.error.RateLimitError as e:
+            logger.warning(e)
+            limiter.observe(e.headers, rate_limited=True)
+        except Exception as e:
+            logger.error(e)
+            logger.debug(description)
+            return ""
+    logger.error(f"Gave up after {MAX_TRIES} rate limited attempts.")
+    logger.debug(description)
+    return ""
+
+
+def _text_description(
+    prompt: str,
+    temp: Optional[float],
+    max_tokens: Optional[int],
+    top_p: Optional[float],
+) -> str:
+    """Describes a text request for log messages."""
+    return (
+        f" from: {prompt} with temp: {temp}, "
+        f" max_tokens: {max_tokens}, and top_p: {top_p}"
+    )
+
+
 def generate_text(
     prompt: str,
     temp: Optional[float] = 0.8,
     max_tokens: Optional[int] = int(MAX_TOKENS / 2),
     top_p: Optional[float] = 1,
 ) -> str:
-    """Sends request to GPT-3 Completion service and returns response."""
-    openai.api_key = get_api_key_from_env()
-    try:
-        response = openai.Completion.create(
-            engine=MODEL,
-            prompt=prompt,
-            temperature=temp,
-            max_tokens=max_tokens,
-            top_p=top_p,
-            frequency_penalty=0,
-            presence_penalty=0,
-        )
-        return str(response["choices"][0]["text"])
-    except Exception as e:
-        logger.error(e)
-        logger.debug(
-            f" from: {prompt} with temp: {temp}, "
-            f" max_tokens: {max_tokens}, and top_p: {top_p}"
+    """Returns a cached response or sends request to GPT-3 Completion."""
+    params = _text_params(prompt, temp, max_tokens, top_p)
+    text = _cache_lookup(params, temp)
+    if text is None:
+        text = _send(
+            text_rate_limiter(),
+            estimate_tokens(prompt, max_tokens),
+            functools.partial(
+                _create_completion, prompt, temp, max_tokens, top_p
+            ),
+            _text_description(prompt, temp, max_tokens, top_p),
         )
-        return ""
+        _cache_store(params, text, temp)
+    return text
 
 
-@on_exception(expo, RateLimitException, max_tries=8)
-@limits(calls=10, period=MINUTE)
 def generate_image(prompt: str) -> str:
-    """Sends request to GPT-3 Image service and returns response."""
-    openai.api_key = get_api_key_from_env()
-    if len(prompt) > MAX_IMAGE_PROMPT_LENGTH:
-        prompt = prompt[:MAX_IMAGE_PROMPT_LENGTH]
-    try:
-        response = openai.Image.create(
-            prompt=prompt,
-            n=1,
-            size="512x512",
+    """Returns a cached image URL or sends request to GPT-3 Image service."""
+    params = _image_params(prompt)
+    image_url = _cache_lookup(params, max_age=IMAGE_URL_TTL)
+    if image_url is None:
+        image_url = _send(
+            image_rate_limiter(),
+            0,
+            functools.partial(_create_image, prompt),
+            f" from: {prompt}",
+        )
+        _cache_store(params, image_url)
+    return image_url
+
+
+async def agenerate_text(
+    prompt: str,
+    temp: Optional[float] = 0.8,
+    max_tokens: Optional[int] = int(MAX_TOKENS / 2),
+    top_p: Optional[float] = 1,
+) -> str:
+    """Asynchronous version of generate_text.
+
+    Requests wait on the host-wide rate limiter and then run on a thread pool,
+    so many of them can be in flight at once.
+    """
+    params = _text_params(prompt, temp, max_tokens, top_p)
+    text = _cache_lookup(params, temp)
+    if text is None:
+        text = await _asend(
+            text_rate_limiter(),
+            estimate_tokens(prompt, max_tokens),
+            functools.partial(
+                _create_completion, prompt, temp, max_tokens, top_p
+            ),
+            _text_description(prompt, temp, max_tokens, top_p),
+        )
+        _cache_store(params, text, temp)
+    return text
+
+
+async def agenerate_image(prompt: str) -> str:
+    """Asynchronous version of generate_image."""
+    params = _image_params(prompt)
+    image_url = _cache_lookup(params, max_age=IMAGE_URL_TTL)
+    if image_url is None:
+        image_url = await _asend(
+            image_rate_limiter(),
+            0,
+            functools.partial(_create_image, prompt),
+            f" from: {prompt}",
         )
-        return str(response["data"][0]["url"])
-    except Exception as e:
-        logger.error(e)
-        logger.debug(f" from: {prompt}")
-        return ""
+        _cache_store(params, image_url)
+    return image_url
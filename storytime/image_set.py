@@ -1,13 +1,27 @@
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
 
-import random
+import asyncio
 
 import requests
 
-from storytime.gpt3 import generate_image
+from storytime.gpt3 import agenerate_image, generate_image, run_async
+from storytime.rng import Seed, get_rng
 from storytime.scene import Scene
 
 
+async def generate_images(prompts: List[str]) -> List[str]:
+    """Generates an image for each prompt concurrently."""
+    image_urls = await asyncio.gather(
+        *(agenerate_image(prompt) for prompt in prompts)
+    )
+    return list(image_urls)
+
+
+async def gather_all(coros: Iterable[Awaitable[Any]]) -> List[Any]:
+    """Awaits the coroutines concurrently."""
+    return list(await asyncio.gather(*coros))
+
+
 class ImageSet:
     """Set of images to accompany scenes in a story."""
 
@@ -77,32 +91,72 @@ class ImageSet:
         self,
         medium: Optional[str] = None,
         style: Optional[str] = None,
+        seed: Seed = None,
     ) -> None:
         """Initialize ImageSet class."""
+        rng = get_rng(seed)
         if medium is None:
-            self.medium = random.choice(self.art_mediums)
+            self.medium = rng.choice(self.art_mediums)
         else:
             self.medium = medium
         if style is None:
-            self.style = random.choice(self.art_styles)
+            self.style = rng.choice(self.art_styles)
         else:
             self.style = style
         self.images: Dict[str, str] = {}
 
-    def add_scene_image(self, label: str, scene: "Scene") -> None:
-        """Add a generated image to the ImageSet based on a scene."""
-        prompt = (
+    def scene_image_prompt(self, scene: "Scene") -> str:
+        """Describe a scene for the image generator."""
+        return (
             f"A {self.medium} scene with a {self.style} style. A "
             f"{scene.location.area} {scene.location.locale} at "
             f"{scene.time_period.time_of_day} in "
             f"{scene.time_period.season}. {scene.scene_visual}"
         )
-        self.images[label] = generate_image(prompt)
+
+    def add_scene_image(self, label: str, scene: "Scene") -> None:
+        """Add a generated image to the ImageSet based on a scene."""
+        self.images[label] = generate_image(self.scene_image_prompt(scene))
+
+    def add_scene_images(
+        self,
+        scenes: Dict[str, "Scene"],
+        on_image: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """Add generated images for many labeled scenes at once.
+
+        The images are requested concurrently but added in label order.
+        on_image, if given, is called with each label as its image arrives.
+        """
+
+        async def add_image(label: str, scene: "Scene") -> None:
+            # Wait for a visual summary still being written without blocking
+            # the event loop, which the other images share
+            await scene.ascene_visual()
+            self.images[label] = await agenerate_image(
+                self.scene_image_prompt(scene)
+            )
+            if on_image is not None:
+                on_image(label)
+
+        # Reserve each label's place so images keep their order as they arrive
+        for label in scenes:
+            self.images.setdefault(label, "")
+        run_async(
+            gather_all(
+                add_image(label, scene) for label, scene in scenes.items()
+            )
+        )
+
+    def save_image(self, label: str, save_dir: str) -> None:
+        """Save one image to disk."""
+        image_url = self.images.get(label)
+        if image_url is not None and len(image_url) > 0:
+            img_data = requests.get(image_url).content
+            with open(f"{save_dir}{label}.png", "wb") as handler:
+                handler.write(img_data)
 
     def save_images(self, save_dir: str) -> None:
         """Save images to disk."""
-        for label, image_url in self.images.items():
-            if image_url is not None and len(image_url) > 0:
-                img_data = requests.get(image_url).content
-                with open(f"{save_dir}{label}.png", "wb") as handler:
-                    handler.write(img_data)
+        for label in self.images:
+            self.save_image(label, save_dir)
@@ -1,6 +1,6 @@
 from typing import Optional
 
-import random
+from storytime.rng import Seed, get_rng
 
 LOCATION_GEN_URL = "http://storygen.weebly.com/location.html"
 
@@ -413,18 +413,20 @@ class Location:
         era: Optional[str] = None,
         area: Optional[str] = None,
         locale: Optional[str] = None,
+        seed: Seed = None,
     ):
         """Initialize the Area and Locale."""
+        rng = get_rng(seed)
         self.era = era
         available_areas = self.avail_areas()
         if area:
             self.area = area
         else:
-            self.area = random.choice(list(available_areas.keys()))
+            self.area = rng.choice(list(available_areas.keys()))
         if locale:
             self.locale = locale
         else:
-            self.locale = random.choice(available_areas[self.area])
+            self.locale = rng.choice(available_areas[self.area])
 
     def __str__(self) -> str:
         return f"{self.area}:{self.locale}"
@@ -453,8 +455,9 @@ class Location:
         return available_areas
 
     @classmethod
-    def new_locale(cls, location: "Location") -> "Location":
+    def new_locale(cls, location: "Location", seed: Seed = None) -> "Location":
         """Select a different locale in the area."""
+        rng = get_rng(seed)
         available_areas = cls.avail_areas(location)
         possible_locales = [
             v for v in available_areas[location.area] if v != location.locale
@@ -462,21 +465,22 @@ class Location:
         return cls(
             era=location.era,
             area=location.area,
-            locale=random.choice(possible_locales),
+            locale=rng.choice(possible_locales),
         )
 
     @classmethod
-    def new_area(cls, location: "Location") -> "Location":
+    def new_area(cls, location: "Location", seed: Seed = None) -> "Location":
         """Select a different area in the era."""
+        rng = get_rng(seed)
         available_areas = cls.avail_areas(location)
         possible_areas = [
             k for k in available_areas.keys() if k != location.area
         ]
-        new_a = random.choice(possible_areas)
+        new_a = rng.choice(possible_areas)
         return cls(
             era=location.era,
             area=new_a,
-            locale=random.choice(available_areas[new_a]),
+            locale=rng.choice(available_areas[new_a]),
         )
 
 
@@ -7,7 +7,10 @@ import logging
 
 from google.cloud import texttospeech
 
+from storytime.rate_limiter import RateLimiter, get_rate_limiter
+
 MAX_INPUT_LENGTH = 5000
+TTS_REQUESTS_PER_MINUTE = 1000
 INTRO_BREAK = '<speak><break time="2s"/>'
 OUTRO_BREAK = '<break time="2s"/></speak>'
 
@@ -19,6 +22,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def tts_rate_limiter() -> RateLimiter:
+    """Returns the limiter shared by all speech requests on this host."""
+    return get_rate_limiter("tts", TTS_REQUESTS_PER_MINUTE)
+
+
 class Narrator:
     """Narrator class for synthesizing speech from text."""
 
@@ -77,6 +85,7 @@ class Narrator:
 
         # Perform the text-to-speech request on the text input with the
         # selected voice parameters and audio file type
+        tts_rate_limiter().acquire()
         response = self.client.synthesize_speech(
             input=synthesis_input,
             voice=voice,
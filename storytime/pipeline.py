@@ -0,0 +1,390 @@
+"""Pipelined story production: text, images, narration, video and upload.
+
+Each stage runs on its own pool of worker threads and hands its results to
+the next stage through a bounded queue. When a stage falls behind its input
+queue fills up and the stages feeding it block, so work never piles up in
+memory and throughput is set by the slowest stage instead of the sum of all
+of them.
+
+Within a story, each scene's image and narration start as soon as its text is
+streamed. Across stories, one story's video renders and uploads while the
+next one is still being written.
+"""
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from storytime.narrator import Narrator
+from storytime.scene import Scene
+from storytime.story import Story, get_story_image_dir, scene_label
+from storytime.upload_youtube import upload_story
+from storytime.video import create_video
+
+QUEUE_SIZE = 8  # Items waiting between two stages before the first blocks
+STORY_WORKERS = 2  # Stories having their scenes written at once
+IMAGE_WORKERS = 4
+NARRATION_WORKERS = 4
+VIDEO_WORKERS = 1  # Rendering is CPU bound
+UPLOAD_WORKERS = 1
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # Tells a stage's workers there's nothing more to come
+
+StoryScene = Tuple[Story, int, int, Scene]
+
+
+class Stage:
+    """One step of a pipeline, worked on by a fixed number of threads."""
+
+    def __init__(
+        self,
+        name: str,
+        work: Callable[[Any], Any],
+        workers: int = 1,
+        queue_size: int = QUEUE_SIZE,
+    ) -> None:
+        """Set up the stage.
+
+        Args:
+            name: Name used for the stage's threads and stats.
+            work: Turns an item from the previous stage into the item for the
+                next one.
+            workers: Items worked on at once.
+            queue_size: Items allowed to wait for a worker.
+        """
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool = False) -> None:
+        """Count one item the stage finished with."""
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+            self.seconds += seconds
+
+    def stats(self) -> Dict[str, float]:
+        """Returns item counts and time spent working on them."""
+        with self._lock:
+            finished = self.processed + self.failed
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "seconds": self.seconds,
+                "mean_seconds": self.seconds / finished if finished else 0.0,
+            }
+
+
+class Pipeline:
+    """Stages joined by bounded queues."""
+
+    def __init__(self, stages: List[Stage]) -> None:
+        self.stages = stages
+
+    def run(
+        self,
+        items: Iterable[Any],
+        on_error: Optional[Callable[[Stage, Any, Exception], None]] = None,
+    ) -> List[Any]:
+        """Feed the items through every stage.
+
+        Items that fail in a stage are logged and dropped, after being passed
+        to on_error along with the stage and the exception, if it's given.
+
+        Returns:
+            What came out of the last stage, in the order it finished.
+        """
+        inboxes: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=stage.queue_size) for stage in self.stages
+        ]
+        results: "queue.Queue[Any]" = queue.Queue()
+        outboxes = inboxes[1:] + [results]
+        next_workers = [stage.workers for stage in self.stages[1:]] + [1]
+        threads = []
+        for stage, inbox, outbox, downstream in zip(
+            self.stages, inboxes, outboxes, next_workers
+        ):
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for i in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(
+                        stage,
+                        inbox,
+                        outbox,
+                        downstream,
+                        remaining,
+                        remaining_lock,
+                        on_error,
+                    ),
+                    name=f"{stage.name}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        try:
+            for item in items:
+                inboxes[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                inboxes[0].put(_DONE)
+            finished = []
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                finished.append(item)
+            for thread in threads:
+                thread.join()
+        return finished
+
+    @staticmethod
+    def _work(
+        stage: Stage,
+        inbox: "queue.Queue[Any]",
+        outbox: "queue.Queue[Any]",
+        downstream: int,
+        remaining: List[int],
+        remaining_lock: threading.Lock,
+        on_error: Optional[Callable[[Stage, Any, Exception], None]],
+    ) -> None:
+        """Work on items until told there are no more."""
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            start = time.monotonic()
+            try:
+                result = stage.work(item)
+            except Exception as e:
+                stage.record(time.monotonic() - start, failed=True)
+                logger.exception(f"{stage.name} failed: {e}")
+                if on_error is not None:
+                    on_error(stage, item, e)
+                continue
+            stage.record(time.monotonic() - start)
+            outbox.put(result)
+        # The last worker out tells the next stage it's done too
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(downstream):
+                outbox.put(_DONE)
+
+
+class StoryProducer:
+    """Produces stories from text through to an uploaded video."""
+
+    def __init__(
+        self,
+        with_video: bool = True,
+        upload: bool = False,
+        story_workers: int = STORY_WORKERS,
+        image_workers: int = IMAGE_WORKERS,
+        narration_workers: int = NARRATION_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+    ) -> None:
+        """Set up the stages.
+
+        Args:
+            with_video: Whether to render a video of each story. Stories need
+                images for a video.
+            upload: Whether to upload each video.
+            story_workers: Stories written at once.
+            image_workers: Images per story requested at once.
+            narration_workers: Scenes per story narrated at once.
+            queue_size: Items allowed to wait between two stages.
+        """
+        self.with_video = with_video
+        self.upload = upload
+        self.narrator: Optional[Narrator] = None
+        self._narrator_lock = threading.Lock()
+        # Scenes come from Story.stream, this stage only keeps their stats
+        self.text = Stage("text", lambda item: item)
+        self.image = Stage(
+            "image", self.illustrate_scene, image_workers, queue_size
+        )
+        self.narration = Stage(
+            "narration", self.narrate_scene, narration_workers, queue_size
+        )
+        self.story = Stage(
+            "story", self.write_story, story_workers, queue_size
+        )
+        self.video = Stage(
+            "video", self.render_video, VIDEO_WORKERS, queue_size
+        )
+        self.upload_stage = Stage(
+            "upload", self.upload_video, UPLOAD_WORKERS, queue_size
+        )
+
+    def get_narrator(self) -> Narrator:
+        """Returns the narrator shared by every story."""
+        with self._narrator_lock:
+            if self.narrator is None:
+                self.narrator = Narrator()
+        return self.narrator
+
+    def stages(self) -> List[Stage]:
+        """Returns the stages each story goes through, in order."""
+        stages = [self.story]
+        if self.with_video:
+            stages.append(self.video)
+            if self.upload:
+                stages.append(self.upload_stage)
+        return stages
+
+    def produce(
+        self,
+        stories: Iterable[Story],
+    ) -> List[Tuple[Story, Optional[str]]]:
+        """Produce each story, which should be created with deferred=True.
+
+        Returns:
+            Each produced story with its video file, if it has one, in the
+            order they finished.
+        """
+        return Pipeline(self.stages()).run((story, None) for story in stories)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the stats of every stage."""
+        return {
+            stage.name: stage.stats()
+            for stage in (
+                self.text,
+                self.image,
+                self.narration,
+                self.story,
+                self.video,
+                self.upload_stage,
+            )
+        }
+
+    def write_story(
+        self,
+        item: Tuple[Story, Optional[str]],
+    ) -> Tuple[Story, Optional[str]]:
+        """Write a story while its scenes are illustrated and narrated.
+
+        Raises:
+            Exception: The first error illustrating or narrating a scene,
+                once every other scene is done and the story is checkpointed.
+        """
+        story, _ = item
+        narrator = self.get_narrator()
+        story.narrate(narrator, "Title", story.title_narration(narrator.name))
+        stages = [self.narration]
+        if story.with_images:
+            stages.insert(0, self.image)
+        errors: List[Exception] = []
+        Pipeline(stages).run(
+            self._timed_stream(story),
+            on_error=lambda stage, scene, error: errors.append(error),
+        )
+        if errors:
+            story.save_checkpoint()
+            raise errors[0]
+        story.narrate(narrator, "Outro", story.outro_narration())
+        if story.with_images:
+            # Images arrive in the order they finish, the video needs them in
+            # story order
+            story.image_set.images = {
+                label: story.image_set.images.get(label, "")
+                for label in story.scene_labels()
+            }
+        story.save_checkpoint()
+        return story, None
+
+    def _timed_stream(self, story: Story) -> Iterator[StoryScene]:
+        """Stream a story's scenes, timing how long each took to write."""
+        start = time.monotonic()
+        # The image stage illustrates each scene, so the stream mustn't too
+        for act_number, scene_number, scene in story.stream(images=False):
+            self.text.record(time.monotonic() - start)
+            yield story, act_number, scene_number, scene
+            start = time.monotonic()
+
+    def illustrate_scene(self, item: StoryScene) -> StoryScene:
+        """Generate and download the image for a scene."""
+        story, act_number, scene_number, scene = item
+        label = scene_label(act_number, scene_number)
+        if not story.image_set.images.get(label):
+            story.image_set.add_scene_image(label, scene)
+            story.save_checkpoint()
+        image_dir = get_story_image_dir(story.title)
+        if not os.path.exists(image_dir):
+            os.makedirs(image_dir, exist_ok=True)
+        story.image_set.save_image(label, image_dir)
+        return item
+
+    def narrate_scene(self, item: StoryScene) -> StoryScene:
+        """Narrate each part of a scene."""
+        story, act_number, scene_number, _ = item
+        narrator = self.get_narrator()
+        for label, text in story.scene_narration(
+            act_number, scene_number
+        ).items():
+            story.narrate(narrator, label, text)
+        return item
+
+    def render_video(
+        self,
+        item: Tuple[Story, Optional[str]],
+    ) -> Tuple[Story, Optional[str]]:
+        """Render a story's video once all of its assets are ready."""
+        story, _ = item
+        if not story.with_images:
+            logger.warning(f"{story.title} has no images for a video.")
+            return story, None
+        return story, create_video(story)
+
+    def upload_video(
+        self,
+        item: Tuple[Story, Optional[str]],
+    ) -> Tuple[Story, Optional[str]]:
+        """Upload a story's video."""
+        story, video_file = item
+        if video_file is not None:
+            upload_story(story, video_file)
+        return story, video_file
+
+
+def produce_story(
+    story: Story,
+    with_video: bool = True,
+    upload: bool = False,
+) -> Optional[str]:
+    """Produce one story, returning its video file if it has one."""
+    produced = StoryProducer(with_video=with_video, upload=upload).produce(
+        [story]
+    )
+    if not produced:
+        return None
+    return produced[0][1]
@@ -0,0 +1,312 @@
+"""Token bucket rate limiting shared by every thread and process on a host.
+
+Each named limiter keeps a requests-per-minute bucket and, optionally, a
+tokens-per-minute bucket in a small SQLite database. Every acquisition runs in
+an exclusive transaction, so story workers running in separate processes draw
+from the same quota instead of each assuming they own all of it.
+
+The configured limits are only a starting point: observe() retunes them from
+the rate limit headers the service sends back with every response.
+"""
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from storytime.cache import get_cache_dir
+
+MINUTE = 60
+RATE_LIMIT_FILENAME = "ratelimits.sqlite3"
+DEFAULT_RETRY_AFTER = 1.0  # Seconds to pause when a 429 says nothing more
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": MINUTE, "h": 60 * MINUTE}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a duration such as "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * DURATION_SECONDS[unit] for n, unit in parts)
+
+
+def _header_number(
+    headers: Mapping[str, str],
+    name: str,
+) -> Optional[float]:
+    """Return a numeric header value, or None if missing or malformed."""
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Requests and tokens per minute limits for one service."""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        """Open the shared bucket state, creating it if needed.
+
+        Args:
+            name: Service the limits apply to, e.g. "text" or "image".
+            requests_per_minute: Starting requests per minute limit.
+            tokens_per_minute: Starting tokens per minute limit, None for no
+                limit.
+            path: Database file, defaults to the storytime cache directory.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), RATE_LIMIT_FILENAME)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, "
+                "requests_per_minute REAL NOT NULL, "
+                "tokens_per_minute REAL, "
+                "requests REAL NOT NULL, "
+                "tokens REAL NOT NULL, "
+                "updated REAL NOT NULL)"
+            )
+        self._create_bucket(requests_per_minute, tokens_per_minute)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the bucket state exclusively, across threads and processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _refill(
+        self,
+        conn: sqlite3.Connection,
+        now: float,
+    ) -> Tuple[float, Optional[float], float, float]:
+        """Return the limits and bucket levels refilled up to now."""
+        rpm, tpm, requests, tokens, updated = conn.execute(
+            "SELECT requests_per_minute, tokens_per_minute, requests, tokens, "
+            "updated FROM buckets WHERE name = ?",
+            (self.name,),
+        ).fetchone()
+        elapsed = max(now - updated, 0)
+        requests = min(rpm, requests + elapsed * rpm / MINUTE)
+        if tpm:
+            tokens = min(tpm, tokens + elapsed * tpm / MINUTE)
+        return rpm, tpm, requests, tokens
+
+    def _store(
+        self,
+        conn: sqlite3.Connection,
+        now: float,
+        requests: float,
+        tokens: float,
+    ) -> None:
+        """Save the bucket levels as of now."""
+        conn.execute(
+            "UPDATE buckets SET requests = ?, tokens = ?, updated = ? "
+            "WHERE name = ?",
+            (requests, tokens, now, self.name),
+        )
+
+    def _create_bucket(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float],
+    ) -> None:
+        """Start a full bucket with the given limits, if none exists yet.
+
+        An existing bucket keeps the limits other workers have learned.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.name,
+                    requests_per_minute,
+                    tokens_per_minute,
+                    requests_per_minute,
+                    tokens_per_minute or 0,
+                    time.time(),
+                ),
+            )
+
+    def set_limits(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+    ) -> None:
+        """Set the limits for every user of this bucket."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE buckets SET requests_per_minute = ?, "
+                "tokens_per_minute = ? WHERE name = ?",
+                (requests_per_minute, tokens_per_minute, self.name),
+            )
+
+    def limits(self) -> Tuple[float, Optional[float]]:
+        """Return the requests and tokens per minute limits."""
+        with self._lock:
+            rpm, tpm = self._conn.execute(
+                "SELECT requests_per_minute, tokens_per_minute FROM buckets "
+                "WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        return rpm, tpm
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Take capacity for one request from the buckets.
+
+        The buckets may go negative, which reserves the capacity for this
+        caller ahead of later ones.
+
+        Args:
+            tokens: Tokens the request will use.
+
+        Returns:
+            Seconds to wait before sending the request.
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            rpm, tpm, requests, available_tokens = self._refill(conn, now)
+            requests -= 1
+            wait = max(-requests * MINUTE / rpm, 0)
+            if tpm:
+                # Never wait on more tokens than the bucket can hold
+                available_tokens -= min(tokens, tpm)
+                wait = max(wait, -available_tokens * MINUTE / tpm)
+            self._store(conn, now, requests, available_tokens)
+        if wait > 0:
+            logger.debug(f"Waiting {wait:.2f}s for {self.name} capacity.")
+        return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until a request using the tokens may be sent."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """Asynchronous version of acquire.
+
+        The reservation's SQLite transaction can wait on other processes'
+        locks, so it runs on the loop's executor and only the sleep is
+        awaited on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        wait = await loop.run_in_executor(None, self.reserve, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def observe(
+        self,
+        headers: Mapping[str, str],
+        rate_limited: bool = False,
+    ) -> None:
+        """Retune the buckets from the rate limit headers of a response.
+
+        The limits are replaced by the ones the service reports and the
+        buckets are drained to what the service says remains. A rate limited
+        response also pauses the limiter until the service's reset time.
+
+        Args:
+            headers: Response headers, with case-insensitive lookup.
+            rate_limited: Whether the response was a 429.
+        """
+        new_rpm = _header_number(headers, "x-ratelimit-limit-requests")
+        new_tpm = _header_number(headers, "x-ratelimit-limit-tokens")
+        remaining_requests = _header_number(
+            headers, "x-ratelimit-remaining-requests"
+        )
+        remaining_tokens = _header_number(
+            headers, "x-ratelimit-remaining-tokens"
+        )
+        pause = None
+        if rate_limited:
+            pause = (
+                parse_duration(headers.get("retry-after"))
+                or parse_duration(headers.get("x-ratelimit-reset-requests"))
+                or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                or DEFAULT_RETRY_AFTER
+            )
+        with self._transaction() as conn:
+            now = time.time()
+            rpm, tpm, requests, tokens = self._refill(conn, now)
+            if (new_rpm and new_rpm != rpm) or (new_tpm and new_tpm != tpm):
+                rpm = new_rpm or rpm
+                tpm = new_tpm or tpm
+                conn.execute(
+                    "UPDATE buckets SET requests_per_minute = ?, "
+                    "tokens_per_minute = ? WHERE name = ?",
+                    (rpm, tpm, self.name),
+                )
+                logger.info(
+                    f"Rate limits for {self.name} are now {rpm:g} requests "
+                    f"and {tpm or 0:g} tokens per minute."
+                )
+            if remaining_requests is not None:
+                requests = min(requests, remaining_requests)
+            if remaining_tokens is not None and tpm:
+                tokens = min(tokens, remaining_tokens)
+            if pause:
+                # A negative level makes the next request wait out the pause
+                requests = min(requests, -pause * rpm / MINUTE)
+                logger.warning(f"Pausing {self.name} requests for {pause}s.")
+            self._store(conn, now, requests, tokens)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    name: str,
+    requests_per_minute: float,
+    tokens_per_minute: Optional[float] = None,
+) -> RateLimiter:
+    """Return the process's limiter for a service, creating it on first use."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(
+                name, requests_per_minute, tokens_per_minute
+            )
+    return _limiters[name]
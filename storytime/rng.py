@@ -0,0 +1,36 @@
+"""Random number generators for reproducible stories.
+
+Everything that makes random choices takes a seed, which is either a
+random.Random to draw from or a value to seed a new one with. A story draws
+from its own generator instead of the random module's shared one, so the same
+seed plans the same story, even with other stories being written at once.
+"""
+from typing import Optional, Union
+
+import random
+
+Seed = Optional[Union[int, str, random.Random]]
+SEED_BITS = 64  # Size of the seeds picked for stories that aren't given one
+
+
+def get_rng(seed: Seed = None) -> random.Random:
+    """Returns seed if it's a generator, else a new one seeded with it."""
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+
+def new_seed() -> int:
+    """Pick a seed, so a story made without one can still be remade."""
+    return random.SystemRandom().getrandbits(SEED_BITS)
+
+
+def derive_rng(seed: Optional[int], *labels: object) -> random.Random:
+    """Returns a generator for one part of a story, e.g. an act or scene.
+
+    Each part gets its own stream of numbers, so parts written concurrently
+    or resumed later draw the same numbers as when written in order.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random(":".join(str(part) for part in (seed,) + labels))
@@ -1,15 +1,68 @@
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
 
-import random
+import asyncio
+import logging
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from storytime import gpt3
 from storytime.character import Character
-from storytime.gpt3 import generate_text
+from storytime.gpt3 import agenerate_text, generate_text, run_async
 from storytime.location import Location
+from storytime.rng import Seed, get_rng
 from storytime.time_period import TimePeriod
+from storytime.tokens import fit_prompt
 
 SUFFIXES = {1: "st", 2: "nd", 3: "rd"}
-CHAR_PER_TOKEN = 3  # Average number of characters per token
+VISUAL_WORKERS = 8  # Visual summaries written at once in the background
+PART_HEADING = "###"  # Marks the start of each part in a single request
+PART_INSTRUCTIONS = (
+    "Start with a paragraph that describes what "
+    "the characters experience externally and "
+    "then write one or more paragraphs that "
+    "describes how the characters react to what "
+    "happened beginning with their feelings, "
+    "then any reflexive actions, followed by "
+    "any rational actions and dialogue."
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+_visual_executor = ThreadPoolExecutor(
+    max_workers=VISUAL_WORKERS,
+    thread_name_prefix="visual",
+)
+
+
+class SceneContext(NamedTuple):
+    """What a scene needs to know about the scene before it."""
+
+    scene_number: int
+    scene_type: str
+    location: Location
+    time_period: TimePeriod
+    summary: str
+    written: bool
+
+
+class ScenePlan(NamedTuple):
+    """Everything decided about a scene before any of it is written.
+
+    The setup of its prompts, and so the prompts, can only be finished once
+    the scene before it is written and summarized.
+    """
+
+    scene_number: int
+    total_scenes_in_act: int
+    scene_type: str
+    characters: Dict[str, Character]
+    location: Location
+    time_period: TimePeriod
+    opening: str  # How the setup starts, before the scene before it
 
 
 def ordinal(num):
@@ -25,20 +78,58 @@ def ordinal(num):
 
 def summarize_text(scene_text: List[str]) -> str:
     """Summarizes scene text."""
-    prompt = f"Summarize the following scene: {' '.join(scene_text)}"
-    return generate_text(
-        prompt,
-        max_tokens=(gpt3.MAX_TOKENS - int(len(prompt) / CHAR_PER_TOKEN)),
-    ).strip()
+    prompt, max_tokens = fit_prompt(
+        f"Summarize the following scene: {' '.join(scene_text)}", "summary"
+    )
+    return generate_text(prompt, max_tokens=max_tokens).strip()
+
+
+async def write_scene_parts(scene_prompts: List[str]) -> List[str]:
+    """Generates the text for each scene part concurrently."""
+    fitted = [
+        fit_prompt(scene_prompt, "scene part")
+        for scene_prompt in scene_prompts
+    ]
+    scene_text = await asyncio.gather(
+        *(
+            agenerate_text(prompt, max_tokens=max_tokens)
+            for prompt, max_tokens in fitted
+        )
+    )
+    return list(scene_text)
+
+
+def split_scene_parts(text: str, parts: List[str]) -> Optional[List[str]]:
+    """Splits text written in a single request into its scene parts.
+
+    Returns None unless every part is found, in order, with some text.
+    """
+    headings = list(
+        re.finditer(
+            rf"^[ \t]*{PART_HEADING}[ \t]*(\w+)[ \t]*:?[ \t]*$",
+            text,
+            flags=re.MULTILINE,
+        )
+    )
+    found = [heading.group(1).lower() for heading in headings]
+    if found != [part.lower() for part in parts]:
+        return None
+    scene_text = []
+    for i, heading in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        part_text = text[heading.end() : end].strip()
+        if not part_text:
+            return None
+        scene_text.append(part_text)
+    return scene_text
 
 
 def visually_summarize(scene_part: str) -> str:
     """Describes scene visually."""
-    prompt = f"Visually summarize the following scene: {scene_part}"
-    return generate_text(
-        prompt,
-        max_tokens=(gpt3.MAX_TOKENS - int(len(prompt) / CHAR_PER_TOKEN)),
-    ).strip()
+    prompt, max_tokens = fit_prompt(
+        f"Visually summarize the following scene: {scene_part}", "visual"
+    )
+    return generate_text(prompt, max_tokens=max_tokens).strip()
 
 
 class Scene:
@@ -80,111 +171,292 @@ class Scene:
         time_period: TimePeriod,
         characters: Dict[str, Character],
         total_scenes_in_act: int,
-        previous_scenes: Optional[List["Scene"]] = None,
+        previous_scene: Optional[SceneContext] = None,
         area: Optional[str] = None,
+        single_request: bool = False,
+        seed: Seed = None,
     ):
-        self.previous_scenes = previous_scenes
-        self.scene_number = len(previous_scenes) + 1 if previous_scenes else 1
-        scene_number_ordinal = ordinal(self.scene_number)
-        self.total_scenes_in_act = total_scenes_in_act
-        self.scene_type = "scene"
-        if previous_scenes and previous_scenes[-1].scene_type == "scene":
-            self.scene_type = "sequel"
+        plan = self.plan(
+            target_audience=target_audience,
+            genre=genre,
+            themes=themes,
+            act_description=act_description,
+            time_period=time_period,
+            characters=characters,
+            total_scenes_in_act=total_scenes_in_act,
+            previous_scene=previous_scene,
+            area=area,
+            seed=seed,
+        )
+        previous_summary = None
+        if previous_scene is not None and previous_scene.written:
+            previous_summary = previous_scene.summary
+        self.render(plan, previous_summary, single_request)
+
+    @classmethod
+    def plan(
+        cls,
+        target_audience: str,
+        genre: str,
+        themes: List[str],
+        act_description: str,
+        time_period: TimePeriod,
+        characters: Dict[str, Character],
+        total_scenes_in_act: int,
+        previous_scene: Optional[Union[SceneContext, ScenePlan]] = None,
+        area: Optional[str] = None,
+        seed: Seed = None,
+    ) -> ScenePlan:
+        """Plan a scene without writing anything, or making any requests."""
+        rng = get_rng(seed)
+        scene_number = previous_scene.scene_number + 1 if previous_scene else 1
+        scene_type = "scene"
+        if previous_scene and previous_scene.scene_type == "scene":
+            scene_type = "sequel"
 
         # Include the protagonist and a random set of characters in the scene.
-        self.characters = {"protagonist": characters["protagonist"]}
-        char_in_scene = random.randrange(2, len(characters.keys()))
+        scene_characters = {"protagonist": characters["protagonist"]}
+        char_in_scene = rng.randrange(2, len(characters.keys()))
         for i in range(char_in_scene):
-            char = random.choice(list(characters.keys()))
-            if char not in self.characters:
-                self.characters[char] = characters[char]
+            char = rng.choice(list(characters.keys()))
+            if char not in scene_characters:
+                scene_characters[char] = characters[char]
 
         # Randomly change the location from the prior scene
-        if previous_scenes is None or len(previous_scenes) == 0:
-            self.location = Location(
+        if previous_scene is None:
+            location = Location(
                 era=time_period.era,
                 area=area,
+                seed=rng,
             )
         else:
-            if random.random() > 0.6:
-                self.location = Location.new_locale(
-                    previous_scenes[-1].location
-                )
-            elif area is None and random.random() > 0.9:
-                self.location = Location.new_area(previous_scenes[-1].location)
+            if rng.random() > 0.6:
+                location = Location.new_locale(previous_scene.location, rng)
+            elif area is None and rng.random() > 0.9:
+                location = Location.new_area(previous_scene.location, rng)
             else:
-                self.location = previous_scenes[-1].location
+                location = previous_scene.location
 
         # Advance the time of day and randomly change the season and era
-        if previous_scenes is None or len(previous_scenes) == 0:
-            self.time_period = time_period
+        if previous_scene is None:
+            scene_time_period = time_period
         else:
-            self.time_period = TimePeriod.advance_time_of_day(
-                previous_scenes[-1].time_period
+            scene_time_period = TimePeriod.advance_time_of_day(
+                previous_scene.time_period
             )
-            if random.random() > 0.7:
-                self.time_period = TimePeriod.advance_season(self.time_period)
-            if random.random() > 0.95:
-                self.time_period = TimePeriod.advance_era(self.time_period)
+            if rng.random() > 0.7:
+                scene_time_period = TimePeriod.advance_season(
+                    scene_time_period
+                )
+            if rng.random() > 0.95:
+                scene_time_period = TimePeriod.advance_era(scene_time_period)
 
-        # Write the scene from scene prompts
-        self.scene_text: List[str] = []
-        self.scene_setup = (
-            f"As part of a {genre} story appealing to "
-            f"{target_audience} with the themes of "
-            f"{themes[0]} and {themes[1]}, in the "
-            f"{scene_number_ordinal} scene of a "
-            f"{total_scenes_in_act} scene act where "
-            f"{act_description}"
+        return ScenePlan(
+            scene_number=scene_number,
+            total_scenes_in_act=total_scenes_in_act,
+            scene_type=scene_type,
+            characters=scene_characters,
+            location=location,
+            time_period=scene_time_period,
+            opening=(
+                f"As part of a {genre} story appealing to "
+                f"{target_audience} with the themes of "
+                f"{themes[0]} and {themes[1]}, in the "
+                f"{ordinal(scene_number)} scene of a "
+                f"{total_scenes_in_act} scene act where "
+                f"{act_description}"
+            ),
         )
+
+    @classmethod
+    def setup(
+        cls,
+        plan: ScenePlan,
+        previous_summary: Optional[str] = None,
+        outline: Optional[str] = None,
+    ) -> str:
+        """Returns what every prompt for a planned scene starts with."""
+        scene_setup = plan.opening
         # Add previous scene to scene setup
-        if previous_scenes is not None and len(previous_scenes) > 0:
-            self.scene_summary = ""
-            if (
-                previous_scenes[-1].scene_text is not None
-                and len(previous_scenes[-1].scene_text) > 0
-            ):
-                self.scene_setup += (
-                    f" The previous scene was about: "
-                    f"{previous_scenes[-1].scene_summary}"
-                )
+        if previous_summary is not None:
+            scene_setup += f" The previous scene was about: {previous_summary}"
+        # Or what the story's outline says happens in this scene
+        if outline is not None:
+            scene_setup += f" In this scene: {outline}"
         # Add location and time of day to scene setup
-        self.scene_setup += (
+        scene_setup += (
             f" This scene takes place in a "
-            f"{self.location.locale} "
-            f"in a {self.location.area} area during "
-            f"{self.time_period.time_of_day} of "
-            f"{self.time_period.season} in the"
-            f" {self.time_period.era} era."
+            f"{plan.location.locale} "
+            f"in a {plan.location.area} area during "
+            f"{plan.time_period.time_of_day} of "
+            f"{plan.time_period.season} in the"
+            f" {plan.time_period.era} era."
         )
         # Add characters to scene setup
-        for char in list(self.characters.keys()):
-            self.scene_setup += f" {self.characters[char]} is the {char}."
-        # Add scene types to scene prompt and generate scene text
-        for part in self.scene_types[self.scene_type]:
-            scene_prompt = self.scene_setup
+        for char in list(plan.characters.keys()):
+            scene_setup += f" {plan.characters[char]} is the {char}."
+        return scene_setup
+
+    @classmethod
+    def part_prompts(cls, scene_type: str, scene_setup: str) -> List[str]:
+        """Returns the prompt for each part of a scene."""
+        scene_prompts = []
+        for part in cls.scene_types[scene_type]:
+            scene_prompt = scene_setup
             scene_prompt += (
                 f"Write a part of the scene where"
-                f" {self.scene_types[self.scene_type][part]} "
-                f"Start with a paragraph that describes what "
-                f"the characters experience externally and "
-                f"then write one or more paragraphs that "
-                f"describes how the characters react to what "
-                f"happened beginning with their feelings, "
-                f"then any reflexive actions, followed by "
-                f"any rational actions and dialogue."
+                f" {cls.scene_types[scene_type][part]} "
+                f"{PART_INSTRUCTIONS}"
+            )
+            scene_prompts.append(scene_prompt)
+        return scene_prompts
+
+    @classmethod
+    def single_request_prompt(cls, scene_type: str, scene_setup: str) -> str:
+        """Returns the prompt for every part of a scene at once."""
+        parts = cls.scene_types[scene_type]
+        scene_prompt = scene_setup
+        scene_prompt += f"Write the scene in {len(parts)} parts."
+        for part, description in parts.items():
+            scene_prompt += (
+                f" Begin the {part} part with a line containing only "
+                f"'{PART_HEADING} {part.upper()}' and in it write where "
+                f"{description}"
             )
-            new_scene_text = generate_text(
-                scene_prompt,
-                max_tokens=(
-                    gpt3.MAX_TOKENS - int(len(scene_prompt) / CHAR_PER_TOKEN)
-                ),
+        scene_prompt += f" In each part: {PART_INSTRUCTIONS}"
+        return scene_prompt
+
+    @classmethod
+    def from_plan(
+        cls,
+        plan: ScenePlan,
+        previous_summary: Optional[str] = None,
+        single_request: bool = False,
+        outline: Optional[str] = None,
+    ) -> "Scene":
+        """Write a planned scene.
+
+        A scene written from an outline of what happens in it doesn't need
+        the summary of the scene before it.
+        """
+        scene = cls.__new__(cls)
+        scene.render(plan, previous_summary, single_request, outline)
+        return scene
+
+    def render(
+        self,
+        plan: ScenePlan,
+        previous_summary: Optional[str] = None,
+        single_request: bool = False,
+        outline: Optional[str] = None,
+    ) -> None:
+        """Write the scene's text and summaries from its plan."""
+        self.scene_number = plan.scene_number
+        self.total_scenes_in_act = plan.total_scenes_in_act
+        self.scene_type = plan.scene_type
+        self.characters = dict(plan.characters)
+        self.location = plan.location
+        self.time_period = plan.time_period
+        self.scene_setup = self.setup(plan, previous_summary, outline)
+
+        # Write the scene from scene prompts
+        self.scene_text: List[str] = []
+        # Write all the parts in one request if asked, which shares the
+        # setup between them
+        if single_request:
+            self.scene_text = self.write_in_single_request()
+        if not self.scene_text:
+            # The parts only share the setup, so generate them all at once
+            self.scene_text = run_async(
+                write_scene_parts(
+                    self.part_prompts(self.scene_type, self.scene_setup)
+                )
             )
-            self.scene_text.append(new_scene_text)
+        # Visually describe the scene in the background, only the summary is
+        # needed to start the next scene
+        self.write_visual()
         # Summarize the scene
         self.scene_summary = summarize_text(self.scene_text)
-        # Visually describe the scene
-        self.scene_visual = visually_summarize(self.scene_text[2])
+
+    def write_visual(self) -> None:
+        """Start writing the visual summary of the scene in the background."""
+        visual = _visual_executor.submit(
+            visually_summarize, self.scene_text[2]
+        )
+        self.scene_visual = visual
+        visual.add_done_callback(self._visual_written)
+
+    @property
+    def scene_visual(self) -> str:
+        """Visual description of the scene, waiting for it to be written."""
+        if "scene_visual" not in self.__dict__:
+            raise AttributeError("scene_visual")
+        visual = self.__dict__["scene_visual"]
+        if isinstance(visual, Future):
+            visual = visual.result()
+            self.__dict__["scene_visual"] = visual
+        return visual
+
+    @scene_visual.setter
+    def scene_visual(self, visual: Union[str, "Future[str]"]) -> None:
+        self.__dict__["scene_visual"] = visual
+
+    def _visual_written(self, visual: "Future[str]") -> None:
+        """Keep the visual summary in place of the future it came from."""
+        if self.__dict__.get("scene_visual") is visual:
+            if not visual.cancelled() and visual.exception() is None:
+                self.__dict__["scene_visual"] = visual.result()
+
+    async def ascene_visual(self) -> str:
+        """Visual description of the scene, awaiting it to be written."""
+        visual = self.__dict__.get("scene_visual")
+        if isinstance(visual, Future):
+            await asyncio.wrap_future(visual)
+        return self.scene_visual
+
+    def on_visual(self, callback: Callable[[], None]) -> None:
+        """Call callback once the visual summary is written."""
+        visual = self.__dict__.get("scene_visual")
+        if isinstance(visual, Future):
+            visual.add_done_callback(lambda _: callback())
+        else:
+            callback()
+
+    def visual_pending(self) -> bool:
+        """Returns whether the visual description is still being written."""
+        visual = self.__dict__.get("scene_visual")
+        return isinstance(visual, Future) and not visual.done()
+
+    def context(self) -> SceneContext:
+        """Return what the next scene needs to know about this one."""
+        return SceneContext(
+            scene_number=self.scene_number,
+            scene_type=self.scene_type,
+            location=self.location,
+            time_period=self.time_period,
+            summary=self.scene_summary,
+            written=bool(self.scene_text),
+        )
+
+    def write_in_single_request(self) -> List[str]:
+        """Write every part of the scene with one request.
+
+        Returns an empty list if the response can't be split into the parts.
+        """
+        parts = self.scene_types[self.scene_type]
+        scene_prompt = self.single_request_prompt(
+            self.scene_type, self.scene_setup
+        )
+        prompt, max_tokens = fit_prompt(scene_prompt, "scene")
+        text = generate_text(prompt, max_tokens=max_tokens)
+        scene_text = split_scene_parts(text, list(parts))
+        if scene_text is None:
+            logger.warning(
+                "Could not split scene parts from a single request, "
+                "writing each part separately."
+            )
+            return []
+        return scene_text
 
     def __str__(self) -> str:
         full_scene: str = ""
@@ -0,0 +1,342 @@
+"""Plain data encoding of stories, with a versioned schema.
+
+Stories are saved as compact JSON made only of dicts, lists, strings and
+numbers, so loading one never has to import and rebuild arbitrary classes.
+Characters are written once per story and scenes refer to them by role.
+
+Every file records the SCHEMA_VERSION it was written with. Files written
+with jsonpickle before the schema existed are recognized by their "py/object"
+markers and can be migrated with story.migrate_json.
+
+Since version 2 a story file is a header line holding everything but the
+scenes, followed by one line per scene. The header indexes where each scene's
+line is, so StoryFile can read a story's metadata, or any one of its scenes,
+without decoding the rest of the file.
+
+Since version 3 characters are written as the fields Character lists in
+saved_fields and optional_fields, leaving out names derived from the full
+name.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import json
+import re
+
+from storytime.character import Character
+from storytime.image_set import ImageSet
+from storytime.location import Location
+from storytime.scene import Scene
+from storytime.time_period import TimePeriod
+
+SCHEMA_VERSION = 3
+SCENE_INDEX_VERSION = 2  # First version with a header and a scene per line
+JSONPICKLE_MARKER = "py/object"
+# How Scene describes where and when it takes place in its setup
+# Character attributes written before version 3 that are derived on loading
+DERIVED_CHARACTER_FIELDS = {"pronoun", "firstname", "lastname", "name"}
+SETUP_PLACE = re.compile(
+    r"This scene takes place in a (?P<locale>.+?) in a (?P<area>.+?) area "
+    r"during (?P<time_of_day>.+?) of (?P<season>.+?) in the "
+    r"(?P<era>.+?) era\."
+)
+
+
+def dumps(data: Dict[str, Any]) -> str:
+    """Encode data as compact JSON."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(text: str) -> Dict[str, Any]:
+    """Decode JSON written by dumps."""
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("Story data must be a JSON object.")
+    return data
+
+
+def is_jsonpickle(data: Dict[str, Any]) -> bool:
+    """Returns whether decoded JSON was written by jsonpickle."""
+    return JSONPICKLE_MARKER in data
+
+
+def check_schema(data: Dict[str, Any]) -> None:
+    """Raise a ValueError unless this version can read the data."""
+    version = data.get("schema_version")
+    if not isinstance(version, int) or version < 1:
+        raise ValueError(f"Not a story file, schema version: {version}")
+    if version > SCHEMA_VERSION:
+        raise ValueError(
+            f"Story schema version {version} is newer than the supported "
+            f"version {SCHEMA_VERSION}."
+        )
+
+
+def encode_story(data: Dict[str, Any]) -> bytes:
+    """Encode a story as a header line followed by a line per scene.
+
+    The header's scene_index gives the offset and length in bytes of each
+    scene's line, counted from the end of the header line.
+    """
+    header = {key: value for key, value in data.items() if key != "acts"}
+    scene_index: List[List[Tuple[int, int]]] = []
+    lines: List[bytes] = []
+    offset = 0
+    for act in data["acts"]:
+        act_index = []
+        for scene in act:
+            line = dumps(scene).encode("utf-8") + b"\n"
+            act_index.append((offset, len(line)))
+            lines.append(line)
+            offset += len(line)
+        scene_index.append(act_index)
+    header["scene_index"] = scene_index
+    return dumps(header).encode("utf-8") + b"\n" + b"".join(lines)
+
+
+def read_story(filename: str) -> Dict[str, Any]:
+    """Decode a whole story file, in any format it was ever written in.
+
+    Returns:
+        The story in the story schema, or the raw jsonpickle data of files
+        that need migrating.
+    """
+    with open(filename, "rb") as read_file:
+        raw = read_file.read()
+    header_line, _, body = raw.partition(b"\n")
+    try:
+        header = loads(header_line.decode("utf-8"))
+    except ValueError:
+        return loads(raw.decode("utf-8"))  # One document over many lines
+    if "scene_index" not in header:
+        return header
+    data = {
+        key: value for key, value in header.items() if key != "scene_index"
+    }
+    data["acts"] = [
+        [
+            loads(body[offset : offset + length].decode("utf-8"))
+            for offset, length in act_index
+        ]
+        for act_index in header["scene_index"]
+    ]
+    return data
+
+
+class StoryFile:
+    """Random access to a saved story's header and scenes.
+
+    Opening the file decodes only its header line. Scenes are read, by
+    seeking to them, when they're asked for.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        with open(filename, "rb") as read_file:
+            header_line = read_file.readline()
+        self._body_start = len(header_line)
+        self._acts: Optional[List[List[Dict[str, Any]]]] = None
+        try:
+            header = loads(header_line.decode("utf-8"))
+        except ValueError:
+            header = read_story(filename)
+        if is_jsonpickle(header):
+            raise ValueError(f"{filename} needs migrating to be read.")
+        check_schema(header)
+        if "scene_index" in header:
+            self._scene_index = header.pop("scene_index")
+        else:
+            # Files before the scene index hold every scene in one document
+            self._acts = header.pop("acts")
+            self._scene_index = [[(0, 0)] * len(act) for act in self._acts]
+        self.header = header
+
+    def scene_counts(self) -> List[int]:
+        """Returns the number of scenes written in each act."""
+        return [len(act_index) for act_index in self._scene_index]
+
+    def scene(self, act_number: int, scene_number: int) -> Dict[str, Any]:
+        """Returns an encoded scene, counting acts and scenes from 1."""
+        if act_number < 1 or scene_number < 1:
+            raise IndexError(f"No scene {scene_number} in act {act_number}")
+        if self._acts is not None:
+            return self._acts[act_number - 1][scene_number - 1]
+        offset, length = self._scene_index[act_number - 1][scene_number - 1]
+        with open(self.filename, "rb") as read_file:
+            read_file.seek(self._body_start + offset)
+            return loads(read_file.read(length).decode("utf-8"))
+
+    def act(self, act_number: int) -> List[Dict[str, Any]]:
+        """Returns the encoded scenes of an act, counting acts from 1."""
+        if act_number < 1:
+            raise IndexError(f"No act {act_number}")
+        if self._acts is not None:
+            return self._acts[act_number - 1]
+        act_index = self._scene_index[act_number - 1]
+        if not act_index:
+            return []
+        # An act's scenes are next to each other, so read them in one go
+        start = act_index[0][0]
+        end = act_index[-1][0] + act_index[-1][1]
+        with open(self.filename, "rb") as read_file:
+            read_file.seek(self._body_start + start)
+            block = read_file.read(end - start)
+        return [
+            loads(block[offset - start : offset - start + length].decode())
+            for offset, length in act_index
+        ]
+
+
+def place_from_setup(
+    scene_setup: str,
+) -> Optional[Tuple[Location, TimePeriod]]:
+    """Recover where and when a scene takes place from its setup."""
+    match = SETUP_PLACE.search(scene_setup)
+    if match is None:
+        return None
+    location = Location(
+        era=match["era"], area=match["area"], locale=match["locale"]
+    )
+    time_period = TimePeriod(
+        era=match["era"],
+        season=match["season"],
+        time_of_day=match["time_of_day"],
+    )
+    return location, time_period
+
+
+def time_period_to_dict(time_period: TimePeriod) -> Dict[str, str]:
+    return {
+        "era": time_period.era,
+        "season": time_period.season,
+        "time_of_day": time_period.time_of_day,
+    }
+
+
+def time_period_from_dict(data: Dict[str, str]) -> TimePeriod:
+    return TimePeriod(
+        era=data["era"],
+        season=data["season"],
+        time_of_day=data["time_of_day"],
+    )
+
+
+def location_to_dict(location: Location) -> Dict[str, Optional[str]]:
+    return {
+        "era": location.era,
+        "area": location.area,
+        "locale": location.locale,
+    }
+
+
+def location_from_dict(data: Dict[str, Optional[str]]) -> Location:
+    return Location(
+        era=data["era"],
+        area=data["area"],
+        locale=data["locale"],
+    )
+
+
+def character_to_dict(character: Character) -> Dict[str, Any]:
+    """Returns the fields a character is saved as."""
+    fields = Character.saved_fields + Character.optional_fields
+    return {
+        field: getattr(character, field)
+        for field in fields
+        if hasattr(character, field)
+    }
+
+
+def character_from_dict(data: Dict[str, Any]) -> Character:
+    """Rebuild a character without generating anything new."""
+    missing = set(Character.saved_fields) - set(data)
+    if missing:
+        raise ValueError(f"Character is missing: {', '.join(sorted(missing))}")
+    unknown = (
+        set(data)
+        - set(Character.saved_fields)
+        - set(Character.optional_fields)
+        - DERIVED_CHARACTER_FIELDS
+    )
+    if unknown:
+        raise ValueError(
+            f"Unknown character fields: {', '.join(sorted(unknown))}"
+        )
+    return Character.restore(data)
+
+
+def scene_to_dict(
+    scene: Scene,
+    roles: Dict[int, str],
+    wait_for_visual: bool = True,
+) -> Dict[str, Any]:
+    """Encode a scene, referring to the story's characters by role.
+
+    Args:
+        scene: Scene to encode.
+        roles: Role of each of the story's characters, keyed by id().
+        wait_for_visual: Whether to wait for a visual summary still being
+            written, or leave it out.
+    """
+    characters: Dict[str, Any] = {}
+    for role, character in scene.characters.items():
+        if roles.get(id(character)) == role:
+            characters[role] = None  # The story's character in that role
+        else:
+            characters[role] = character_to_dict(character)
+    return {
+        "scene_number": scene.scene_number,
+        "total_scenes_in_act": scene.total_scenes_in_act,
+        "scene_type": scene.scene_type,
+        "characters": characters,
+        "location": location_to_dict(scene.location),
+        "time_period": time_period_to_dict(scene.time_period),
+        "scene_setup": scene.scene_setup,
+        "scene_text": list(scene.scene_text),
+        "scene_summary": getattr(scene, "scene_summary", ""),
+        "scene_visual": ""
+        if not wait_for_visual and scene.visual_pending()
+        else getattr(scene, "scene_visual", ""),
+    }
+
+
+def scene_from_dict(
+    data: Dict[str, Any],
+    characters: Dict[str, Character],
+) -> Scene:
+    """Rebuild a scene without generating anything new.
+
+    Args:
+        data: Encoded scene.
+        characters: The story's characters by role.
+    """
+    scene = Scene.__new__(Scene)
+    scene.scene_number = data["scene_number"]
+    scene.total_scenes_in_act = data["total_scenes_in_act"]
+    scene.scene_type = data["scene_type"]
+    scene.characters = {
+        role: characters[role]
+        if character is None
+        else character_from_dict(character)
+        for role, character in data["characters"].items()
+    }
+    scene.location = location_from_dict(data["location"])
+    scene.time_period = time_period_from_dict(data["time_period"])
+    scene.scene_setup = data["scene_setup"]
+    scene.scene_text = list(data["scene_text"])
+    scene.scene_summary = data["scene_summary"]
+    scene.scene_visual = data["scene_visual"]
+    return scene
+
+
+def image_set_to_dict(image_set: ImageSet) -> Dict[str, Any]:
+    return {
+        "medium": image_set.medium,
+        "style": image_set.style,
+        "images": dict(image_set.images),
+    }
+
+
+def image_set_from_dict(data: Dict[str, Any]) -> ImageSet:
+    image_set = ImageSet(medium=data["medium"], style=data["style"])
+    image_set.images = dict(data["images"])
+    return image_set
@@ -1,17 +1,43 @@
-from typing import Dict, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
+import glob
 import logging
 import os.path
-import random
+import queue
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import jsonpickle
 
+from storytime import serialization
+from storytime.catalog import get_catalog
 from storytime.character import Character
-from storytime.gpt3 import generate_text
+from storytime.character_pool import CharacterPool
+from storytime.gpt3 import estimate_tokens, generate_text
 from storytime.image_set import ImageSet
+from storytime.location import Location
 from storytime.narrator import Narrator
-from storytime.scene import Scene
+from storytime.rng import derive_rng, new_seed
+from storytime.scene import Scene, SceneContext, ScenePlan
 from storytime.time_period import TimePeriod
+from storytime.tokens import (
+    MAX_TOKENS,
+    count_tokens,
+    fit_prompt,
+    output_budget,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,12 +46,131 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+_checkpoint_lock = threading.Lock()
+# A scene's line in an outline, e.g. "A1S2: Cerelia finds the ring."
+OUTLINE_LINE = re.compile(
+    r"^[ \t]*(?P<label>A\d+S\d+)[ \t]*[:.)-][ \t]*(?P<outline>\S.*)$",
+    flags=re.MULTILINE,
+)
+
+
+class CostEstimate(NamedTuple):
+    """Requests a story will make, estimated from its plan."""
+
+    text_requests: int
+    prompt_tokens: int  # Of the prompts known before writing
+    max_tokens: int  # Most tokens the text requests can count, all told
+    image_requests: int
+    speech_requests: int
+
 
 def load_from_json(filename: str) -> "Story":
-    """Load a story from a JSON file."""
-    with open(filename) as read_file:
-        new_story = jsonpickle.decode(read_file.read())
-    return new_story
+    """Load a story from a JSON file.
+
+    Files written with jsonpickle, before the story schema, are still read.
+    To read only some of a story, use LazyStory instead.
+    """
+    data = serialization.read_story(filename)
+    if serialization.is_jsonpickle(data):
+        with open(filename) as read_file:
+            old_story = jsonpickle.decode(read_file.read())
+        for act in old_story.acts:
+            for scene in act:
+                _repair_references(old_story, scene)
+        # Round trip through the schema to fill in newer attributes
+        return Story.from_dict(old_story.to_dict())
+    return Story.from_dict(data)
+
+
+def _repair_references(story: "Story", scene: Scene) -> None:
+    """Relink what jsonpickle may have restored from the wrong reference.
+
+    jsonpickle can restore an object shared between scenes as some other
+    object from the file, so characters are relinked by role, and the
+    location and time period are read back from the scene's setup.
+    """
+    for role in scene.characters:
+        if role in story.characters:
+            scene.characters[role] = story.characters[role]
+    place = serialization.place_from_setup(scene.scene_setup)
+    if place is None:
+        raise ValueError(f"Can't recover the place of {scene.scene_setup}")
+    scene.location, scene.time_period = place
+    # Locations keep the era the story started in, even if time moved on
+    scene.location.era = story.time_period.era
+
+
+def migrate_json(filename: str) -> bool:
+    """Rewrite a story file using the latest story schema.
+
+    Returns:
+        Whether the file needed migrating.
+    """
+    data = serialization.read_story(filename)
+    if (
+        not serialization.is_jsonpickle(data)
+        and data["schema_version"] == serialization.SCHEMA_VERSION
+    ):
+        return False
+    write_json(load_from_json(filename), filename)
+    logger.info(
+        f"Migrated {filename} to schema version "
+        f"{serialization.SCHEMA_VERSION}"
+    )
+    return True
+
+
+def write_json(
+    story: "Story",
+    filename: str,
+    wait_for_visuals: bool = True,
+) -> Dict[str, Any]:
+    """Write a story to a file, replacing any earlier version in one step.
+
+    A crash while writing never leaves a partial file behind. Unless
+    wait_for_visuals is set, scenes still being visually summarized are
+    written without their visual summary.
+
+    Returns:
+        The story as it was written, in the story schema.
+    """
+    with _checkpoint_lock:
+        data = story.to_dict(wait_for_visuals)
+        encoded = serialization.encode_story(data)
+        temp_file = f"{filename}.tmp"
+        with open(temp_file, "wb") as write_file:
+            write_file.write(encoded)
+        os.replace(temp_file, filename)
+    return data
+
+
+def resume(
+    checkpoint_file: Optional[str] = None,
+    story_id: Optional[str] = None,
+) -> "Story":
+    """Finish writing a story from its checkpoint file.
+
+    Scenes and images that were already written are kept, and the story's
+    narration skips the files it already has.
+
+    Args:
+        checkpoint_file: The story's checkpoint file.
+        story_id: The id the story was created with, to find its checkpoint
+            file by instead.
+    """
+    if checkpoint_file is None:
+        if story_id is None:
+            raise ValueError("Give a checkpoint file or a story id.")
+        checkpoint_file = find_checkpoint(story_id)
+    story = load_from_json(checkpoint_file)
+    story.checkpoint_file = checkpoint_file
+    logger.info(f"Resuming {story.story_id} from {checkpoint_file}")
+    story.write_missing_visuals()
+    story.render()
+    # Visuals checkpoint themselves once written, which can be after
+    # generate() has their results, so the checkpoint is finished here
+    story.save_checkpoint()
+    return story
 
 
 def get_save_path():
@@ -48,6 +193,30 @@ def get_save_path():
     return save_path
 
 
+def scene_label(act_number: int, scene_number: int) -> str:
+    """Label a scene by its act and scene numbers, e.g. "A1S2"."""
+    return f"A{act_number}S{scene_number}"
+
+
+def get_checkpoint_path(seed: int, story_id: str) -> str:
+    """Checkpoint file of a story, by its seed and the id it was created with.
+
+    Titles can repeat and aren't known until they're written, so the
+    checkpoint isn't named after the story's title.
+    """
+    return os.path.join(get_save_path(), f"{seed}-{story_id}.checkpoint.json")
+
+
+def find_checkpoint(story_id: str) -> str:
+    """Returns the checkpoint file of the story created with the id."""
+    matches = glob.glob(
+        os.path.join(get_save_path(), f"*-{story_id}.checkpoint.json")
+    )
+    if not matches:
+        raise FileNotFoundError(f"No checkpoint for story {story_id}")
+    return matches[0]
+
+
 def get_story_image_dir(title: str) -> str:
     story_image_dir = os.path.join(
         get_save_path(),
@@ -413,6 +582,8 @@ class Story:
 
     MAX_SCENES_PER_ACT = 2  # Should be even for scene and sequel
     MAX_TERTIARY_CHARACTERS = 3  # In addition to 6 primary characters
+    MAX_PARALLEL_ACTS = 8  # Acts written at once when writing in parallel
+    MAX_PARALLEL_SCENES = 8  # Scenes written at once from an outline
 
     def __init__(
         self,
@@ -426,17 +597,47 @@ class Story:
         with_images: bool = False,
         medium: Optional[str] = None,
         style: Optional[str] = None,
+        single_request_scenes: bool = False,
+        parallel_acts: bool = False,
+        outline_first: bool = False,
+        checkpoint: bool = False,
+        deferred: bool = False,
+        seed: Optional[int] = None,
+        plan_only: bool = False,
+        character_pool: Optional[CharacterPool] = None,
     ) -> None:
-        """Generate a story based on the target audience and genre."""
+        """Generate a story based on the target audience and genre.
+
+        Set single_request_scenes to write each scene's parts with one request
+        instead of one request per part, and parallel_acts to write the acts
+        concurrently instead of one after another. Set outline_first to
+        outline every scene first, then write the scenes of every act
+        concurrently from the outline instead of one after another.
+        Set checkpoint to save the
+        story after every scene, image and narration file, so an interrupted
+        story can be finished with resume(). Set deferred to only plan the
+        story, leaving the writing to generate() or stream(). Set plan_only
+        to stop before making any requests at all: the story is planned, its
+        cost can be estimated, and render() writes it.
+
+        Every random choice is drawn from generators seeded with seed, so the
+        same seed plans the same story, and scenes are set up the same way.
+        A seed is picked, and kept with the story, if none is given. Give a
+        character_pool to take the cast from characters made ahead of time
+        instead, which the seed doesn't decide.
+        """
+        self.seed = new_seed() if seed is None else seed
+        rng = derive_rng(self.seed)
+
         # Select a target audience if none is provided
         if target_audience is None:
-            self.target_audience = random.choice(self.target_audiences)
+            self.target_audience = rng.choice(self.target_audiences)
         else:
             self.target_audience = target_audience
 
         # Select a random genre if none is provided
         if genre is None:
-            self.genre = random.choice(self.genres)
+            self.genre = rng.choice(self.genres)
         else:
             self.genre = genre
 
@@ -444,7 +645,7 @@ class Story:
         if themes is None:
             self.themes = []
             for i in range(2):
-                self.themes.append(random.choice(self.thematic_concepts))
+                self.themes.append(rng.choice(self.thematic_concepts))
         else:
             self.themes = themes
 
@@ -455,7 +656,7 @@ class Story:
 
         # Get a random narrative structure if none is provided
         if narrative_structure is None:
-            self.narrative_structure = random.choice(
+            self.narrative_structure = rng.choice(
                 list(self.narrative_structures.keys())
             )
         else:
@@ -467,29 +668,112 @@ class Story:
 
         # Get a random time period if none is provided
         if time_period is None:
-            self.time_period = TimePeriod()
+            self.time_period = TimePeriod(seed=rng)
         else:
             self.time_period = time_period
 
-        # Generate some characters
+        # Generate some characters, leaving their names to be picked once
+        # the story is rendered
         if characters is None:
-            self.characters = {
-                "protagonist": Character(self.time_period.era),
-                "antagonist": Character(self.time_period.era),
-                "deuteragonist": Character(self.time_period.era),
-                "confidante": Character(self.time_period.era),
-                "love interest": Character(self.time_period.era),
-                "foil": Character(self.time_period.era),
-            }
-            for i in range(random.randint(0, self.MAX_TERTIARY_CHARACTERS)):
-                self.characters[f"tertiary {i}"] = Character(
-                    self.time_period.era
+            era = self.time_period.era
+            roles = [
+                "protagonist",
+                "antagonist",
+                "deuteragonist",
+                "confidante",
+                "love interest",
+                "foil",
+            ]
+            if character_pool is not None:
+                tertiaries = rng.randint(0, self.MAX_TERTIARY_CHARACTERS)
+                roles += [f"tertiary {i}" for i in range(tertiaries)]
+                cast = [character_pool.take(era) for _ in roles]
+            else:
+                cast = Character.generate_many(
+                    len(roles), era, seed=rng, deferred=True
+                )
+                tertiaries = rng.randint(0, self.MAX_TERTIARY_CHARACTERS)
+                roles += [f"tertiary {i}" for i in range(tertiaries)]
+                cast += Character.generate_many(
+                    tertiaries, era, seed=rng, deferred=True
                 )
+            self.characters = dict(zip(roles, cast))
         else:
             self.characters = characters
 
+        # Author
+        self.author = "GPT-3"
+
+        # Remember how to write the rest of the story, so generation can
+        # resume from a checkpoint
+        self.area = area
+        self.single_request_scenes = single_request_scenes
+        self.parallel_acts = parallel_acts
+        self.outline_first = outline_first
+        self.outline: Dict[str, str] = {}
+        self.with_images = with_images
+        if with_images:
+            self.illustrator = "DALL-E"
+            # TODO: Define medium and style for image set based on genre and
+            #  era
+            self.image_set = ImageSet(
+                medium=medium,
+                style=style,
+                seed=rng,
+            )
+        self.narrated: List[str] = []
+        self.checkpoint = checkpoint
+        # Tells stories apart, even ones with the same seed and title
+        self.story_id = uuid.uuid4().hex
+        self.checkpoint_file: Optional[str] = None
+        if checkpoint:
+            self.checkpoint_file = get_checkpoint_path(
+                self.seed, self.story_id
+            )
+
+        # Each act starts empty and is filled in as its scenes are written
+        self.acts: List[List[Scene]] = [[] for _ in self.plot_elements]
+        if plan_only:
+            return
+        self.prepare()
+        if not deferred:
+            self.generate()
+
+    def prepare(self) -> None:
+        """Look up what the plan left out, and write the title.
+
+        These are the only requests made before the scenes are written.
+        """
+        for character in self.characters.values():
+            character.resolve()
         # Generate the synopsis
-        self.synopsis = (
+        self.synopsis = self.plan_synopsis()
+        # Checkpoint before the first request, which could fail
+        self.save_checkpoint()
+
+        # Write a title
+        prompt, max_tokens = fit_prompt(
+            f"Write a title for {self.synopsis}", "title"
+        )
+        self.title = (
+            generate_text(prompt, max_tokens=max_tokens)
+            .strip()
+            .replace('"', "")
+        )
+        if ":" in self.title:
+            self.subtitle = self.title.split(":")[1].strip()
+            self.title = self.title.split(":")[0].strip()
+        self.save_checkpoint()
+
+    def render(self) -> None:
+        """Write a story that was only planned."""
+        if getattr(self, "title", None) is None:
+            self.prepare()
+        self.generate()
+
+    def plan_synopsis(self) -> str:
+        """Returns the synopsis the title is written from."""
+        return (
             f"A {self.genre} story targeted at {self.target_audience}"
             f" during the {self.time_period.era} era. "
             f"{self.characters['protagonist']} must grapple with"
@@ -500,72 +784,382 @@ class Story:
             f"{self.time_period.season}."
         )
 
-        # Write a title
-        self.title = (
-            generate_text(f"Write a title for {self.synopsis}", max_tokens=30)
-            .strip()
-            .replace('"', "")
+    def plan_act(self, act_number: int) -> List[ScenePlan]:
+        """Plan the scenes of an act that haven't been written yet.
+
+        Planning makes no requests, and plans the same scenes each time.
+        """
+        scenes = self.acts[act_number]
+        if scenes:
+            total_scenes_in_act = scenes[0].total_scenes_in_act
+        elif self.MAX_SCENES_PER_ACT == 2:
+            total_scenes_in_act = 2
+        else:
+            total_scenes_in_act = derive_rng(
+                self.seed, f"A{act_number + 1}"
+            ).randrange(
+                2,
+                self.MAX_SCENES_PER_ACT,
+                2,
+            )
+        previous_scene: Optional[Union[SceneContext, ScenePlan]] = (
+            scenes[-1].context() if scenes else None
         )
-        if ":" in self.title:
-            self.subtitle = self.title.split(":")[1].strip()
-            self.title = self.title.split(":")[0].strip()
+        plans = []
+        for scene_number in range(len(scenes) + 1, total_scenes_in_act + 1):
+            previous_scene = Scene.plan(
+                target_audience=self.target_audience,
+                genre=self.genre,
+                themes=self.themes,
+                act_description=list(self.plot_elements.values())[act_number],
+                time_period=self.time_period,
+                characters=self.characters,
+                total_scenes_in_act=total_scenes_in_act,
+                previous_scene=previous_scene,
+                area=self.area,
+                # Each scene has its own generator, so acts written in
+                # parallel, or resumed, set up their scenes the same way
+                seed=derive_rng(
+                    self.seed, scene_label(act_number + 1, scene_number)
+                ),
+            )
+            plans.append(previous_scene)
+        return plans
 
-        # Author
-        self.author = "GPT-3"
+    def outline_prompts(self) -> List[str]:
+        """Returns the prompts to outline the scenes without an outline yet.
 
-        # Generate the plot as a series of acts with scenes
-        self.acts = []
-        for act_description in self.plot_elements.values():
-            scenes: List["Scene"] = []
-            if self.MAX_SCENES_PER_ACT == 2:
-                total_scenes_in_act = 2
-            else:
-                total_scenes_in_act = random.randrange(
-                    2,
-                    self.MAX_SCENES_PER_ACT,
-                    2,
+        Acts are outlined together until their prompt would leave too little
+        room for the outline, then the rest go in another prompt.
+        """
+        prompt_start = (
+            f"Outline the scenes of {self.plan_synopsis()} The scenes are:\n"
+        )
+        prompt_end = (
+            "\nFor each scene write one line starting with its label, "
+            "e.g. 'A1S1: ', saying what happens in it, so that each scene "
+            "follows on from the one before it."
+        )
+        prompt_limit = MAX_TOKENS - output_budget("outline")
+        prompts = []
+        lines: List[str] = []
+        for act_number, act_plans in enumerate(self.plan(), 1):
+            act_description = list(self.plot_elements.values())[act_number - 1]
+            # Describe each act once, rather than in each of its scenes
+            act_lines = [f"In act {act_number}, {act_description}"]
+            for plan in act_plans:
+                label = scene_label(act_number, plan.scene_number)
+                if label in self.outline:
+                    continue
+                cast = ", ".join(
+                    f"{character.name} the {role}"
+                    for role, character in plan.characters.items()
                 )
-            logger.info(
-                f"Generating {total_scenes_in_act} scenes for "
-                f"{act_description}."
+                act_lines.append(
+                    f"{label}: a {plan.scene_type} in a "
+                    f"{plan.location.locale} during "
+                    f"{plan.time_period.time_of_day} with {cast}"
+                )
+            if len(act_lines) == 1:
+                continue
+            prompt = prompt_start + "\n".join(lines + act_lines) + prompt_end
+            if lines and count_tokens(prompt) > prompt_limit:
+                prompts.append(prompt_start + "\n".join(lines) + prompt_end)
+                lines = []
+            lines.extend(act_lines)
+        if lines:
+            prompts.append(prompt_start + "\n".join(lines) + prompt_end)
+        return prompts
+
+    def write_outline(self) -> None:
+        """Outline the scenes without an outline yet.
+
+        Scenes the responses leave out are written without an outline.
+        """
+        prompts = self.outline_prompts()
+        if not prompts:
+            return
+        logger.info("Outlining the scenes.")
+        fitted = [fit_prompt(prompt, "outline") for prompt in prompts]
+        # Each prompt outlines different acts, so they're sent at once
+        with ThreadPoolExecutor(
+            max_workers=len(prompts), thread_name_prefix="outline"
+        ) as executor:
+            texts = list(
+                executor.map(
+                    lambda prompt, max_tokens: generate_text(
+                        prompt, max_tokens=max_tokens
+                    ),
+                    *zip(*fitted),
+                )
+            )
+        labels = set(
+            scene_label(act_number, plan.scene_number)
+            for act_number, act_plans in enumerate(self.plan(), 1)
+            for plan in act_plans
+        )
+        for match in OUTLINE_LINE.finditer("\n".join(texts)):
+            if match["label"] in labels:
+                self.outline[match["label"]] = match["outline"].strip()
+        missing = labels - set(self.outline)
+        if missing:
+            logger.warning(
+                f"The outline left out {len(missing)} scenes, writing them "
+                f"one after another."
+            )
+        self.save_checkpoint()
+
+    def plan(self) -> List[List[ScenePlan]]:
+        """Plan every scene that hasn't been written yet, act by act."""
+        return [
+            self.plan_act(act_number) for act_number in range(len(self.acts))
+        ]
+
+    def estimate_cost(self) -> CostEstimate:
+        """Estimate the requests still needed to finish the story.
+
+        The estimate is made from the plan, without making any requests.
+        Each request asks for at most its prompt type's output budget, and
+        summaries, whose prompts aren't known yet, are counted as filling
+        the text model's limit, so the token count is an upper bound.
+        """
+        text_requests = 0
+        prompt_tokens = 0
+        max_tokens = 0
+        scene_count = 0
+        speech_requests = sum(
+            label not in self.narrated for label in ["Title", "Outro"]
+        )
+        known_prompts = []  # Prompts and their types
+        if getattr(self, "title", None) is None:
+            known_prompts.append(
+                (f"Write a title for {self.plan_synopsis()}", "title")
+            )
+        if self.outline_first:
+            known_prompts.extend(
+                (prompt, "outline") for prompt in self.outline_prompts()
             )
-            # Generate scenes for each plot element
-            for i in range(total_scenes_in_act):
-                scenes.append(
-                    Scene(
-                        target_audience=self.target_audience,
-                        genre=self.genre,
-                        themes=self.themes,
-                        act_description=act_description,
-                        time_period=self.time_period,
-                        characters=self.characters,
-                        total_scenes_in_act=total_scenes_in_act,
-                        previous_scenes=scenes,
-                        area=area,
+        part_type = "scene" if self.single_request_scenes else "scene part"
+        for act_plans in self.plan():
+            for scene_plan in act_plans:
+                scene_count += 1
+                scene_setup = Scene.setup(scene_plan)
+                if self.single_request_scenes:
+                    prompts = [
+                        Scene.single_request_prompt(
+                            scene_plan.scene_type, scene_setup
+                        )
+                    ]
+                else:
+                    prompts = Scene.part_prompts(
+                        scene_plan.scene_type, scene_setup
                     )
+                known_prompts.extend((prompt, part_type) for prompt in prompts)
+                speech_requests += len(
+                    Scene.scene_types[scene_plan.scene_type]
                 )
-            # Add the scenes to the act
-            self.acts.append(scenes)
+                # Then a summary and a visual summary
+                text_requests += 2
+                max_tokens += 2 * MAX_TOKENS
+        for prompt, prompt_type in known_prompts:
+            text_requests += 1
+            prompt_tokens += estimate_tokens(prompt, None)
+            max_tokens += estimate_tokens(prompt, output_budget(prompt_type))
+        return CostEstimate(
+            text_requests=text_requests,
+            prompt_tokens=prompt_tokens,
+            max_tokens=max_tokens,
+            image_requests=scene_count if self.with_images else 0,
+            speech_requests=speech_requests,
+        )
 
-        # Add images if requested
-        if with_images:
-            self.with_images = with_images
-            self.illustrator = "DALL-E"
-            # TODO: Define medium and style for image set based on genre and
-            #  era
-            self.image_set = ImageSet(
-                medium=medium,
-                style=style,
-            )
-            # Generate an image for each scene
-            logger.info("Generating images for each scene.")
-            for act in self.acts:
-                for scene in act:
-                    label = (
-                        f"A{self.acts.index(act) + 1}S"
-                        f"{act.index(scene) + 1}"
+    def generate(self) -> None:
+        """Write the scenes and images that haven't been written yet."""
+        self.write_acts()
+        self.add_images()
+        for act in self.acts:
+            for scene in act:
+                scene.scene_visual  # Wait for the last visual summaries
+
+    def write_missing_visuals(self) -> None:
+        """Rewrite visual summaries still being written when checkpointed."""
+        for act in self.acts:
+            for scene in act:
+                if len(scene.scene_text) > 2 and not scene.scene_visual:
+                    scene.write_visual()
+                    scene.on_visual(self.save_checkpoint)
+
+    def stream(self, images: bool = True) -> Iterator[Tuple[int, int, Scene]]:
+        """Write the story, yielding each scene as soon as it's written.
+
+        Yields the act number, scene number (both starting at 1) and scene,
+        starting with any scenes that were already written. Scenes from
+        parallel acts arrive in the order they finish. Images, if requested,
+        are added once every scene is written, unless images is False
+        because the caller illustrates each scene itself.
+        """
+        for act_number, act in enumerate(self.acts, 1):
+            for scene_number, scene in enumerate(act, 1):
+                yield act_number, scene_number, scene
+        written: "queue.Queue[Optional[Tuple[int, int, Scene]]]" = (
+            queue.Queue()
+        )
+        errors: List[BaseException] = []
+
+        def write() -> None:
+            try:
+                self.write_acts(
+                    on_scene=lambda act_number, scene_number, scene: (
+                        written.put((act_number, scene_number, scene))
                     )
-                    self.image_set.add_scene_image(label, scene)
+                )
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                written.put(None)  # No more scenes
+
+        threading.Thread(
+            target=write,
+            name="story-stream",
+            daemon=True,
+        ).start()
+        while True:
+            item = written.get()
+            if item is None:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+        if images:
+            self.add_images()
+
+    def write_acts(
+        self,
+        on_scene: Optional[Callable[[int, int, Scene], None]] = None,
+    ) -> None:
+        """Write the scenes that haven't been written yet.
+
+        on_scene, if given, is called with the act number, scene number and
+        scene as each new scene is written.
+        """
+        if self.outline_first:
+            self.write_outline()
+        self.write_outlined_scenes(on_scene)
+        # Generate the plot as a series of acts with scenes. Scenes only
+        # follow on from scenes in the same act, so acts can be written at
+        # the same time.
+        act_numbers = range(len(self.acts))
+        if self.parallel_acts:
+            with ThreadPoolExecutor(
+                max_workers=self.MAX_PARALLEL_ACTS,
+                thread_name_prefix="act",
+            ) as executor:
+                list(
+                    executor.map(
+                        lambda act_number: self.write_act(
+                            act_number, on_scene
+                        ),
+                        act_numbers,
+                    )
+                )
+        else:
+            for act_number in act_numbers:
+                self.write_act(act_number, on_scene)
+
+    def add_images(self) -> None:
+        """Add an image for each scene that doesn't have one yet."""
+        if not self.with_images:
+            return
+        logger.info("Generating images for each scene.")
+        labeled_scenes = {}
+        for act_number, act in enumerate(self.acts, 1):
+            for scene_number, scene in enumerate(act, 1):
+                label = scene_label(act_number, scene_number)
+                if not self.image_set.images.get(label):
+                    labeled_scenes[label] = scene
+        self.image_set.add_scene_images(
+            labeled_scenes,
+            on_image=lambda label: self.save_checkpoint(),
+        )
+
+    def write_outlined_scenes(
+        self,
+        on_scene: Optional[Callable[[int, int, Scene], None]] = None,
+    ) -> None:
+        """Write every act whose remaining scenes are all outlined.
+
+        Each scene has its outline to go on instead of a summary of the
+        scene before it, so the scenes of all those acts are written at the
+        same time.
+        """
+        # Act number, plan and outline of each scene
+        outlined: List[Tuple[int, ScenePlan, Optional[str]]] = []
+        for act_number, plans in enumerate(self.plan()):
+            outline = [
+                self.outline.get(
+                    scene_label(act_number + 1, plan.scene_number)
+                )
+                for plan in plans
+            ]
+            if plans and None not in outline:
+                outlined.extend(zip([act_number] * len(plans), plans, outline))
+        if not outlined:
+            return
+        logger.info(f"Generating {len(outlined)} scenes from the outline.")
+        with ThreadPoolExecutor(
+            max_workers=self.MAX_PARALLEL_SCENES,
+            thread_name_prefix="scene",
+        ) as executor:
+            # Scenes come back in story order, so each act's stay in order
+            written = executor.map(
+                lambda plan, scene_outline: Scene.from_plan(
+                    plan,
+                    single_request=self.single_request_scenes,
+                    outline=scene_outline,
+                ),
+                [plan for _, plan, _ in outlined],
+                [scene_outline for _, _, scene_outline in outlined],
+            )
+            for (act_number, _, _), scene in zip(outlined, written):
+                scenes = self.acts[act_number]
+                with _checkpoint_lock:
+                    scenes.append(scene)
+                self.save_checkpoint()
+                scene.on_visual(self.save_checkpoint)
+                if on_scene is not None:
+                    on_scene(act_number + 1, len(scenes), scene)
+
+    def write_act(
+        self,
+        act_number: int,
+        on_scene: Optional[Callable[[int, int, Scene], None]] = None,
+    ) -> List[Scene]:
+        """Write the remaining scenes for one plot element."""
+        act_description = list(self.plot_elements.values())[act_number]
+        scenes = self.acts[act_number]
+        plans = self.plan_act(act_number)
+        if plans:
+            logger.info(
+                f"Generating {len(plans)} scenes for {act_description}."
+            )
+        # Generate scenes for each plot element
+        for plan in plans:
+            previous_summary = None
+            if scenes and scenes[-1].scene_text:
+                previous_summary = scenes[-1].scene_summary
+            scene = Scene.from_plan(
+                plan,
+                previous_summary,
+                single_request=self.single_request_scenes,
+            )
+            with _checkpoint_lock:
+                scenes.append(scene)
+            self.save_checkpoint()
+            # Checkpoint again once the scene's visual summary is written
+            scene.on_visual(self.save_checkpoint)
+            if on_scene is not None:
+                on_scene(act_number + 1, len(scenes), scene)
+        return scenes
 
     def __str__(self):
         """Return a string representation of the story."""
@@ -577,6 +1171,109 @@ class Story:
                 full_story += str(scene) + "\n\n"
         return full_story
 
+    def to_dict(self, wait_for_visuals: bool = True) -> Dict[str, Any]:
+        """Return the story as plain data in the story schema.
+
+        Unless wait_for_visuals is set, scenes still being visually
+        summarized are returned without their visual summary.
+        """
+        roles = {
+            id(character): role for role, character in self.characters.items()
+        }
+        data: Dict[str, Any] = {
+            "schema_version": serialization.SCHEMA_VERSION,
+            "story_id": getattr(self, "story_id", None),
+            "title": getattr(self, "title", None),
+            "subtitle": getattr(self, "subtitle", None),
+            "author": self.author,
+            "seed": getattr(self, "seed", None),
+            "synopsis": self.synopsis,
+            "target_audience": self.target_audience,
+            "genre": self.genre,
+            "themes": list(self.themes),
+            "narrative_structure": self.narrative_structure,
+            "time_period": serialization.time_period_to_dict(self.time_period),
+            "characters": {
+                role: serialization.character_to_dict(character)
+                for role, character in self.characters.items()
+            },
+            "area": getattr(self, "area", None),
+            "single_request_scenes": getattr(
+                self, "single_request_scenes", False
+            ),
+            "parallel_acts": getattr(self, "parallel_acts", False),
+            "outline_first": getattr(self, "outline_first", False),
+            "outline": dict(getattr(self, "outline", {})),
+            "with_images": getattr(self, "with_images", False),
+            "narrated": list(getattr(self, "narrated", [])),
+            "checkpoint_file": getattr(self, "checkpoint_file", None),
+            "acts": [
+                [
+                    serialization.scene_to_dict(
+                        scene, roles, wait_for_visual=wait_for_visuals
+                    )
+                    for scene in act
+                ]
+                for act in self.acts
+            ],
+        }
+        if data["with_images"]:
+            data["illustrator"] = self.illustrator
+            data["image_set"] = serialization.image_set_to_dict(self.image_set)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Story":
+        """Rebuild a story from plain data without generating anything."""
+        serialization.check_schema(data)
+        story = cls.__new__(cls)
+        # Stories saved before ids have none, checkpoints before their
+        # title is written have no title
+        story.story_id = data.get("story_id")
+        story.title = data["title"]
+        if data["subtitle"] is not None:
+            story.subtitle = data["subtitle"]
+        story.author = data["author"]
+        story.seed = data.get("seed")  # Stories saved before seeds have none
+        story.synopsis = data["synopsis"]
+        story.target_audience = data["target_audience"]
+        story.genre = data["genre"]
+        story.themes = list(data["themes"])
+        story.narrative_structure = data["narrative_structure"]
+        story.plot_elements = cls.narrative_structures[
+            story.narrative_structure
+        ]
+        story.time_period = serialization.time_period_from_dict(
+            data["time_period"]
+        )
+        story.characters = {
+            role: serialization.character_from_dict(character)
+            for role, character in data["characters"].items()
+        }
+        story.area = data["area"]
+        story.single_request_scenes = data["single_request_scenes"]
+        story.parallel_acts = data["parallel_acts"]
+        # Stories saved before outlines have neither
+        story.outline_first = data.get("outline_first", False)
+        story.outline = dict(data.get("outline", {}))
+        story.with_images = data["with_images"]
+        if story.with_images:
+            story.illustrator = data["illustrator"]
+            story.image_set = serialization.image_set_from_dict(
+                data["image_set"]
+            )
+        story.narrated = list(data["narrated"])
+        story.checkpoint_file = data["checkpoint_file"]
+        story.checkpoint = story.checkpoint_file is not None
+        story.acts = [
+            [
+                serialization.scene_from_dict(encoded_scene, story.characters)
+                for encoded_scene in encoded_act
+            ]
+            for encoded_act in data["acts"]
+        ]
+        return story
+
     def save_as_json(self) -> str:
         """Save a JSON representation of the story."""
         save_path = get_save_path()
@@ -586,11 +1283,32 @@ class Story:
             f"{save_path}"
             f"{''.join(c for c in self.title if c.isalnum())}.json"
         )
-        with open(filename, "w") as write_file:
-            write_file.write(jsonpickle.encode(self, keys=True, indent=4))
+        data = write_json(self, filename)
         logger.info(f"Story written to {filename}")
+        get_catalog(save_path).add_story(
+            data,
+            filename,
+            assets={
+                "image_dir": get_story_image_dir(self.title)
+                if self.with_images
+                else None,
+                "audio_dir": get_story_audio_dir(self.title)
+                if self.narrated
+                else None,
+            },
+        )
         return filename
 
+    def save_checkpoint(self) -> None:
+        """Save the story so far to its checkpoint file, if it has one."""
+        if self.checkpoint_file is None:
+            return
+        directory = os.path.dirname(self.checkpoint_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        write_json(self, self.checkpoint_file, wait_for_visuals=False)
+        logger.debug(f"Checkpoint written to {self.checkpoint_file}")
+
     def download_image_set(self):
         """Download images for the story."""
         if self.with_images:
@@ -599,69 +1317,152 @@ class Story:
                 os.mkdir(image_dir)
             self.image_set.save_images(image_dir)
 
-    def add_narration(self):
-        """Add narration to the story."""
-        logger.info("Generating narration.")
-        narrator = Narrator()
-        story_audio_dir = get_story_audio_dir(self.title)
-        if not os.path.exists(story_audio_dir):
-            os.mkdir(story_audio_dir)
-        # Generate narration for the title
-        label = "Title"
+    def scene_labels(self) -> List[str]:
+        """Return the labels of the written scenes in story order."""
+        return [
+            scene_label(act_number, scene_number)
+            for act_number, act in enumerate(self.acts, 1)
+            for scene_number in range(1, len(act) + 1)
+        ]
+
+    def scene_narration(
+        self,
+        act_number: int,
+        scene_number: int,
+    ) -> Dict[str, str]:
+        """Return the text of each part of a scene, keyed by its label."""
+        scene = self.acts[act_number - 1][scene_number - 1]
+        return {
+            f"{scene_label(act_number, scene_number)}P{part_number}": part
+            for part_number, part in enumerate(scene.scene_text, 1)
+        }
+
+    def title_narration(self, narrator_name: str) -> str:
+        """Return the text introducing the story."""
         title_text = (
             f"{self.title}: {self.subtitle}. " f"Written by {self.author}."
         )
         if self.with_images:
             title_text += f" Illustrated by {self.illustrator}."
-        title_text += f" Narrated by {narrator.name}."
-        narrator.synthesize_speech(
-            text_input=title_text,
-            voice_gender="MALE",
-            output_file=f"{story_audio_dir}{label}.mp3",
-        )
-        # Generate narration for each scene
-        for act in self.acts:
-            for scene in act:
-                for part in scene.scene_text:
-                    label = (
-                        f"A{self.acts.index(act) + 1}S"
-                        f"{act.index(scene) + 1}P"
-                        f"{scene.scene_text.index(part) + 1}"
-                    )
-                    logger.info(f"Generating narration for {label}.")
-                    narrator.synthesize_speech(
-                        text_input=part,
-                        voice_gender="MALE",
-                        output_file=f"{story_audio_dir}{label}.mp3",
-                    )
-        outro_text = (
+        title_text += f" Narrated by {narrator_name}."
+        return title_text
+
+    def outro_narration(self) -> str:
+        """Return the text closing the story."""
+        return (
             f"This is the end of {self.title} by {self.author}. "
             f"Thank you for listening."
         )
-        label = "Outro"
+
+    def narrate(self, narrator: Narrator, label: str, text: str) -> None:
+        """Narrate one labeled piece of the story, unless it already is."""
+        if label in self.narrated:
+            return
+        story_audio_dir = get_story_audio_dir(self.title)
+        os.makedirs(story_audio_dir, exist_ok=True)
+        logger.info(f"Generating narration for {label}.")
         narrator.synthesize_speech(
-            text_input=outro_text,
+            text_input=text,
             voice_gender="MALE",
             output_file=f"{story_audio_dir}{label}.mp3",
         )
+        with _checkpoint_lock:
+            self.narrated.append(label)
+        self.save_checkpoint()
+
+    def add_narration(self):
+        """Add narration to the story.
+
+        Narration already recorded in self.narrated is skipped, so a resumed
+        story only pays for the files it's missing.
+        """
+        logger.info("Generating narration.")
+        narrator = Narrator()
+        narration = {"Title": self.title_narration(narrator.name)}
+        for act_number, act in enumerate(self.acts, 1):
+            for scene_number in range(1, len(act) + 1):
+                narration.update(
+                    self.scene_narration(act_number, scene_number)
+                )
+        narration["Outro"] = self.outro_narration()
+        for label, text in narration.items():
+            self.narrate(narrator, label, text)
 
     def get_narration_file_list(self) -> List[str]:
-        """Get the narration files for the story."""
-        story_audio_dir = os.path.join(
-            get_save_path(),
-            f"{''.join(c for c in self.title if c.isalnum())}Audio",
-            "",
-        )
+        """Get the narration files for the story in story order."""
+        story_audio_dir = get_story_audio_dir(self.title)
         audio_files = []
         if os.path.exists(story_audio_dir):
             audio_files.append(os.path.join(story_audio_dir, "Title.mp3"))
-            for file in os.listdir(story_audio_dir):
-                if file.startswith("A") and file.endswith(".mp3"):
-                    audio_files.append(os.path.join(story_audio_dir, file))
+            for act_number, act in enumerate(self.acts, 1):
+                for scene_number in range(1, len(act) + 1):
+                    for label in self.scene_narration(
+                        act_number, scene_number
+                    ):
+                        audio_file = os.path.join(
+                            story_audio_dir, f"{label}.mp3"
+                        )
+                        if os.path.exists(audio_file):
+                            audio_files.append(audio_file)
             audio_files.append(os.path.join(story_audio_dir, "Outro.mp3"))
         return audio_files
 
 
+class LazyStory:
+    """A saved story that's only decoded as far as it's read.
+
+    The story's metadata (title, synopsis, genre, ...) is available as
+    attributes as soon as it's opened, while its characters and scenes are
+    only decoded when asked for.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self._file = serialization.StoryFile(filename)
+        self._characters: Optional[Dict[str, Character]] = None
+        metadata = dict(self._file.header)
+        del metadata["characters"]
+        metadata["time_period"] = serialization.time_period_from_dict(
+            metadata["time_period"]
+        )
+        self.__dict__.update(metadata)
+
+    @property
+    def characters(self) -> Dict[str, Character]:
+        """Returns the story's characters by role."""
+        if self._characters is None:
+            self._characters = {
+                role: serialization.character_from_dict(character)
+                for role, character in self._file.header["characters"].items()
+            }
+        return self._characters
+
+    def scene_counts(self) -> List[int]:
+        """Returns the number of scenes written in each act."""
+        return self._file.scene_counts()
+
+    def scene(self, act_number: int, scene_number: int) -> Scene:
+        """Read one scene, counting acts and scenes from 1."""
+        return serialization.scene_from_dict(
+            self._file.scene(act_number, scene_number), self.characters
+        )
+
+    def act(self, act_number: int) -> List[Scene]:
+        """Read the scenes of one act, counting acts from 1."""
+        return [
+            serialization.scene_from_dict(encoded_scene, self.characters)
+            for encoded_scene in self._file.act(act_number)
+        ]
+
+    def load(self) -> Story:
+        """Read the whole story."""
+        data = dict(self._file.header)
+        data["acts"] = [
+            self._file.act(act_number)
+            for act_number in range(1, len(self.scene_counts()) + 1)
+        ]
+        return Story.from_dict(data)
+
+
 if __name__ == "__main__":
     story = Story()
     story.save_as_json()
@@ -1,6 +1,6 @@
 from typing import Optional
 
-import random
+from storytime.rng import Seed, get_rng
 
 
 class TimePeriod:
@@ -44,19 +44,21 @@ class TimePeriod:
         era: Optional[str] = None,
         season: Optional[str] = None,
         time_of_day: Optional[str] = None,
+        seed: Seed = None,
     ):
+        rng = get_rng(seed)
         if era:
             self.era = era
         else:
-            self.era = random.choice(self.eras)
+            self.era = rng.choice(self.eras)
         if season:
             self.season = season
         else:
-            self.season = random.choice(self.seasons)
+            self.season = rng.choice(self.seasons)
         if time_of_day:
             self.time_of_day = time_of_day
         else:
-            self.time_of_day = random.choice(self.times_of_day)
+            self.time_of_day = rng.choice(self.times_of_day)
 
     def __str__(self) -> str:
         return f"{self.era} {self.season} {self.time_of_day}"
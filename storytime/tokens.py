@@ -0,0 +1,109 @@
+"""Token counting and per-request token budgets.
+
+Prompts are measured with the model's own tokenizer when tiktoken is
+installed, and estimated from their length when it isn't. Every request asks
+for no more output than its kind of prompt needs, and a prompt too long to
+leave room for that output is trimmed to fit.
+"""
+from typing import Any, Optional, Tuple
+
+import functools
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # Estimate from the length of the text instead
+    tiktoken = None
+
+MODEL = "text-davinci-003"  # For testing use: "text-curie-001"  #
+MAX_TOKENS = 2048  # Prompt and completion together
+CHAR_PER_TOKEN = 3  # Average number of characters per token
+TRIM_MARKER = " ... "  # Stands in for the middle of a trimmed prompt
+# Most tokens to ask for in a response to each kind of prompt
+OUTPUT_TOKENS = {
+    "title": 30,
+    "outline": 600,
+    "scene part": 400,
+    "scene": 1200,  # Every part of a scene at once
+    "summary": 150,
+    "visual": 120,
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = MODEL) -> Optional[Any]:
+    """Returns the model's tokenizer, or None if tiktoken isn't installed."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.warning(f"No tokenizer for {model}, estimating tokens.")
+        return None
+
+
+def count_tokens(text: str, model: str = MODEL) -> int:
+    """Returns the number of tokens in text."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Round up, so an estimate is never short
+        return -(-len(text) // CHAR_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def trim_to_tokens(text: str, max_tokens: int, model: str = MODEL) -> str:
+    """Cut the middle out of text until it has at most max_tokens tokens.
+
+    The start and end of a prompt usually say what to do, so they're kept.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    # Tokens can merge across a cut, so leave a little room
+    keep = max(max_tokens - count_tokens(TRIM_MARKER, model) - 2, 0)
+    head = keep - keep // 2
+    tail = keep // 2
+    encoding = get_encoding(model)
+    if encoding is None:
+        chars = [head * CHAR_PER_TOKEN, tail * CHAR_PER_TOKEN]
+        return text[: chars[0]] + TRIM_MARKER + text[len(text) - chars[1] :]
+    encoded = encoding.encode(text)
+    return (
+        encoding.decode(encoded[:head])
+        + TRIM_MARKER
+        + encoding.decode(encoded[len(encoded) - tail :])
+    )
+
+
+def output_budget(prompt_type: str) -> int:
+    """Returns the most tokens to ask for in response to a kind of prompt."""
+    if prompt_type not in OUTPUT_TOKENS:
+        raise ValueError(f"Unknown prompt type: {prompt_type}")
+    return OUTPUT_TOKENS[prompt_type]
+
+
+def fit_prompt(
+    prompt: str,
+    prompt_type: str,
+    model: str = MODEL,
+) -> Tuple[str, int]:
+    """Fit a prompt and its response in the model's token limit.
+
+    Returns:
+        The prompt, trimmed if it was too long, and the most tokens to ask
+        for in response to it.
+    """
+    max_tokens = output_budget(prompt_type)
+    prompt_limit = MAX_TOKENS - max_tokens
+    if count_tokens(prompt, model) > prompt_limit:
+        logger.warning(
+            f"Trimming a {prompt_type} prompt to {prompt_limit} tokens."
+        )
+        prompt = trim_to_tokens(prompt, prompt_limit, model)
+    return prompt, max_tokens
@@ -1,4 +1,4 @@
-from typing import Any, Optional
+from typing import Any, Optional, Union
 
 import logging
 import os.path
@@ -13,7 +13,7 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 
-from storytime.story import Story, get_save_path, load_from_json
+from storytime.story import LazyStory, Story, get_save_path
 
 # This OAuth 2.0 access scope allows an application to upload files to the
 # authenticated user's YouTube channel, but doesn't allow other types of
@@ -175,7 +175,13 @@ def initialize_upload(
     resumable_upload(insert_request)
 
 
-def upload_story(story_to_upload: "Story", video_file: str) -> None:
+def upload_story(
+    story_to_upload: Union[Story, LazyStory], video_file: str
+) -> None:
+    """Upload a story's video, titled and described from the story.
+
+    Only the story's title and synopsis are read, so a LazyStory will do.
+    """
     youtube = get_authenticated_service()
     try:
         initialize_upload(
@@ -189,7 +195,7 @@ def upload_story(story_to_upload: "Story", video_file: str) -> None:
 
 
 if __name__ == "__main__":
-    story = load_from_json(
+    story = LazyStory(
         os.path.join(get_save_path(), "CereliasMagicalSummer.json")
     )
     video = os.path.join(get_save_path(), "Cerelia's Magical Summer.mp4")
@@ -26,8 +26,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def create_video(story: Story) -> None:
-    """Creates a video from a story"""
+def create_video(story: Story) -> str:
+    """Creates a video from a story and returns the video file"""
     logger.info("Loading audio clips")
     audio_files = story.get_narration_file_list()
     audio_clips = [AudioFileClip(audio_file) for audio_file in audio_files]
@@ -85,6 +85,7 @@ def create_video(story: Story) -> None:
     full_video_clip = full_images_clip.set_audio(full_audio_clip)
     video_save_file = os.path.join(get_save_path(), f"{story.title}.mp4")
     full_video_clip.write_videofile(video_save_file, fps=24)
+    return video_save_file
 
 
 def create_title_card(
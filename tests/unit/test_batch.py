@@ -0,0 +1,59 @@
+import json
+
+from pytest_mock import MockerFixture
+
+from storytime import batch
+
+
+def test_expand_specs_cycles_to_count() -> None:
+    """Test that the specs repeat in turn until there are enough."""
+    assert batch.expand_specs(["fairy tale", "random"], 3) == [
+        "fairy tale",
+        "random",
+        "fairy tale",
+    ]
+    assert batch.expand_specs([], None) == ["random"]
+
+
+def test_main_reports_stories_and_failures(
+    mocker: MockerFixture,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that a batch reports the stories it made and the ones it didn't."""
+    monkeypatch.chdir(tmp_path)
+    mocker.patch(
+        "storytime.story.generate_text",
+        return_value="Test Story:Text From Gpt3's Mock",
+    )
+    mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch("storytime.pipeline.Narrator")
+    report_file = tmp_path / "report.json"
+    batch.main(
+        [
+            "random",
+            "no such story",
+            "--count",
+            "3",
+            "--report",
+            str(report_file),
+        ]
+    )
+    report = json.loads(report_file.read_text())
+    assert report["requested"] == 3
+    assert report["produced"] == 2
+    assert report["failures"] == [
+        {
+            "story": "no such story",
+            "stage": "plan",
+            "error": "Unknown story type: no such story",
+        }
+    ]
+    assert report["stages"]["story"]["processed"] == 2
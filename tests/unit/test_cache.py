@@ -0,0 +1,55 @@
+import time
+
+from storytime.cache import PageCache, ResponseCache
+
+PARAMS = {"kind": "text", "prompt": "Test prompt", "temp": 0.8}
+
+
+def test_get_counts_hits_and_misses(tmp_path) -> None:
+    """Test that responses round trip and hits and misses are counted."""
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    assert cache.get(PARAMS) is None
+    cache.set(PARAMS, "Test Response")
+    assert cache.get(PARAMS) == "Test Response"
+    assert cache.get({**PARAMS, "temp": 0}) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+
+def test_evict_by_age_and_size(tmp_path) -> None:
+    """Test that expired and least recently used entries are evicted."""
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_bytes=10)
+    cache.set({"prompt": "old"}, "12345")
+    time.sleep(0.01)
+    cache.set({"prompt": "new"}, "67890")
+    cache.set({"prompt": "newest"}, "abcde")
+    assert cache.evict() == 1
+    assert cache.get({"prompt": "old"}) is None
+    assert cache.get({"prompt": "newest"}) == "abcde"
+    assert cache.get({"prompt": "new"}, max_age=0.001) is None
+
+
+def test_only_deterministic_calls_are_cached_by_default(tmp_path) -> None:
+    """Test that calls with a temperature above 0 are cached if opted in."""
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    assert not cache.accepts(0.8)
+    assert cache.accepts(0)
+    cache = ResponseCache(
+        str(tmp_path / "responses.sqlite3"), cache_sampled=True
+    )
+    assert cache.accepts(0.8)
+
+
+def test_pages_expire_after_their_ttl(tmp_path) -> None:
+    """Test that parsed pages round trip and go stale after the TTL."""
+    cache = PageCache(str(tmp_path / "pages.sqlite3"), ttl=0.05)
+    assert cache.get("https://example.com/") is None
+    cache.set("https://example.com/", ["Ada", "Grace"], etag='"v1"')
+    page = cache.get("https://example.com/")
+    assert page.results == ["Ada", "Grace"]
+    assert page.etag == '"v1"'
+    assert cache.is_fresh(page)
+    time.sleep(0.06)
+    assert not cache.is_fresh(cache.get("https://example.com/"))
+    cache.touch("https://example.com/")
+    assert cache.is_fresh(cache.get("https://example.com/"))
@@ -0,0 +1,118 @@
+import os
+
+from storytime import catalog, serialization
+
+STORY = {
+    "schema_version": serialization.SCHEMA_VERSION,
+    "title": "The Lost Ring",
+    "subtitle": None,
+    "synopsis": "A ring is lost and found.",
+    "genre": "Fantasy",
+    "target_audience": "teenagers",
+    "narrative_structure": "Quest",
+    "themes": ["loyalty", "greed"],
+    "time_period": {
+        "era": "Medieval",
+        "season": "winter",
+        "time_of_day": "dusk",
+    },
+    "with_images": False,
+    "narrated": ["Title", "A1S1P1"],
+    "acts": [
+        [
+            {
+                "scene_text": ["One two three.", "Four five."],
+                "scene_summary": "",
+                "scene_visual": "",
+            }
+        ],
+        [{"scene_text": ["Six."], "scene_summary": "", "scene_visual": ""}],
+    ],
+}
+
+
+def test_find_by_indexed_fields_and_theme(tmp_path) -> None:
+    """Test that stories are found by their metadata and themes."""
+    story_catalog = catalog.StoryCatalog(str(tmp_path / "catalog.sqlite3"))
+    story_catalog.add_story(STORY, str(tmp_path / "TheLostRing.json"))
+    other = dict(STORY, title="Gold", genre="Western", themes=["greed"])
+    story_catalog.add_story(other, str(tmp_path / "Gold.json"))
+    fantasy = story_catalog.find(genre="Fantasy", era="Medieval")
+    assert [found["title"] for found in fantasy] == ["The Lost Ring"]
+    assert sorted(fantasy[0]["themes"]) == ["greed", "loyalty"]
+    assert fantasy[0]["scenes"] == 2
+    assert fantasy[0]["words"] == 6
+    assert fantasy[0]["narrations"] == 2
+    assert len(story_catalog.find(theme="greed")) == 2
+    assert story_catalog.find(theme="loyalty", genre="Western") == []
+    assert len(story_catalog.find(limit=1)) == 1
+
+
+def test_saving_again_updates_the_entry(tmp_path) -> None:
+    """Test that a story saved twice has one entry with its latest data."""
+    story_catalog = catalog.StoryCatalog(str(tmp_path / "catalog.sqlite3"))
+    file = str(tmp_path / "TheLostRing.json")
+    story_catalog.add_story(STORY, file)
+    story_catalog.set_assets(file, video_file="TheLostRing.mp4")
+    story_catalog.add_story(dict(STORY, themes=["hope"]), file)
+    assert story_catalog.count() == 1
+    found = story_catalog.find(theme="hope")[0]
+    assert found["video_file"] == "TheLostRing.mp4"
+    assert story_catalog.find(theme="loyalty") == []
+    story_catalog.remove(file)
+    assert story_catalog.count() == 0
+
+
+def test_add_directory_skips_checkpoints(tmp_path) -> None:
+    """Test that a directory of saved stories can be cataloged at once."""
+    (tmp_path / "TheLostRing.json").write_text(serialization.dumps(STORY))
+    (tmp_path / "TheLostRing.checkpoint.json").write_text(
+        serialization.dumps(STORY)
+    )
+    story_catalog = catalog.get_catalog(str(tmp_path))
+    assert story_catalog.add_directory(str(tmp_path)) == 1
+    assert story_catalog.find()[0]["file"] == os.path.abspath(
+        tmp_path / "TheLostRing.json"
+    )
+
+
+def test_search_finds_scenes_with_snippets(tmp_path) -> None:
+    """Test that scene text, summaries and visuals are searchable."""
+    story_catalog = catalog.StoryCatalog(str(tmp_path / "catalog.sqlite3"))
+    scene = {
+        "scene_text": ["Cerelia walked into the dark forest alone."],
+        "scene_summary": "Cerelia gets lost.",
+        "scene_visual": "A girl among tall pine trees.",
+    }
+    other_scene = dict(scene, scene_text=["The dragon slept."])
+    data = dict(STORY, acts=[[other_scene], [other_scene, scene]])
+    file = str(tmp_path / "TheLostRing.json")
+    story_catalog.add_story(data, file)
+    hits = story_catalog.search('"dark forest"')
+    assert [(hit.act_number, hit.scene_number) for hit in hits] == [(2, 2)]
+    assert hits[0].title == "The Lost Ring"
+    assert "[dark forest]" in hits[0].snippet
+    assert len(story_catalog.search("pine")) == 3
+    # Saving again replaces the story's scenes instead of adding to them
+    story_catalog.add_story(dict(data, acts=[[other_scene]]), file)
+    assert story_catalog.search("forest") == []
+    assert len(story_catalog.search("dragon")) == 1
+    story_catalog.remove(file)
+    assert story_catalog.search("dragon") == []
+
+
+def test_remove_only_unindexes_its_scenes(tmp_path) -> None:
+    """Test that scenes indexed before scenes were tracked are removable."""
+    path = str(tmp_path / "catalog.sqlite3")
+    story_catalog = catalog.StoryCatalog(path)
+    first = str(tmp_path / "TheLostRing.json")
+    second = str(tmp_path / "TheFoundRing.json")
+    story_catalog.add_story(STORY, first)
+    story_catalog.add_story(STORY, second)
+    # Forget which rows are whose, as in a catalog made before they were kept
+    story_catalog._conn.execute("DROP TABLE scenes")
+    story_catalog = catalog.StoryCatalog(path)
+    assert len(story_catalog.search("Six")) == 2
+    story_catalog.remove(first)
+    hits = story_catalog.search("Six")
+    assert [hit.file for hit in hits] == [second]
@@ -0,0 +1,52 @@
+from storytime import story
+from storytime.character_pool import CharacterPool
+
+
+def test_takes_refill_in_the_background() -> None:
+    """Test that a warm pool hits, then refills what was taken."""
+    pool = CharacterPool(size=4, refill_at=2)
+    try:
+        pool.warm(["Medieval"]).result()
+        assert pool.stats()["pooled"] == 4
+        cast = [pool.take("Medieval") for _ in range(3)]
+        assert all(character.era == "Medieval" for character in cast)
+        assert not hasattr(cast[0], "name_lookup")
+        archetype = pool.take("Future", "korean", "Female", 40, "doctor")
+        assert (archetype.ethnicity, archetype.occupation) == (
+            "korean",
+            "doctor",
+        )
+    finally:
+        pool.close()
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+    assert stats["hit_rate"] == 0.75
+    assert stats["kinds"] == 2
+    assert stats["pooled"] == 8
+
+
+def test_story_takes_its_cast_from_the_pool() -> None:
+    """Test that a story's cast comes from the pool, names already picked."""
+    pool = CharacterPool()
+    try:
+        pool.warm().result()
+        planned = story.Story(seed=3, plan_only=True, character_pool=pool)
+    finally:
+        pool.close()
+    assert pool.stats()["hits"] == len(planned.characters)
+    assert not any(
+        hasattr(character, "name_lookup")
+        for character in planned.characters.values()
+    )
+
+
+def test_closed_pool_makes_characters_inline() -> None:
+    """Test that taking from a closed pool still returns characters."""
+    pool = CharacterPool(size=2, refill_at=1)
+    pool.warm(["Modern"]).result()
+    pool.close()
+    cast = [pool.take("Modern") for _ in range(4)]
+    assert all(character.era == "Modern" for character in cast)
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+    assert stats["pooled"] == 0
@@ -0,0 +1,140 @@
+from typing import Any, Dict, Optional
+
+import itertools
+import os
+import random
+import shutil
+
+from pytest_mock import MockerFixture
+
+from storytime import corpus
+from storytime.cache import PageCache
+from storytime.character import Character
+from storytime.corpus import get_corpus, interest_code
+
+
+def page_response(
+    mocker: MockerFixture,
+    page: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> Any:
+    """Returns a mock response that streams a page in two chunks."""
+    content = page.encode("utf-8")
+    response = mocker.Mock(
+        status_code=200, headers=headers or {}, encoding="utf-8"
+    )
+    response.iter_content.return_value = [content[:20], content[20:]]
+    return response
+
+
+def test_every_character_gets_a_name_and_occupation() -> None:
+    """Test that the corpus has names and occupations for every character."""
+    corpus = get_corpus()
+    rng = random.Random(1)
+    for ethnicity, gender in itertools.product(
+        Character.ethnicities, Character.genders
+    ):
+        fullname = corpus.random_fullname(ethnicity, gender, "language", rng)
+        assert fullname not in ["John Doe", "Jane Doe"]
+        assert len(fullname.split(" ")) == 2
+    for tp_param, ethnicity in [
+        ("medieval", "old-norse"),
+        ("medieval", "old-roman"),
+        ("medieval", "old-english"),
+    ]:
+        assert corpus.random_fullname(ethnicity, "Female", tp_param, rng)
+    for interests in itertools.permutations(Character.interest_areas, 3):
+        assert corpus.occupations[interest_code(interests)]
+    assert corpus.random_fullname("klingon", "Male", "language", rng) == (
+        "John Doe"
+    )
+
+
+def test_picks_are_seeded_and_offline(mocker: MockerFixture) -> None:
+    """Test that names and occupations come from the seed, not requests."""
+    session = mocker.patch("storytime.corpus.get_session")
+    corpus = get_corpus()
+    interests = ["Social", "Artistic", "Investigative"]
+    assert corpus.random_fullname(
+        "japanese", "Male", "language", random.Random(3)
+    ) == corpus.random_fullname(
+        "japanese", "Male", "language", random.Random(3)
+    )
+    assert corpus.random_occupation(
+        interests, random.Random(3)
+    ) == corpus.random_occupation(interests, random.Random(3))
+    assert session.call_count == 0
+
+
+def test_scraped_pages_are_parsed_once(
+    mocker: MockerFixture,
+    tmp_path,
+) -> None:
+    """Test that pages are fetched once, then revalidated when stale."""
+    page = (
+        '<div id="names-container"><h3>Ada Lovelace</h3>'
+        "<h3>Grace Hopper</h3></div>"
+    )
+    page_request = mocker.patch(
+        "storytime.corpus.get_session"
+    ).return_value.get
+    page_request.return_value = page_response(mocker, page, {"ETag": '"v1"'})
+    parse = mocker.spy(corpus, "parse_fullnames")
+    cache = PageCache(str(tmp_path / "pages.sqlite3"))
+    corpus.set_page_cache(cache)
+    try:
+        for _ in range(3):
+            assert corpus.scrape_fullnames(
+                "english", "Female", "language"
+            ) == [
+                "Ada Lovelace",
+                "Grace Hopper",
+            ]
+        assert page_request.call_count == 1
+        cache.ttl = 0
+        page_request.return_value = mocker.Mock(status_code=304, headers={})
+        assert corpus.scrape_fullnames("english", "Female", "language") == [
+            "Ada Lovelace",
+            "Grace Hopper",
+        ]
+        assert page_request.call_count == 2
+        assert page_request.call_args[1]["headers"]["If-None-Match"] == '"v1"'
+        assert parse.call_count == 1
+    finally:
+        corpus.set_page_cache(None)
+
+
+def test_generate_many_makes_a_seeded_cast() -> None:
+    """Test that a cast made at once matches one made a character at a time."""
+    cast = Character.generate_many(3, "Contemporary", seed=5)
+    rng = random.Random(5)
+    assert [character.__dict__ for character in cast] == [
+        Character("Contemporary", seed=rng).__dict__ for _ in range(3)
+    ]
+
+
+def test_build_corpus_adds_scraped_names(
+    mocker: MockerFixture,
+    tmp_path,
+) -> None:
+    """Test that every page is scraped and what's new is added."""
+    for filename in [corpus.NAMES_FILENAME, corpus.OCCUPATIONS_FILENAME]:
+        shutil.copy(os.path.join(corpus.DATA_DIR, filename), tmp_path)
+    page = (
+        '<div id="names-container"><h3>Zebedee Quill</h3></div>'
+        '<table><tr><td data-title="Occupation"><a>Cartographers</a></td>'
+        "</tr></table>"
+    )
+    page_request = mocker.patch(
+        "storytime.corpus.get_session"
+    ).return_value.get
+    page_request.return_value = page_response(mocker, page)
+    corpus.set_page_cache(None)
+    corpus.build_corpus(str(tmp_path))
+    built = corpus.Corpus.load(str(tmp_path))
+    assert page_request.call_count == len(built.first_names) + len(
+        built.occupations
+    )
+    assert "Zebedee" in built.first_names[("language", "english", "Male")]
+    assert "Quill" in built.last_names[("language", "english", "Male")]
+    assert "Cartographer" in built.occupations["RIC"]
@@ -0,0 +1,30 @@
+from storytime.extract import Selector, extract_text
+
+NAMES_PATH = [Selector("div", (("id", "names"),)), Selector("h3")]
+
+
+def test_extracts_only_the_text_asked_for() -> None:
+    """Test that text is only taken from elements matching the path."""
+    page = (
+        "<html><body><h3>Not a name</h3>"
+        '<div id="names"><h3>Zoë <b>Ávila</b></h3><br><p>Blurb<p>'
+        "<h3>Tom &amp; Jerry</h3></div>"
+        '<div id="other"><h3>Not one either</h3></div></body></html>'
+    ).encode("utf-8")
+    # Split in the middle of a character
+    split = page.index("ë".encode("utf-8")) + 1
+    chunks = [page[:split], page[split:]]
+    assert extract_text(chunks, NAMES_PATH) == ["Zoë Ávila", "Tom & Jerry"]
+
+
+def test_stops_once_the_only_match_ends() -> None:
+    """Test that chunks after the only matching element aren't read."""
+    read = []
+
+    def chunks():
+        for chunk in [b'<div id="names"><h3>Ada</h3>', b"</div>", b"<h3>"]:
+            read.append(chunk)
+            yield chunk
+
+    assert extract_text(chunks(), NAMES_PATH, once=True) == ["Ada"]
+    assert len(read) == 2
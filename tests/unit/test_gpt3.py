@@ -0,0 +1,115 @@
+from typing import List
+
+import asyncio
+import time
+
+import openai
+import pytest
+from pytest_mock import MockerFixture
+
+from storytime import gpt3, rate_limiter
+from storytime.cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch) -> ResponseCache:
+    monkeypatch.setenv("STORYTIME_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    gpt3.set_response_cache(cache)
+    yield cache
+    gpt3.set_response_cache(None)
+
+
+async def generate_many_texts(count: int) -> List[str]:
+    texts = await asyncio.gather(
+        *(gpt3.agenerate_text("Test prompt") for _ in range(count))
+    )
+    return list(texts)
+
+
+def test_agenerate_text_runs_requests_concurrently(
+    mocker: MockerFixture,
+) -> None:
+    """Test that async text requests are in flight at the same time."""
+
+    def slow_completion(*args, **kwargs):
+        time.sleep(0.2)
+        return {"choices": [{"text": "Test Text From Gpt3."}]}
+
+    mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        side_effect=slow_completion,
+    )
+    start = time.monotonic()
+    texts = gpt3.run_async(generate_many_texts(5))
+    elapsed = time.monotonic() - start
+    assert texts == ["Test Text From Gpt3."] * 5
+    assert elapsed < 0.5
+
+
+def test_agenerate_text_returns_empty_on_error(mocker: MockerFixture) -> None:
+    """Test that a failed async request returns an empty string."""
+    mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        side_effect=Exception("Test Error"),
+    )
+    assert gpt3.run_async(gpt3.agenerate_text("Test prompt")) == ""
+
+
+def test_generate_text_uses_response_cache(
+    mocker: MockerFixture,
+    response_cache: ResponseCache,
+) -> None:
+    """Test that a repeated request is answered from the cache."""
+    create = mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        return_value={"choices": [{"text": "Test Text From Gpt3."}]},
+    )
+    first = gpt3.generate_text("Test prompt", temp=0)
+    second = gpt3.run_async(gpt3.agenerate_text("Test prompt", temp=0))
+    assert first == second == "Test Text From Gpt3."
+    assert create.call_count == 1
+    assert response_cache.stats()["hits"] == 1
+
+
+def test_generate_text_retries_after_rate_limit(mocker: MockerFixture) -> None:
+    """Test that a rate limited request is retried after the pause."""
+    mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        side_effect=[
+            openai.error.RateLimitError(
+                "Test Rate Limit", headers={"retry-after": "0.1"}
+            ),
+            {"choices": [{"text": "Test Text From Gpt3."}]},
+        ],
+    )
+    start = time.monotonic()
+    assert gpt3.generate_text("Test prompt") == "Test Text From Gpt3."
+    assert time.monotonic() - start >= 0.1
+
+
+def test_sampled_calls_are_cached_only_by_env(monkeypatch) -> None:
+    """Test that the default cache only takes sampled calls when told to."""
+    monkeypatch.delenv("STORYTIME_CACHE_SAMPLED", raising=False)
+    monkeypatch.setattr(gpt3, "_response_cache_loaded", False)
+    cache = gpt3.get_response_cache()
+    assert cache is not None
+    assert not cache.accepts(0.8)
+    assert cache.accepts(0)
+    monkeypatch.setenv("STORYTIME_CACHE_SAMPLED", "1")
+    monkeypatch.setattr(gpt3, "_response_cache_loaded", False)
+    assert gpt3.get_response_cache().accepts(0.8)
+
+
+def test_generate_text_without_openai_session(
+    mocker: MockerFixture,
+    monkeypatch,
+) -> None:
+    """Test that requests still go out if openai's session isn't there."""
+    monkeypatch.delattr(openai.api_requestor, "_make_session")
+    mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        return_value={"choices": [{"text": "Test Text From Gpt3."}]},
+    )
+    assert gpt3.generate_text("Test prompt") == "Test Text From Gpt3."
@@ -0,0 +1,164 @@
+import threading
+import time
+
+from pytest_mock import MockerFixture
+
+from storytime import pipeline, story
+
+
+def test_pipeline_limits_each_stages_workers() -> None:
+    """Test that no stage works on more items at once than it has workers."""
+    busy = {"double": 0, "add": 0}
+    most_busy = {"double": 0, "add": 0}
+    lock = threading.Lock()
+
+    def counted(name, work):
+        def run(item):
+            with lock:
+                busy[name] += 1
+                most_busy[name] = max(most_busy[name], busy[name])
+            time.sleep(0.01)
+            with lock:
+                busy[name] -= 1
+            return work(item)
+
+        return run
+
+    double = pipeline.Stage("double", counted("double", lambda n: n * 2), 3)
+    add = pipeline.Stage("add", counted("add", lambda n: n + 1), 1, 1)
+    results = pipeline.Pipeline([double, add]).run(range(20))
+    assert sorted(results) == [n * 2 + 1 for n in range(20)]
+    assert most_busy == {"double": 3, "add": 1}
+    assert double.stats()["processed"] == 20
+
+
+def test_pipeline_drops_failed_items() -> None:
+    """Test that an item failing in one stage doesn't stop the others."""
+
+    def invert(n):
+        return 1 / n
+
+    stage = pipeline.Stage("invert", invert, 2)
+    results = pipeline.Pipeline([stage]).run([0, 1, 2])
+    assert sorted(results) == [0.5, 1]
+    assert stage.stats()["failed"] == 1
+
+
+def test_producer_illustrates_and_narrates_every_scene(
+    mocker: MockerFixture,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that each streamed scene gets its image and narration."""
+    monkeypatch.chdir(tmp_path)
+    mocker.patch(
+        "storytime.story.generate_text",
+        return_value="Test Story:Text From Gpt3's Mock",
+    )
+    mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.image_set.generate_image",
+        return_value="Test Image URL From DALL-E.",
+    )
+    mocker.patch("storytime.image_set.ImageSet.save_image")
+    mocker.patch("storytime.pipeline.Narrator")
+    deferred_story = story.Story(
+        with_images=True,
+        deferred=True,
+        parallel_acts=True,
+    )
+    producer = pipeline.StoryProducer(with_video=False)
+    produced = producer.produce([deferred_story])
+    assert produced == [(deferred_story, None)]
+    labels = deferred_story.scene_labels()
+    assert list(deferred_story.image_set.images) == labels
+    assert len(deferred_story.narrated) == 2 + 3 * len(labels)
+    assert producer.stats()["image"]["processed"] == len(labels)
+
+
+def test_producer_fails_a_story_with_a_failed_scene(
+    mocker: MockerFixture,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that a scene failing to narrate fails its story's stage."""
+    monkeypatch.chdir(tmp_path)
+    mocker.patch(
+        "storytime.story.generate_text",
+        return_value="Test Story:Text From Gpt3's Mock",
+    )
+    mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    narrator = mocker.patch("storytime.pipeline.Narrator").return_value
+    narrator.synthesize_speech.side_effect = [None] + [
+        OSError("No voice")
+    ] * 99
+    deferred_story = story.Story(deferred=True, parallel_acts=True)
+    producer = pipeline.StoryProducer(with_video=False)
+    failures = []
+    produced = pipeline.Pipeline(producer.stages()).run(
+        [(deferred_story, None)],
+        on_error=lambda stage, item, error: failures.append(stage.name),
+    )
+    assert produced == []
+    assert failures == ["story"]
+    assert producer.stats()["story"]["failed"] == 1
+    assert producer.stats()["narration"]["failed"] > 0
+
+
+def test_producer_requests_one_image_per_scene(
+    mocker: MockerFixture,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that streamed scenes aren't illustrated a second time."""
+    monkeypatch.chdir(tmp_path)
+    mocker.patch(
+        "storytime.story.generate_text",
+        return_value="Test Story:Text From Gpt3's Mock",
+    )
+    mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Scene Text From Gpt3.",
+    )
+
+    def slow_image(prompt: str) -> str:
+        time.sleep(0.05)
+        return "Test Image URL From DALL-E."
+
+    generate_image = mocker.patch(
+        "storytime.image_set.generate_image",
+        side_effect=slow_image,
+    )
+    agenerate_image = mocker.patch(
+        "storytime.image_set.agenerate_image",
+        return_value="Test Image URL From DALL-E.",
+    )
+    mocker.patch("storytime.image_set.ImageSet.save_image")
+    mocker.patch("storytime.pipeline.Narrator")
+    deferred_story = story.Story(
+        with_images=True,
+        deferred=True,
+        seed=1,
+        narrative_structure="Five-Act",
+    )
+    pipeline.StoryProducer(with_video=False).produce([deferred_story])
+    scenes = len(deferred_story.scene_labels())
+    assert generate_image.call_count + agenerate_image.call_count == scenes
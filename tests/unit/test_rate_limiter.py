@@ -0,0 +1,83 @@
+import asyncio
+import multiprocessing
+import time
+
+from pytest_mock import MockerFixture
+
+from storytime.rate_limiter import RateLimiter
+
+
+def reserve_in_other_process(path: str) -> float:
+    return RateLimiter("text", 6, path=path).reserve()
+
+
+def test_requests_beyond_the_limit_wait(tmp_path) -> None:
+    """Test that a request beyond the limit waits for the bucket to refill."""
+    limiter = RateLimiter("text", 60, path=str(tmp_path / "limits.sqlite3"))
+    waits = [limiter.reserve() for _ in range(61)]
+    assert max(waits[:60]) == 0
+    assert 0.9 < waits[60] <= 1
+
+
+def test_token_limit_waits_for_tokens(tmp_path) -> None:
+    """Test that requests also wait on the tokens per minute limit."""
+    limiter = RateLimiter(
+        "text", 60, 600, path=str(tmp_path / "limits.sqlite3")
+    )
+    assert limiter.reserve(tokens=600) == 0
+    assert 4.9 < limiter.reserve(tokens=50) <= 5
+
+
+def test_processes_share_the_limit(tmp_path) -> None:
+    """Test that a limiter in another process draws from the same bucket."""
+    path = str(tmp_path / "limits.sqlite3")
+    limiter = RateLimiter("text", 6, path=path)
+    for _ in range(6):
+        limiter.reserve()
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        wait = pool.apply(reserve_in_other_process, (path,))
+    assert 5 < wait <= 10
+
+
+def test_observe_retunes_limits_from_headers(tmp_path) -> None:
+    """Test that response headers replace the configured limits."""
+    limiter = RateLimiter(
+        "text", 60, 600, path=str(tmp_path / "limits.sqlite3")
+    )
+    limiter.observe(
+        {
+            "x-ratelimit-limit-requests": "3000",
+            "x-ratelimit-limit-tokens": "250000",
+            "x-ratelimit-remaining-requests": "0",
+        }
+    )
+    assert limiter.limits() == (3000, 250000)
+    assert 0 < limiter.reserve() <= 0.02
+
+
+def test_rate_limited_response_pauses_requests(tmp_path) -> None:
+    """Test that a 429 pauses requests until the service's reset time."""
+    limiter = RateLimiter("image", 60, path=str(tmp_path / "limits.sqlite3"))
+    limiter.observe({"x-ratelimit-reset-requests": "6m0s"}, rate_limited=True)
+    assert 359 < limiter.reserve() <= 361
+
+
+def test_aacquire_reserves_off_the_event_loop(
+    tmp_path,
+    mocker: MockerFixture,
+) -> None:
+    """Test that a reservation waiting on a lock doesn't block the loop."""
+    limiter = RateLimiter("text", 60, path=str(tmp_path / "limits.sqlite3"))
+
+    def locked_reserve(tokens: int = 0) -> float:
+        time.sleep(0.2)
+        return 0
+
+    mocker.patch.object(limiter, "reserve", side_effect=locked_reserve)
+
+    async def acquire_many() -> None:
+        await asyncio.gather(*(limiter.aacquire() for _ in range(3)))
+
+    start = time.monotonic()
+    asyncio.run(acquire_many())
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,187 @@
+from typing import Dict
+
+import threading
+
+import pytest
+from pytest_mock import MockerFixture
+
+from storytime import scene
+from storytime.character import Character
+from storytime.gpt3 import run_async
+from storytime.image_set import ImageSet
+from storytime.time_period import TimePeriod
+
+SINGLE_REQUEST_TEXT = """
+### GOAL
+Test goal text.
+
+### CONFLICT
+Test conflict text.
+### DISASTER
+Test disaster text.
+"""
+
+
+@pytest.fixture
+def characters() -> Dict[str, Character]:
+    return {
+        role: Character(era="Medieval", fullname=f"Test {role}")
+        for role in ["protagonist", "antagonist", "deuteragonist"]
+    }
+
+
+def test_split_scene_parts() -> None:
+    """Test that a single request's text is split at the part headings."""
+    assert scene.split_scene_parts(
+        SINGLE_REQUEST_TEXT, ["goal", "conflict", "disaster"]
+    ) == ["Test goal text.", "Test conflict text.", "Test disaster text."]
+    assert (
+        scene.split_scene_parts(
+            SINGLE_REQUEST_TEXT, ["reaction", "dilemma", "decision"]
+        )
+        is None
+    )
+
+
+def test_single_request_falls_back_to_each_part(
+    mocker: MockerFixture,
+    characters: Dict[str, Character],
+) -> None:
+    """Test that a response that can't be split is written part by part."""
+    generate_text = mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Scene Text Without Headings.",
+    )
+    agenerate_text = mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Part Text From Gpt3.",
+    )
+    new_scene = scene.Scene(
+        target_audience="children",
+        genre="fantasy",
+        themes=["friendship", "dreams"],
+        act_description="The characters and setting are introduced.",
+        time_period=TimePeriod(era="Medieval"),
+        characters=characters,
+        total_scenes_in_act=2,
+        single_request=True,
+    )
+    assert new_scene.scene_text == ["Test Part Text From Gpt3."] * 3
+    assert agenerate_text.call_count == 3
+    # The visual summary is written in the background
+    assert new_scene.scene_visual == "Test Scene Text Without Headings."
+    # The single request, the summary and the visual summary
+    assert generate_text.call_count == 3
+
+
+def test_scene_follows_previous_scene_context(
+    mocker: MockerFixture,
+    characters: Dict[str, Character],
+) -> None:
+    """Test that a scene only needs the context of the scene before it."""
+    mocker.patch(
+        "storytime.scene.generate_text",
+        return_value="Test Summary From Gpt3.",
+    )
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Part Text From Gpt3.",
+    )
+    scene_args = dict(
+        target_audience="children",
+        genre="fantasy",
+        themes=["friendship", "dreams"],
+        act_description="The characters and setting are introduced.",
+        time_period=TimePeriod(era="Medieval"),
+        characters=characters,
+        total_scenes_in_act=2,
+    )
+    first_scene = scene.Scene(**scene_args)
+    second_scene = scene.Scene(
+        previous_scene=first_scene.context(), **scene_args
+    )
+    assert second_scene.scene_number == 2
+    assert second_scene.scene_type == "sequel"
+    assert "previous scene was about: Test Summary" in second_scene.scene_setup
+    assert not hasattr(second_scene, "previous_scenes")
+
+
+def test_visual_summary_is_written_in_the_background(
+    mocker: MockerFixture,
+    characters: Dict[str, Character],
+) -> None:
+    """Test that a scene is finished before its visual summary is."""
+    visual_written = threading.Event()
+
+    def summarize(prompt: str, *, max_tokens: int) -> str:
+        if prompt.startswith("Visually"):
+            assert visual_written.wait(5)
+            return "Test Visual From Gpt3."
+        return "Test Summary From Gpt3."
+
+    mocker.patch("storytime.scene.generate_text", side_effect=summarize)
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Part Text From Gpt3.",
+    )
+    new_scene = scene.Scene(
+        target_audience="children",
+        genre="fantasy",
+        themes=["friendship", "dreams"],
+        act_description="The characters and setting are introduced.",
+        time_period=TimePeriod(era="Medieval"),
+        characters=characters,
+        total_scenes_in_act=2,
+    )
+    assert new_scene.scene_summary == "Test Summary From Gpt3."
+    assert new_scene.visual_pending()
+    visual_written.set()
+    assert new_scene.scene_visual == "Test Visual From Gpt3."
+    assert not new_scene.visual_pending()
+
+
+def test_images_wait_for_visuals_without_blocking(
+    mocker: MockerFixture,
+    characters: Dict[str, Character],
+) -> None:
+    """Test that an image waiting on its visual leaves the event loop free."""
+    visual_written = threading.Event()
+
+    def summarize(prompt: str, *, max_tokens: int) -> str:
+        if prompt.startswith("Visually"):
+            assert visual_written.wait(5)
+            return "Test Visual From Gpt3."
+        return "Test Summary From Gpt3."
+
+    mocker.patch("storytime.scene.generate_text", side_effect=summarize)
+    mocker.patch(
+        "storytime.scene.agenerate_text",
+        return_value="Test Part Text From Gpt3.",
+    )
+    generate_image = mocker.patch(
+        "storytime.image_set.agenerate_image",
+        return_value="Test Image URL From DALL-E.",
+    )
+    new_scene = scene.Scene(
+        target_audience="children",
+        genre="fantasy",
+        themes=["friendship", "dreams"],
+        act_description="The characters and setting are introduced.",
+        time_period=TimePeriod(era="Medieval"),
+        characters=characters,
+        total_scenes_in_act=2,
+    )
+    image_set = ImageSet()
+    illustrate = threading.Thread(
+        target=image_set.add_scene_images, args=({"A1S1": new_scene},)
+    )
+    illustrate.start()
+    # Other coroutines still run while the image waits for its visual
+    assert run_async(scene.write_scene_parts(["Part."])) == [
+        "Test Part Text From Gpt3."
+    ]
+    assert new_scene.visual_pending()
+    visual_written.set()
+    illustrate.join(5)
+    assert image_set.images == {"A1S1": "Test Image URL From DALL-E."}
+    assert generate_image.call_args[0][0].endswith("Test Visual From Gpt3.")
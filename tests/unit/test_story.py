@@ -1,30 +1,65 @@
+from typing import NamedTuple
+
+import glob
 import os
+import threading
+import time
+from unittest.mock import MagicMock
 
+import jsonpickle
 import pytest
 from pytest_mock import MockerFixture
 
-from storytime import story
+from storytime import gpt3, rate_limiter, serialization, story, tokens
+from storytime.serialization import SCHEMA_VERSION
+
+
+class Gpt3Mocks(NamedTuple):
+    """Mocks of the requests made while writing a story."""
+
+    story_text: MagicMock
+    scene_text: MagicMock
+    scene_parts: MagicMock
 
 
 @pytest.fixture
-def test_story(mocker: MockerFixture) -> story.Story:
+def mock_gpt3(mocker: MockerFixture) -> Gpt3Mocks:
     mocker.patch(
-        "storytime.story.generate_text",
-        return_value="Test Story:Text From Gpt3's Mock",
-    )
-    mocker.patch(
-        "storytime.scene.generate_text",
-        return_value="Test Scene Text From Gpt3.",
+        "storytime.image_set.generate_image",
+        return_value="Test Image URL From DALL-E.",
     )
     mocker.patch(
-        "storytime.image_set.generate_image",
+        "storytime.image_set.agenerate_image",
         return_value="Test Image URL From DALL-E.",
     )
+    return Gpt3Mocks(
+        story_text=mocker.patch(
+            "storytime.story.generate_text",
+            return_value="Test Story:Text From Gpt3's Mock",
+        ),
+        scene_text=mocker.patch(
+            "storytime.scene.generate_text",
+            return_value="Test Scene Text From Gpt3.",
+        ),
+        scene_parts=mocker.patch(
+            "storytime.scene.agenerate_text",
+            return_value="Test Scene Text From Gpt3.",
+        ),
+    )
+
+
+@pytest.fixture
+def test_story(mock_gpt3: Gpt3Mocks) -> story.Story:
     return story.Story()
 
 
-def test_save_and_load_as_json(test_story: story.Story) -> None:
+def test_save_and_load_as_json(
+    test_story: story.Story,
+    tmp_path,
+    monkeypatch,
+) -> None:
     """Test that a story can be saved as a JSON file and loaded back."""
+    monkeypatch.chdir(tmp_path)
     errors = []
     # Save mocked story as a JSON file
     story_filename = test_story.save_as_json()
@@ -38,3 +73,334 @@ def test_save_and_load_as_json(test_story: story.Story) -> None:
     os.remove(story_filename)
     # Assert no error message has been registered, else print messages
     assert not errors, "errors occurred:\n{}".format("\n".join(errors))
+
+
+def test_parallel_acts_keep_their_order(mock_gpt3: Gpt3Mocks) -> None:
+    """Test that acts written in parallel stay in plot element order."""
+    parallel_story = story.Story(
+        narrative_structure="Hero's Journey",
+        parallel_acts=True,
+    )
+    act_descriptions = list(parallel_story.plot_elements.values())
+    assert len(parallel_story.acts) == len(act_descriptions)
+    for act, act_description in zip(parallel_story.acts, act_descriptions):
+        assert all(act_description in scene.scene_setup for scene in act)
+
+
+def test_resume_writes_only_missing_scenes(
+    mock_gpt3: Gpt3Mocks,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that resuming a checkpoint only writes the unfinished act."""
+    monkeypatch.chdir(tmp_path)
+    checkpointed_story = story.Story(checkpoint=True)
+    checkpoint_file = checkpointed_story.checkpoint_file
+    assert os.path.exists(checkpoint_file)
+    # Lose the last act, as if generation died before writing it
+    checkpointed_story.acts[-1].clear()
+    checkpointed_story.save_checkpoint()
+    mock_gpt3.scene_parts.reset_mock()
+    resumed_story = story.resume(checkpoint_file)
+    assert len(resumed_story.acts) == len(checkpointed_story.acts)
+    assert all(len(act) == 2 for act in resumed_story.acts)
+    assert (
+        mock_gpt3.scene_parts.call_count == 2 * 3
+    )  # Two scenes of three parts
+
+
+def test_checkpoints_are_kept_by_story_id(
+    mock_gpt3: Gpt3Mocks,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that stories with the same title keep their own checkpoints."""
+    monkeypatch.chdir(tmp_path)
+    first = story.Story(checkpoint=True, seed=3)
+    second = story.Story(checkpoint=True, seed=3)
+    assert first.title == second.title
+    assert first.checkpoint_file != second.checkpoint_file
+    assert story.find_checkpoint(second.story_id) == second.checkpoint_file
+    header = serialization.StoryFile(first.checkpoint_file).header
+    assert header["story_id"] == first.story_id
+
+
+def test_resume_a_story_that_died_writing_its_title(
+    mock_gpt3: Gpt3Mocks,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that a story is checkpointed before its first request."""
+    monkeypatch.chdir(tmp_path)
+    mock_gpt3.story_text.side_effect = [OSError("No connection")]
+    with pytest.raises(OSError):
+        story.Story(checkpoint=True)
+    (checkpoint_file,) = glob.glob(
+        os.path.join(story.get_save_path(), "*.checkpoint.json")
+    )
+    story_id = serialization.StoryFile(checkpoint_file).header["story_id"]
+    mock_gpt3.story_text.side_effect = None
+    resumed_story = story.resume(story_id=story_id)
+    assert resumed_story.title == "Test Story"
+    assert all(len(act) == 2 for act in resumed_story.acts)
+
+
+def test_resume_rewrites_pending_visuals(
+    mock_gpt3: Gpt3Mocks,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that visuals checkpointed before they were written get written."""
+    monkeypatch.chdir(tmp_path)
+    checkpointed_story = story.Story(checkpoint=True)
+    checkpoint_file = checkpointed_story.checkpoint_file
+    # Lose a visual, as if generation died while it was being written
+    checkpointed_story.acts[0][0].scene_visual = ""
+    checkpointed_story.save_checkpoint()
+    resumed_story = story.resume(checkpoint_file)
+    assert (
+        resumed_story.acts[0][0].scene_visual == "Test Scene Text From Gpt3."
+    )
+    reloaded = story.load_from_json(checkpoint_file)
+    assert reloaded.acts[0][0].scene_visual == "Test Scene Text From Gpt3."
+
+
+def test_stream_yields_every_scene(mock_gpt3: Gpt3Mocks) -> None:
+    """Test that streaming a deferred story yields each scene once."""
+    deferred_story = story.Story(deferred=True, parallel_acts=True)
+    assert not any(deferred_story.acts)
+    streamed = {
+        story.scene_label(act_number, scene_number): scene
+        for act_number, scene_number, scene in deferred_story.stream()
+    }
+    assert len(streamed) == sum(len(act) for act in deferred_story.acts)
+    assert streamed["A1S2"] is deferred_story.acts[0][1]
+
+
+def test_schema_round_trip(test_story: story.Story, tmp_path) -> None:
+    """Test that a story survives a round trip through the story schema."""
+    filename = str(tmp_path / "story.json")
+    story.write_json(test_story, filename)
+    loaded = story.load_from_json(filename)
+    assert str(loaded) == str(test_story)
+    assert loaded.to_dict() == test_story.to_dict()
+    # Scenes share the story's characters instead of copies of them
+    scene = loaded.acts[0][0]
+    assert scene.characters["protagonist"] is loaded.characters["protagonist"]
+
+
+def test_characters_are_saved_as_their_fields(
+    test_story: story.Story,
+) -> None:
+    """Test that characters are saved as listed fields, checked on load."""
+    character = test_story.characters["protagonist"]
+    data = serialization.character_to_dict(character)
+    assert set(data) <= set(character.saved_fields + character.optional_fields)
+    loaded = serialization.character_from_dict(data)
+    assert vars(loaded) == vars(character)
+    # Version 2 files also saved the names derived from the full name
+    old_data = dict(data, name=character.name, pronoun=character.pronoun)
+    assert vars(serialization.character_from_dict(old_data)) == vars(character)
+    with pytest.raises(ValueError):
+        serialization.character_from_dict(dict(data, _cache={}))
+    del data["age"]
+    with pytest.raises(ValueError):
+        serialization.character_from_dict(data)
+
+
+def test_migrate_jsonpickle_file(test_story: story.Story, tmp_path) -> None:
+    """Test that a story saved with jsonpickle is rewritten in the schema."""
+    filename = str(tmp_path / "story.json")
+    with open(filename, "w") as write_file:
+        write_file.write(jsonpickle.encode(test_story, keys=True, indent=4))
+    assert story.migrate_json(filename)
+    assert not story.migrate_json(filename)
+    header = serialization.StoryFile(filename).header
+    assert header["schema_version"] == SCHEMA_VERSION
+    assert story.load_from_json(filename).to_dict() == test_story.to_dict()
+
+
+def test_read_version_1_file(test_story: story.Story, tmp_path) -> None:
+    """Test that a file with every scene in one document is still read."""
+    filename = str(tmp_path / "story.json")
+    data = dict(test_story.to_dict(), schema_version=1)
+    with open(filename, "w") as write_file:
+        write_file.write(serialization.dumps(data))
+    assert story.LazyStory(filename).scene(1, 1).scene_text == (
+        test_story.acts[0][0].scene_text
+    )
+    assert story.migrate_json(filename)
+    assert story.load_from_json(filename).to_dict() == test_story.to_dict()
+
+
+def test_lazy_story_reads_only_what_it_needs(
+    test_story: story.Story,
+    tmp_path,
+    mocker: MockerFixture,
+) -> None:
+    """Test that a story's metadata is read without decoding its scenes."""
+    filename = str(tmp_path / "story.json")
+    story.write_json(test_story, filename)
+    scene_from_dict = mocker.spy(serialization, "scene_from_dict")
+    lazy_story = story.LazyStory(filename)
+    assert lazy_story.title == test_story.title
+    assert lazy_story.synopsis == test_story.synopsis
+    assert lazy_story.time_period.era == test_story.time_period.era
+    assert scene_from_dict.call_count == 0
+    assert lazy_story.scene_counts() == [len(act) for act in test_story.acts]
+    last_act = len(test_story.acts)
+    scene = lazy_story.scene(last_act, 2)
+    assert scene.scene_text == test_story.acts[-1][1].scene_text
+    assert (
+        scene.characters["protagonist"] is lazy_story.characters["protagonist"]
+    )
+    assert [s.scene_setup for s in lazy_story.act(2)] == [
+        s.scene_setup for s in test_story.acts[1]
+    ]
+    assert lazy_story.load().to_dict() == test_story.to_dict()
+
+
+def test_same_seed_same_story(mock_gpt3: Gpt3Mocks) -> None:
+    """Test that a seed plans the same story, written in order or not."""
+    in_order = story.Story(seed=42)
+    in_parallel = story.Story(seed=42, parallel_acts=True)
+    assert in_order.seed == 42
+    assert in_parallel.to_dict()["acts"] == in_order.to_dict()["acts"]
+    assert in_parallel.synopsis == in_order.synopsis
+    assert str(in_parallel.characters["foil"]) == str(
+        in_order.characters["foil"]
+    )
+
+
+def test_plan_only_makes_no_requests(
+    mocker: MockerFixture,
+    mock_gpt3: Gpt3Mocks,
+) -> None:
+    """Test that a story is planned, and costed, before any requests."""
+    title_request = mock_gpt3.story_text
+    name_lookup = mocker.patch(
+        "storytime.character.random_fullname",
+        return_value="Test Name",
+    )
+    planned = story.Story(seed=7, plan_only=True)
+    plans = planned.plan()
+    scene_count = sum(len(act_plans) for act_plans in plans)
+    estimate = planned.estimate_cost()
+    assert estimate.text_requests == 1 + 5 * scene_count
+    assert estimate.speech_requests == 2 + 3 * scene_count
+    assert estimate.image_requests == 0
+    assert title_request.call_count == 0
+    assert name_lookup.call_count == 0
+    planned.render()
+    assert title_request.call_count == 1
+    assert name_lookup.call_count == len(planned.characters)
+    assert [
+        [(scene.scene_type, str(scene.location)) for scene in act]
+        for act in planned.acts
+    ] == [
+        [(plan.scene_type, str(plan.location)) for plan in act_plans]
+        for act_plans in plans
+    ]
+    assert planned.plan() == [[] for _ in planned.acts]
+
+
+def test_outline_first_writes_scenes_from_the_outline(
+    mock_gpt3: Gpt3Mocks,
+) -> None:
+    """Test that every scene is written from its line of the outline."""
+
+    def write(prompt: str, *, max_tokens: int) -> str:
+        if prompt.startswith("Outline"):
+            labels = [
+                line.split(":")[0]
+                for line in prompt.splitlines()
+                if line[:1] == "A"
+            ]
+            return "\n".join(
+                f"{label}: Outline of {label}." for label in labels
+            )
+        return "Test Story:Text From Gpt3's Mock"
+
+    text_request = mock_gpt3.story_text
+    text_request.side_effect = write
+    outlined = story.Story(outline_first=True)
+    # One request for the title, then the outline, in as few as fit
+    outline_requests = text_request.call_args_list[1:]
+    assert outline_requests
+    assert all(call[0][0].startswith("Outline") for call in outline_requests)
+    for act_number, act in enumerate(outlined.acts, 1):
+        for scene_number, scene in enumerate(act, 1):
+            label = story.scene_label(act_number, scene_number)
+            assert f"In this scene: Outline of {label}." in scene.scene_setup
+            assert "The previous scene was about" not in scene.scene_setup
+    assert outlined.outline_prompts() == []
+
+
+def test_outlined_acts_are_written_at_once(
+    mocker: MockerFixture,
+    mock_gpt3: Gpt3Mocks,
+) -> None:
+    """Test that scenes from different acts share one pool once outlined."""
+
+    def outline(prompt: str, *, max_tokens: int) -> str:
+        if prompt.startswith("Outline"):
+            return "\n".join(
+                f"{line.split(':')[0]}: Outlined."
+                for line in prompt.splitlines()
+                if line[:1] == "A"
+            )
+        return "Test Story:Text From Gpt3's Mock"
+
+    mock_gpt3.story_text.side_effect = outline
+    busy = [0]
+    most_busy = [0]
+    lock = threading.Lock()
+    from_plan = story.Scene.from_plan
+
+    def write(*args, **kwargs):
+        with lock:
+            busy[0] += 1
+            most_busy[0] = max(most_busy[0], busy[0])
+        time.sleep(0.05)
+        with lock:
+            busy[0] -= 1
+        return from_plan(*args, **kwargs)
+
+    mocker.patch.object(story.Scene, "from_plan", side_effect=write)
+    outlined = story.Story(outline_first=True)
+    assert len(outlined.acts) > 1
+    assert most_busy[0] > story.Story.MAX_SCENES_PER_ACT
+
+
+def test_requests_ask_for_their_output_budget(
+    mocker: MockerFixture,
+    tmp_path,
+    monkeypatch,
+) -> None:
+    """Test that every request keeps its temperature and token budget."""
+    monkeypatch.setenv("STORYTIME_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(gpt3, "TEXT_REQUESTS_PER_MINUTE", 60000)
+    monkeypatch.setattr(gpt3, "_response_cache", None)
+    monkeypatch.setattr(gpt3, "_response_cache_loaded", True)
+    create = mocker.patch(
+        "storytime.gpt3.openai.Completion.create",
+        return_value={"choices": [{"text": "Test Text From Gpt3."}]},
+    )
+    # The scenes' single requests don't split into parts, so the parts are
+    # requested too
+    story.Story(outline_first=True, single_request_scenes=True)
+    assert {call.kwargs["temperature"] for call in create.call_args_list} == {
+        0.8
+    }
+    assert {call.kwargs["max_tokens"] for call in create.call_args_list} == {
+        tokens.OUTPUT_TOKENS[prompt_type]
+        for prompt_type in [
+            "title",
+            "outline",
+            "scene",
+            "scene part",
+            "summary",
+            "visual",
+        ]
+    }
@@ -0,0 +1,45 @@
+import pytest
+
+from storytime import tokens
+
+
+@pytest.fixture
+def estimated_tokens(monkeypatch) -> None:
+    """Count tokens from text length, as without tiktoken installed."""
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    tokens.get_encoding.cache_clear()
+    yield
+    tokens.get_encoding.cache_clear()
+
+
+def test_count_tokens_without_tokenizer(estimated_tokens) -> None:
+    """Test that estimates round up, so they're never short."""
+    assert tokens.count_tokens("") == 0
+    assert tokens.count_tokens("abc") == 1
+    assert tokens.count_tokens("abcd") == 2
+
+
+def test_trim_keeps_start_and_end(estimated_tokens) -> None:
+    """Test that trimming cuts the middle out of text to fit its budget."""
+    text = "Start. " + "middle " * 200 + "End."
+    trimmed = tokens.trim_to_tokens(text, 20)
+    assert tokens.count_tokens(trimmed) <= 20
+    assert trimmed.startswith("Start.")
+    assert trimmed.endswith("End.")
+    assert tokens.TRIM_MARKER in trimmed
+    assert tokens.trim_to_tokens("Short.", 20) == "Short."
+
+
+def test_fit_prompt(estimated_tokens) -> None:
+    """Test that prompts and their responses fit in the model's limit."""
+    assert tokens.fit_prompt("Write a title.", "title") == (
+        "Write a title.",
+        tokens.OUTPUT_TOKENS["title"],
+    )
+    prompt, max_tokens = tokens.fit_prompt(
+        "word " * tokens.MAX_TOKENS, "scene"
+    )
+    assert max_tokens == tokens.OUTPUT_TOKENS["scene"]
+    assert tokens.count_tokens(prompt) + max_tokens <= tokens.MAX_TOKENS
+    with pytest.raises(ValueError):
+        tokens.fit_prompt("Write a poem.", "poem")